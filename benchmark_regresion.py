@@ -0,0 +1,652 @@
+"""
+Benchmarks de la herramienta de regresión visual (no acceden al sandbox).
+
+- Estructuras DOM sintéticas (1k a 100k DIVs con inserciones, desplazamientos y redimensiones).
+- Capturas PNG sintéticas de distintas alturas (índice de teselas, marcado y guardado).
+- Snapshots binarios de la estructura DOM (escritura, apertura mapeada y tamaño frente al JSON).
+- Páginas HTML estáticas servidas en localhost y capturadas con Chrome headless (flujo completo).
+
+Los resultados se escriben en JSON para comparar corridas entre sí (--comparar-con).
+
+Uso:
+    python benchmark_regresion.py
+    python benchmark_regresion.py --tamanos 10000 50000 --repeticiones 5
+    python benchmark_regresion.py --captura-homepage reporte_regresion/Homepage_V170_base_....png
+    python benchmark_regresion.py --sin-chrome --salida bench.json --comparar-con bench_anterior.json
+"""
+
+import argparse
+import datetime
+import functools
+import http.server
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+import regre_visual_tn_desk_sbx as regresion
+
+# ---
+## Datos Sintéticos de Estructura DOM
+# ---
+
+def generar_estructura_sintetica(n_divs, semilla=0):
+    """
+    Genera una lista de dicts con `n_divs` DIVs en forma de árbol (selectores :nth-child reales),
+    con la misma forma que devuelve `obtener_estructura_dom` en su formato de filas.
+    """
+    rnd = random.Random(semilla)
+    data = []
+    pendientes = [('html > body', 0, 0.0)]
+    while pendientes and len(data) < n_divs:
+        padre, profundidad, y_base = pendientes.pop(0)
+        for nth in range(1, rnd.randint(2, 8) + 1):
+            if len(data) >= n_divs:
+                break
+            selector = f"{padre} > div" + (f":nth-child({nth})" if nth != 1 else "")
+            y = y_base + nth * rnd.uniform(20, 120)
+            data.append({
+                'selector': selector,
+                'id_attr': f"bloque-{len(data)}" if rnd.random() < 0.02 else '',
+                'class_attr': rnd.choice(['card', 'card card--big', 'col', 'row', 'ad-slot', '']),
+                'x': float(rnd.randint(0, 1200)),
+                'y': y,
+                'width': float(rnd.randint(20, 1920)),
+                'height': float(rnd.randint(20, 600)),
+            })
+            if profundidad < 12:
+                pendientes.append((selector, profundidad + 1, y))
+    return data
+
+def aplicar_cambios(data, proporcion_desplazados=0.05, proporcion_redimensionados=0.01, proporcion_eliminados=0.002,
+                    proporcion_insertados=0.0, semilla=1):
+    """
+    Copia de `data` con desplazamientos (X/Y), redimensiones (W/H), eliminaciones e inserciones
+    controladas. Cada inserción agrega un DIV hijo nuevo (sin hermanos previos del mismo camino)
+    justo después del elemento sorteado, como un banner o módulo agregado en V2.
+    """
+    rnd = random.Random(semilla)
+    resultado = []
+    for item in data:
+        r = rnd.random()
+        if r < proporcion_eliminados:
+            continue
+        nuevo = dict(item)
+        if r < proporcion_eliminados + proporcion_redimensionados:
+            nuevo['height'] += rnd.choice([-10, 4, 25])
+        elif r < proporcion_eliminados + proporcion_redimensionados + proporcion_desplazados:
+            nuevo['y'] += rnd.choice([-30, 8, 50])
+            if rnd.random() < 0.3:
+                nuevo['x'] += 2
+        resultado.append(nuevo)
+        if proporcion_insertados and rnd.random() < proporcion_insertados:
+            resultado.append(dict(item, selector=f"{item['selector']} > div:nth-child(99)", id_attr='', class_attr='insertado',
+                                  y=item['y'] + 10, height=float(rnd.randint(20, 250))))
+    return resultado
+
+def imagen_sintetica(alto=15000, ancho=1920, semilla=0):
+    """Imagen BGR tipo Homepage (fondo liso, bloques de imagen y líneas de texto)."""
+    rng = np.random.default_rng(semilla)
+    img = np.full((alto, ancho, 3), 245, dtype=np.uint8)
+    for y in range(80, alto - 400, 420):
+        for x in range(40, ancho - 440, 460):
+            img[y:y + 240, x:x + 420] = rng.integers(0, 256, (1, 1, 3), dtype=np.uint8) + rng.integers(0, 40, (240, 420, 1), dtype=np.uint8)
+            for linea in range(3):
+                largo = int(rng.integers(200, 420))
+                img[y + 260 + linea * 30:y + 276 + linea * 30, x:x + largo] = 30
+    return img
+
+def generar_captura_sintetica(alto=15000, ancho=1920, semilla=0):
+    """Captura sintética en bytes PNG, para cuando no se dispone de una captura real."""
+    return cv2.imencode('.png', imagen_sintetica(alto, ancho, semilla))[1].tobytes()
+
+def generar_captura_por_filas(ruta, alto, ancho=1920, semilla=0, filas_por_banda=2000):
+    """
+    Igual que `generar_captura_sintetica` pero escrita en disco por bandas con `EscritorPNGPorFilas`
+    (como las capturas por teselas), sin tener la página completa en memoria.
+    """
+    escritor = regresion.EscritorPNGPorFilas(ruta, ancho, alto)
+    for y_inicio in range(0, alto, filas_por_banda):
+        filas = min(filas_por_banda, alto - y_inicio)
+        escritor.agregar_filas(imagen_sintetica(filas + 400, ancho, semilla + y_inicio)[:filas])
+    return escritor.cerrar()
+
+def escribir_captura_por_filas(ruta, img, filas_por_banda=2000):
+    """Escribe una imagen BGR con `EscritorPNGPorFilas`, como las capturas por teselas."""
+    escritor = regresion.EscritorPNGPorFilas(ruta, img.shape[1], img.shape[0])
+    for y in range(0, img.shape[0], filas_por_banda):
+        escritor.agregar_filas(img[y:y + filas_por_banda])
+    return escritor.cerrar()
+
+def fallas_sinteticas(alto, ancho=1920, cantidad=200, semilla=0):
+    """Fallas con coordenadas repartidas en toda la captura (mezcla de graves, menores y visuales)."""
+    rnd = random.Random(semilla)
+    tipos = ('DIFERENCIA AGRUPADA GRAVE', 'DIFERENCIA AGRUPADA MENOR', 'DIFERENCIA VISUAL')
+    return [{'selector': f"html > body > div:nth-child({i})", 'tipo': rnd.choice(tipos),
+             'coords_v2': {'x': rnd.randint(0, ancho - 300), 'y': rnd.randint(0, alto - 300),
+                           'width': rnd.randint(20, 300), 'height': rnd.randint(20, 300)}}
+            for i in range(cantidad)]
+
+def generar_pagina_html(n_divs, semilla=0):
+    """
+    Página HTML estática con `n_divs` DIVs anidados de tamaño fijo (sin recursos externos), para
+    capturarla con el flujo completo de Selenium contra un servidor local.
+    """
+    rnd = random.Random(semilla)
+    partes = ["<!DOCTYPE html><html><head><meta charset='utf-8'><title>Benchmark</title>",
+              "<style>body{margin:0;font-family:Arial} div{box-sizing:border-box;padding:4px;border:1px solid #ddd}</style>",
+              "</head><body>"]
+    creados = 0
+    while creados < n_divs:
+        hijos = min(rnd.randint(3, 12), n_divs - creados - 1)
+        partes.append(f"<div class='seccion' style='background:#{rnd.randint(0, 0xffffff):06x}'>")
+        for h in range(hijos):
+            partes.append(f"<div class='card' style='height:{rnd.randint(40, 220)}px;width:{rnd.randint(20, 100)}%'>Bloque {creados + h}</div>")
+        partes.append("</div>")
+        creados += hijos + 1
+    partes.append("</body></html>")
+    return "".join(partes)
+
+@contextmanager
+def servidor_local(directorio):
+    """Sirve `directorio` por HTTP en 127.0.0.1 (puerto libre) mientras dura el bloque; devuelve la URL base."""
+    manejador = functools.partial(_ManejadorSilencioso, directory=directorio)
+    servidor = http.server.ThreadingHTTPServer(('127.0.0.1', 0), manejador)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    try:
+        yield f"http://127.0.0.1:{servidor.server_address[1]}"
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+class _ManejadorSilencioso(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, formato, *args):
+        pass
+
+def modificar_captura(png, semilla=1):
+    """Copia de la captura con un único cambio chico de color (como un botón que cambió de tono)."""
+    img = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+    rng = np.random.default_rng(semilla)
+    y, x = int(rng.integers(0, img.shape[0] - 60)), int(rng.integers(0, img.shape[1] - 200))
+    img[y:y + 40, x:x + 160] = (0, 0, 200)
+    return cv2.imencode('.png', img)[1].tobytes()
+
+# ---
+## Referencia: Comparación Original (Bucle Python)
+# ---
+
+def comparar_estructura_dom_referencia(data_v1, data_v2, umbral_pixeles):
+    """
+    Implementación original (bucle Python elemento por elemento) de `comparar_estructura_dom`.
+    Se conserva como referencia de resultados y de tiempos. Recibe listas de dicts.
+    """
+    v2_map = {item['selector']: item for item in data_v2 if item['selector'] is not None}
+    
+    # Diccionario para agrupar fallas por selector
+    errores_agrupados = {}
+    
+    # Función de ayuda para añadir una falla a la agrupación
+    def add_falla(selector, tipo, diff, v1, v2, coords_v2):
+        # Asegurarse de que los valores sean números antes de formatear
+        v1_val = v1 if isinstance(v1, (int, float)) else 0
+        v2_val = v2 if isinstance(v2, (int, float)) else 0
+        
+        # Inicialización de la entrada (gravedad inicial: 'menor')
+        if selector not in errores_agrupados:
+            errores_agrupados[selector] = {
+                'selector': selector,
+                'tipos': [],
+                'coords_v2': coords_v2,
+                'cambio_dimension': 0, # Nuevo contador
+                'cambio_posicion': 0,  # Nuevo contador
+                'gravedad': 'menor' 
+            }
+        
+        # Añadir el detalle de la falla (con formato condicional para N/A)
+        v1_display = f"{v1:.2f}" if isinstance(v1, (int, float)) else str(v1)
+        v2_display = f"{v2:.2f}" if isinstance(v2, (int, float)) else str(v2)
+        diff_display = f"{diff:.2f}px" if isinstance(diff, (int, float)) else str(diff)
+
+        detalle = f"Tipo: <b>{tipo}</b> | V1: {v1_display} | V2: {v2_display} | Diff: {diff_display}"
+        errores_agrupados[selector]['tipos'].append(detalle)
+        
+        # Actualización de contadores de cambios
+        if 'ALTURA (H)' in tipo or 'ANCHO (W)' in tipo:
+             errores_agrupados[selector]['cambio_dimension'] += 1
+        elif 'POSICIÓN (Y)' in tipo or 'POSICIÓN (X)' in tipo:
+             errores_agrupados[selector]['cambio_posicion'] += 1
+        
+        # Fallas de existencia son siempre graves
+        if tipo in ['AUSENTE V2', 'NUEVO EN V2']:
+            errores_agrupados[selector]['gravedad'] = 'grave'
+
+
+    for item1 in data_v1:
+        selector = item1['selector']
+        
+        if selector in v2_map and selector is not None:
+            item2 = v2_map[selector]
+            
+            # 1. ALTURA (H)
+            diff_height = abs(item1['height'] - item2['height'])
+            if diff_height > umbral_pixeles:
+                add_falla(selector, 'DIFERENCIA ALTURA (H)', diff_height, item1['height'], item2['height'], item2)
+
+            # 2. POSICIÓN Y
+            diff_y = abs(item1['y'] - item2['y'])
+            if diff_y > umbral_pixeles:
+                 add_falla(selector, 'DIFERENCIA POSICIÓN (Y)', diff_y, item1['y'], item2['y'], item2)
+            
+            # 3. ANCHO (W)
+            diff_width = abs(item1['width'] - item2['width'])
+            if diff_width > umbral_pixeles:
+                add_falla(selector, 'DIFERENCIA ANCHO (W)', diff_width, item1['width'], item2['width'], item2)
+            
+            # 4. POSICIÓN X
+            diff_x = abs(item1['x'] - item2['x'])
+            if diff_x > umbral_pixeles:
+                 add_falla(selector, 'DIFERENCIA POSICIÓN (X)', diff_x, item1['x'], item2['x'], item2)
+        
+        elif selector not in ['ERROR', 'FATAL ERROR'] and selector is not None:
+            # 5. Elemento presente en V1, ausente en V2 (FALLA GRAVE)
+             coords_v1_for_mark = {'x': item1['x'], 'y': item1['y'], 'width': item1['width'], 'height': item1['height']} 
+             add_falla(selector, 'AUSENTE V2', "N/A", "N/A", "N/A", coords_v1_for_mark)
+            
+    # 6. Elementos en V2 que no están en V1 (FALLA GRAVE)
+    v1_selectors = set(item['selector'] for item in data_v1 if item['selector'] is not None)
+    for item2 in data_v2:
+        selector = item2['selector']
+        if selector not in v1_selectors and selector not in ['ERROR', 'FATAL ERROR'] and selector is not None:
+            coords_v2_for_mark = {'x': item2['x'], 'y': item2['y'], 'width': item2['width'], 'height': item2['height']} 
+            add_falla(selector, 'NUEVO EN V2', "N/A", "N/A", "N/A", coords_v2_for_mark)
+
+    # 7. CONSOLIDACIÓN FINAL Y CLASIFICACIÓN DE GRAVEDAD
+    fallas_final = []
+    selectores_fallidos = []
+    
+    for selector, data in errores_agrupados.items():
+        
+        # *** LÓGICA DE CLASIFICACIÓN REFINADA ***
+        # Si ya se marcó como 'grave' (p. ej. por Ausente/Nuevo) O si cambió W o H, ES GRAVE.
+        if data['gravedad'] == 'grave' or data['cambio_dimension'] > 0:
+            data['gravedad'] = 'grave'
+        # Si NO cambió W ni H, pero sí cambió X y/o Y, es MENOR (Efecto Dominó).
+        elif data['cambio_posicion'] > 0:
+            data['gravedad'] = 'menor'
+        else:
+             # Si no hay cambios significativos, se podría omitir, 
+             # pero por seguridad, mantenemos el menor si entró en el bucle
+             data['gravedad'] = 'menor'
+        # *************************************************
+
+        descripcion_consolidada = "<div style='margin-top: 5px; border-left: 2px solid #ccc; padding-left: 5px;'>"+ "<br>".join(data['tipos']) + "</div>"
+        
+        # Usar el resultado de la lógica refinada
+        tipo_marcado = 'DIFERENCIA AGRUPADA GRAVE' if data['gravedad'] == 'grave' else 'DIFERENCIA AGRUPADA MENOR'
+        
+        fallas_final.append({
+            'selector': selector,
+            'tipo': tipo_marcado, 
+            'diff': 1, 
+            'v1': "Consolidado", 
+            'v2': descripcion_consolidada, 
+            'coords_v2': data['coords_v2']
+        })
+        selectores_fallidos.append(selector)
+
+    return fallas_final, selectores_fallidos
+
+# ---
+## Benchmarks
+# ---
+
+def _resumen_falla(f, detalle):
+    """Lo que la implementación original reporta de una falla: selector, tipo, caja en V2 y detalle HTML."""
+    return f['selector'], f['tipo'], {k: f['coords_v2'][k] for k in ('x', 'y', 'width', 'height')}, detalle
+
+def _medir(funcion, repeticiones):
+    """Mejor tiempo (segundos) de `repeticiones` ejecuciones y el último resultado."""
+    mejor = float('inf')
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+def bench_comparacion(tamanos, repeticiones):
+    """
+    Compara la implementación vectorizada (alineación por selector) contra la original y verifica
+    que el resultado sea idéntico. También mide el costo de la alineación estructural de árboles.
+    V2 tiene desplazamientos, redimensiones, eliminaciones e inserciones controladas.
+    """
+    print("\n🔍 comparar_estructura_dom (vectorizado NumPy) vs. bucle original")
+    print(f"  {'DIVs':>8} | {'fallas':>7} | {'original':>10} | {'numpy':>10} | {'speedup':>7} | {'numpy + árbol':>13}")
+    filas = []
+    for n in tamanos:
+        data_v1 = generar_estructura_sintetica(n, semilla=n)
+        data_v2 = aplicar_cambios(data_v1, proporcion_insertados=0.002, semilla=n + 1)
+        columnar_v1 = regresion.normalizar_estructura(data_v1)
+        columnar_v2 = regresion.normalizar_estructura(data_v2)
+
+        # Una ejecución sin medir de cada variante: la primera paga inicializaciones únicas
+        # (imports diferidos, cachés de NumPy) que distorsionan el speedup del primer tamaño.
+        comparar_estructura_dom_referencia(data_v1, data_v2, 0)
+        for estructural in (False, True):
+            regresion.comparar_estructura_dom(columnar_v1, columnar_v2, 0, alineacion_estructural=estructural)
+
+        t_ref, esperado = _medir(lambda: comparar_estructura_dom_referencia(data_v1, data_v2, 0), repeticiones)
+        t_np, obtenido = _medir(lambda: regresion.comparar_estructura_dom(columnar_v1, columnar_v2, 0, alineacion_estructural=False), repeticiones)
+
+        t_arbol, _ = _medir(lambda: regresion.comparar_estructura_dom(columnar_v1, columnar_v2, 0, alineacion_estructural=True), repeticiones)
+
+        # El detalle HTML que la versión original arma al comparar ahora sale de los cambios estructurados
+        resumen_esperado = [_resumen_falla(f, f['v2']) for f in esperado[0]]
+        resumen_obtenido = [_resumen_falla(f, regresion.detalle_falla_html(f)) for f in obtenido[0]]
+        if (resumen_obtenido, obtenido[1]) != (resumen_esperado, esperado[1]):
+            raise AssertionError(f"El resultado vectorizado difiere del original para {n} DIVs.")
+        print(f"  {n:>8} | {len(esperado[0]):>7} | {t_ref * 1000:>8.1f}ms | {t_np * 1000:>8.1f}ms | {t_ref / t_np:>6.1f}x | {t_arbol * 1000:>11.1f}ms")
+        filas.append({'caso': f"{n} divs", 'divs': n, 'fallas': len(esperado[0]),
+                      'original_ms': t_ref * 1000, 'numpy_ms': t_np * 1000, 'arbol_ms': t_arbol * 1000})
+    return filas
+
+def bench_indice_teselas(ruta_captura, repeticiones):
+    """
+    Diferencia de píxeles sobre una captura completa de la Homepage con y sin índice de teselas:
+    par idéntico (caso típico de páginas sin cambios), par con un cambio chico (con y sin el costo
+    de decodificar los PNG) y par por teselas en disco con un cambio en la parte superior (la
+    lectura se corta después de la última tesela distinta). Verifica que ambos caminos devuelvan
+    las mismas regiones.
+    """
+    if ruta_captura:
+        with open(ruta_captura, 'rb') as f:
+            png_v1 = f.read()
+        origen = ruta_captura
+    else:
+        png_v1 = generar_captura_sintetica()
+        origen = "captura sintética"
+    png_v2 = modificar_captura(png_v1)
+    alto, ancho = cv2.imdecode(np.frombuffer(png_v1, np.uint8), cv2.IMREAD_GRAYSCALE).shape
+
+    print(f"\n🧮 Índice de teselas ({regresion.DIFF_PIXELES_TESELA}px) sobre {origen} ({ancho}x{alto})")
+    t_indice, indice_v1 = _medir(lambda: regresion.construir_indice_teselas(png_v1), repeticiones)
+    indice_v2 = regresion.construir_indice_teselas(png_v2)
+    print(f"  Construcción del índice (al capturar): {t_indice * 1000:>8.1f}ms")
+    filas = [{'caso': 'construcción', 'alto': alto, 'indice_ms': t_indice * 1000}]
+
+    img_v1 = cv2.imdecode(np.frombuffer(png_v1, np.uint8), cv2.IMREAD_COLOR)
+    img_v2 = cv2.imdecode(np.frombuffer(png_v2, np.uint8), cv2.IMREAD_COLOR)
+    directorio = tempfile.mkdtemp()
+    ruta_v1 = os.path.join(directorio, 'v1.png')
+    ruta_v2 = os.path.join(directorio, 'v2.png')
+    escribir_captura_por_filas(ruta_v1, img_v1)
+    img_arriba = img_v1.copy()
+    img_arriba[400:440, 300:460] = (0, 0, 200)
+    escribir_captura_por_filas(ruta_v2, img_arriba)
+    indices_disco = (regresion.construir_indice_teselas(ruta_v1), regresion.construir_indice_teselas(ruta_v2))
+
+    print(f"  {'par':>23} | {'sin índice':>11} | {'con índice':>11} | {'speedup':>7} | {'teselas distintas':>17}")
+    for nombre, a, b, indices in (('idéntico', png_v1, png_v1, (indice_v1, indice_v1)),
+                                  ('1 cambio', png_v1, png_v2, (indice_v1, indice_v2)),
+                                  ('1 cambio, decodificadas', img_v1, img_v2, (indice_v1, indice_v2)),
+                                  ('1 cambio arriba, disco', ruta_v1, ruta_v2, indices_disco)):
+        t_sin, esperado = _medir(lambda: regresion.diferencia_visual_pixeles(a, b), repeticiones)
+        t_con, obtenido = _medir(lambda: regresion.diferencia_visual_pixeles(a, b, indices=indices), repeticiones)
+        if obtenido != esperado:
+            raise AssertionError(f"El diff con índice difiere del diff completo (par {nombre}).")
+        distintas = regresion.teselas_distintas(*indices)
+        print(f"  {nombre:>23} | {t_sin * 1000:>9.1f}ms | {t_con * 1000:>9.1f}ms | {t_sin / t_con:>6.1f}x | {int(distintas.sum()):>8}/{distintas.size}")
+        filas.append({'caso': f"par {nombre}", 'sin_indice_ms': t_sin * 1000, 'con_indice_ms': t_con * 1000,
+                      'teselas_distintas': int(distintas.sum()), 'teselas': int(distintas.size)})
+    shutil.rmtree(directorio, ignore_errors=True)
+    return filas
+
+def _render_fallas_referencia(fallas, filas_v2, url_id):
+    """
+    Render original: busca cada selector recorriendo todas las filas de V2 (cuadrático). Los
+    ausentes en V2 no muestran atributos de V2 aunque otro DIV reubicado tenga su selector.
+    """
+    items = []
+    for i, f in enumerate(fallas):
+        ausente = any(cambio['tipo'] == 'AUSENTE V2' for cambio in f['cambios'])
+        item_v2 = None if ausente else next((item for item in filas_v2 if item['selector'] == f['selector']), None)
+        atributos = {'id_attr': item_v2['id_attr'], 'class_attr': item_v2['class_attr']} if item_v2 else None
+        items.append(regresion.render_falla_html(dict(f, atributos_v2=atributos), i, url_id))
+    return items
+
+def bench_render_reporte(n_divs, repeticiones):
+    """
+    Arma la lista de diferencias del reporte para una página sintética de `n_divs` DIVs con los
+    atributos de V2 que viajan en cada falla, y verifica que el HTML sea idéntico al de la
+    búsqueda lineal original por selector, con alineación por selector y estructural (donde el
+    selector de un DIV ausente puede pertenecer a otro DIV de V2 reubicado).
+    """
+    data_v1 = generar_estructura_sintetica(n_divs, semilla=n_divs)
+    data_v2 = aplicar_cambios(data_v1, semilla=n_divs + 1)
+    selectores_v2 = {item['selector'] for item in data_v2}
+    url_id = "Sintetica"
+    filas = []
+
+    for estructural in (False, True):
+        fallas, _ = regresion.comparar_estructura_dom(regresion.normalizar_estructura(data_v1),
+                                                      regresion.normalizar_estructura(data_v2), 0,
+                                                      alineacion_estructural=estructural)
+        ausentes_reubicados = sum(1 for f in fallas if f['selector'] in selectores_v2
+                                  and any(cambio['tipo'] == 'AUSENTE V2' for cambio in f['cambios']))
+        alineacion = 'estructural' if estructural else 'por selector'
+
+        print(f"\n🧾 Lista de diferencias del reporte ({n_divs} DIVs, alineación {alineacion}, {len(fallas)} fallas, "
+              f"{ausentes_reubicados} ausentes con selector reutilizado en V2)")
+        directorio_original = regresion.output_dir
+        with tempfile.TemporaryDirectory() as directorio:
+            regresion.output_dir = directorio
+            try:
+                t_ref, esperado = _medir(lambda: _render_fallas_referencia(fallas, data_v2, url_id), 1)
+                t_nuevo, (html, fragmento) = _medir(lambda: regresion.escribir_fallas_html(fallas, url_id, "fallas/bench.js"), repeticiones)
+                obtenido = [regresion.render_falla_html(f, i, url_id) for i, f in enumerate(fallas)]
+                tamano_fragmento = os.path.getsize(os.path.join(directorio, fragmento)) if fragmento else 0
+            finally:
+                regresion.output_dir = directorio_original
+        if obtenido != esperado:
+            raise AssertionError(f"El render con atributos en la falla difiere del original para {n_divs} DIVs (alineación {alineacion}).")
+        print(f"  búsqueda lineal por falla: {t_ref * 1000:>9.1f}ms")
+        print(f"  atributos en la falla:     {t_nuevo * 1000:>9.1f}ms ({t_ref / t_nuevo:.1f}x, fragmento {tamano_fragmento / 1024:.0f} KB)")
+        filas.append({'caso': f"{n_divs} divs, alineación {alineacion}", 'fallas': len(fallas),
+                      'ausentes_reubicados': ausentes_reubicados, 'busqueda_lineal_ms': t_ref * 1000,
+                      'render_ms': t_nuevo * 1000, 'fragmento_bytes': tamano_fragmento})
+    return filas
+
+def bench_snapshot_dom(tamanos, repeticiones):
+    """
+    Snapshot binario de la estructura DOM frente al JSON de la misma estructura: escritura,
+    apertura (mapeo en memoria), reconstrucción de la estructura columnar y tamaño en disco.
+    Verifica que la estructura reconstruida sea la original (geometría con precisión float32).
+    """
+    print("\n🗜️ guardar_snapshot_dom / cargar_snapshot_dom vs JSON")
+    print(f"  {'divs':>7} | {'JSON':>9} | {'snapshot':>9} | {'escritura':>9} | {'apertura':>8} | {'estructura':>10} | {'json.loads':>10}")
+    filas = []
+    with tempfile.TemporaryDirectory() as directorio:
+        for n in tamanos:
+            data = regresion.normalizar_estructura(generar_estructura_sintetica(n, semilla=n))
+            ruta = os.path.join(directorio, f"{n}.dom.snap")
+            texto = json.dumps(data)
+            t_escritura, _ = _medir(lambda: regresion.guardar_snapshot_dom(data, ruta), repeticiones)
+            t_apertura, snapshot = _medir(lambda: regresion.cargar_snapshot_dom(ruta), repeticiones)
+            t_estructura, obtenida = _medir(lambda: regresion.cargar_snapshot_dom(ruta).estructura(), repeticiones)
+            t_json, _ = _medir(lambda: json.loads(texto), repeticiones)
+            if (obtenida['selector'] != data['selector'] or obtenida['id_attr'] != data['id_attr'] or obtenida['class_attr'] != data['class_attr']
+                    or not all(np.allclose(obtenida[c], data[c], rtol=1e-6, atol=1e-3) for c in ('x', 'y', 'width', 'height'))):
+                raise AssertionError(f"El snapshot de {n} DIVs no reconstruye la estructura original.")
+            tamano = os.path.getsize(ruta)
+            print(f"  {n:>7} | {len(texto) / 1024:>6.0f} KB | {tamano / 1024:>6.0f} KB | {t_escritura * 1000:>7.1f}ms | "
+                  f"{t_apertura * 1000:>6.2f}ms | {t_estructura * 1000:>8.1f}ms | {t_json * 1000:>8.1f}ms")
+            filas.append({'caso': f"{n} divs", 'json_bytes': len(texto), 'snapshot_bytes': tamano, 'escritura_ms': t_escritura * 1000,
+                          'apertura_ms': t_apertura * 1000, 'estructura_ms': t_estructura * 1000, 'json_loads_ms': t_json * 1000})
+            del snapshot
+    return filas
+
+def bench_marcado_y_guardado(alturas, repeticiones, cantidad_fallas=200):
+    """
+    Marcado de fallas y guardado de la captura V2 para capturas sintéticas de distintas alturas:
+    en memoria (decodificar, dibujar, codificar en FORMATO_CAPTURA_MARCADA) y en disco por bandas
+    (como las capturas por teselas). Verifica que ambos caminos dibujen lo mismo.
+    """
+    print(f"\n🖍️ marcar_fallas_en_captura + guardado ({cantidad_fallas} fallas, formato {regresion.FORMATO_CAPTURA_MARCADA})")
+    print(f"  {'alto':>7} | {'PNG':>8} | {'marcado memoria':>15} | {'marcado bandas':>14} | {'guardado':>9}")
+    filas = []
+    directorio_original = regresion.DIRECTORIO_TEMPORAL
+    with tempfile.TemporaryDirectory() as directorio:
+        regresion.DIRECTORIO_TEMPORAL = directorio
+        try:
+            for alto in alturas:
+                ruta_png = generar_captura_por_filas(os.path.join(directorio, f"captura_{alto}.png"), alto)
+                with open(ruta_png, 'rb') as f:
+                    png = f.read()
+                fallas = fallas_sinteticas(alto, semilla=alto)
+
+                t_memoria, marcada = _medir(lambda: regresion.marcar_fallas_en_captura(png, fallas, None), repeticiones)
+                marcadas_en_disco = []
+                t_bandas, _ = _medir(lambda: marcadas_en_disco.append(regresion.marcar_fallas_en_captura(ruta_png, fallas, None)), repeticiones)
+
+                img_memoria = cv2.imdecode(np.frombuffer(marcada, np.uint8), cv2.IMREAD_COLOR)
+                if regresion.FORMATO_CAPTURA_MARCADA == 'png' and not np.array_equal(img_memoria, cv2.imread(marcadas_en_disco[-1], cv2.IMREAD_COLOR)):
+                    raise AssertionError(f"El marcado por bandas difiere del marcado en memoria ({alto}px).")
+
+                destino = os.path.join(directorio, f"reporte_{alto}.{regresion.extension_imagen(marcada)}")
+                t_guardado, _ = _medir(lambda: regresion.guardar_captura(marcada, destino), repeticiones)
+                for ruta in marcadas_en_disco:
+                    regresion.descartar_captura_temporal(ruta)
+
+                print(f"  {alto:>7} | {len(png) / 1024 / 1024:>6.1f}MB | {t_memoria * 1000:>13.1f}ms | {t_bandas * 1000:>12.1f}ms | {t_guardado * 1000:>7.1f}ms")
+                filas.append({'caso': f"{alto}px", 'alto': alto, 'png_bytes': len(png), 'marcada_bytes': len(marcada),
+                              'marcado_memoria_ms': t_memoria * 1000, 'marcado_bandas_ms': t_bandas * 1000,
+                              'guardado_ms': t_guardado * 1000})
+        finally:
+            regresion.DIRECTORIO_TEMPORAL = directorio_original
+    return filas
+
+def bench_captura_local(tamanos, repeticiones):
+    """
+    Flujo completo de `ejecutar_selenium_para_estructura` (navegación, limpieza, estabilización,
+    extracción y captura) con Chrome headless sobre páginas estáticas servidas en localhost.
+    Devuelve los tiempos por fase medidos por el propio script. Si Chrome no está disponible,
+    se informa y se omite.
+    """
+    print("\n🌐 Captura completa con Chrome headless sobre páginas locales")
+    filas = []
+    with tempfile.TemporaryDirectory() as directorio:
+        for n in tamanos:
+            with open(os.path.join(directorio, f"pagina_{n}.html"), 'w', encoding='utf-8') as f:
+                f.write(generar_pagina_html(n, semilla=n))
+
+        pool = regresion.PoolDrivers(1)
+        try:
+            with servidor_local(directorio) as url_base:
+                for n in tamanos:
+                    mejor = None
+                    for _ in range(repeticiones):
+                        metricas = {}
+                        inicio = time.perf_counter()
+                        data, png = regresion.ejecutar_selenium_para_estructura(f"{url_base}/pagina_{n}.html", f"bench {n}", pool, metricas)
+                        segundos = time.perf_counter() - inicio
+                        if regresion.estructura_tiene_error(data):
+                            print("  ⚠️ No se pudo capturar con Chrome headless (¿Chrome/chromedriver instalados?): se omite.")
+                            return filas
+                        if mejor is None or segundos < mejor[0]:
+                            mejor = (segundos, data, png, metricas)
+                    segundos, data, png, metricas = mejor
+                    regresion.descartar_captura_temporal(png)
+                    fases = {}
+                    for span in metricas.get('fases', []):
+                        fases[span['fase']] = fases.get(span['fase'], 0.0) + span['duracion_s'] * 1000
+                    print(f"  {n:>6} DIVs -> {segundos:.2f}s ({len(data['selector'])} DIVs extraídos, "
+                          f"WebDriver {regresion.format_bytes(metricas.get('webdriver_bytes'))})")
+                    print("         " + " | ".join(f"{fase}: {ms:.0f}ms" for fase, ms in fases.items()))
+                    filas.append({'caso': f"{n} divs", 'divs': n, 'divs_extraidos': len(data['selector']),
+                                  'total_ms': segundos * 1000, 'webdriver_bytes': metricas.get('webdriver_bytes'),
+                                  **{f"{fase}_ms": ms for fase, ms in fases.items()}})
+        finally:
+            pool.cerrar()
+    return filas
+
+def _metricas_planas(resultados):
+    """{'bench/caso/metrica_ms': valor} de todas las métricas de tiempo de una corrida."""
+    planas = {}
+    for bench, filas in resultados.items():
+        for fila in filas:
+            for clave, valor in fila.items():
+                if clave.endswith('_ms'):
+                    planas[f"{bench}/{fila['caso']}/{clave}"] = valor
+    return planas
+
+def comparar_con_anterior(resultados, ruta_anterior, tolerancia=0.2):
+    """Lista las métricas que empeoraron más de `tolerancia` respecto de una corrida anterior."""
+    with open(ruta_anterior, 'r', encoding='utf-8') as f:
+        anteriores = _metricas_planas(json.load(f)['resultados'])
+    actuales = _metricas_planas(resultados)
+    comunes = sorted(set(anteriores) & set(actuales))
+    peores = [(clave, anteriores[clave], actuales[clave]) for clave in comunes
+              if anteriores[clave] > 0 and actuales[clave] > anteriores[clave] * (1 + tolerancia)]
+
+    print(f"\n📊 Comparación con {ruta_anterior} ({len(comunes)} métricas en común, tolerancia {tolerancia:.0%})")
+    for clave, antes, ahora in peores:
+        print(f"  🔴 {clave}: {antes:.1f}ms -> {ahora:.1f}ms ({ahora / antes:.2f}x)")
+    if not peores:
+        print("  ✅ Sin regresiones de velocidad.")
+    return peores
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de la regresión visual (offline).")
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 10000, 50000, 100000],
+                        help="Cantidad de DIVs de las estructuras sintéticas.")
+    parser.add_argument('--repeticiones', type=int, default=3, help="Repeticiones por medición (se toma la mejor).")
+    parser.add_argument('--divs-reporte', type=int, default=20000,
+                        help="Cantidad de DIVs de la página sintética del benchmark del reporte.")
+    parser.add_argument('--captura-homepage', default=None,
+                        help="PNG de página completa de la Homepage (p. ej. de un reporte anterior); por defecto se genera una sintética.")
+    parser.add_argument('--alturas', type=int, nargs='+', default=[5000, 15000, 30000],
+                        help="Alturas (px) de las capturas sintéticas para el marcado y el guardado.")
+    parser.add_argument('--divs-paginas', type=int, nargs='+', default=[1000, 5000],
+                        help="Cantidad de DIVs de las páginas locales capturadas con Chrome.")
+    parser.add_argument('--sin-chrome', action='store_true',
+                        help="No correr la captura completa con Chrome headless sobre páginas locales.")
+    parser.add_argument('--salida', default="benchmark_regresion.json",
+                        help="Archivo JSON donde se escriben los resultados.")
+    parser.add_argument('--comparar-con', default=None, metavar='ANTERIOR.json',
+                        help="Resultados de una corrida anterior: se listan las métricas que empeoraron.")
+    parser.add_argument('--tolerancia', type=float, default=0.2,
+                        help="Empeoramiento relativo tolerado al comparar con una corrida anterior (por defecto 0.2 = 20%%).")
+    args = parser.parse_args()
+
+    resultados = {
+        'comparacion': bench_comparacion(args.tamanos, args.repeticiones),
+        'indice_teselas': bench_indice_teselas(args.captura_homepage, args.repeticiones),
+        'render_reporte': bench_render_reporte(args.divs_reporte, args.repeticiones),
+        'marcado_guardado': bench_marcado_y_guardado(args.alturas, args.repeticiones),
+        'snapshot_dom': bench_snapshot_dom(args.tamanos, args.repeticiones),
+    }
+    if not args.sin_chrome:
+        resultados['captura_local'] = bench_captura_local(args.divs_paginas, 1)
+
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump({
+            'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'parametros': vars(args),
+            'resultados': resultados,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Resultados en {args.salida}")
+
+    if args.comparar_con:
+        comparar_con_anterior(resultados, args.comparar_con, args.tolerancia)
@@ -4,9 +4,34 @@ import numpy as np
 import time
 import datetime
 import re
-import io
 import sys 
-from PIL import Image
+import argparse
+import asyncio
+import base64
+import difflib
+import hashlib
+import itertools
+import json
+import queue
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+import websocket
+import zlib
+try:
+    import resource  # No existe en Windows: ahí el pico de RSS queda sin medir
+except ImportError:
+    resource = None
+try:
+    import websockets  # Solo lo usa el backend de captura CDP asíncrono (--backend cdp); está en requirements.txt
+except ImportError:
+    websockets = None
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
@@ -22,6 +47,101 @@ os.makedirs(output_dir, exist_ok=True)
 # Se usa para la posición X, Y y la dimensión W, H.
 UMBRAL_PIXELES_TOLERANCIA = 0 
 
+# Matriz de páginas a testear (URL, descripción, plantilla, viewports, umbrales y máscaras por página).
+# Se puede sobrescribir con el argumento --config.
+ARCHIVO_PAGINAS = "paginas_regresion.json"
+
+# Cantidad máxima de navegadores Chrome headless ejecutándose en simultáneo.
+# Se puede sobrescribir con el argumento --workers.
+MAX_WORKERS_CHROME = 4
+
+# Tamaño de ventana (viewport) por defecto de cada sesión de Chrome (la matriz puede pedir otros;
+# la sesión se redimensiona antes de cada captura).
+VENTANA_ANCHO = 1920
+VENTANA_ALTO = 1080
+
+# Backend de captura: 'selenium' (una sesión WebDriver por hilo, comandos bloqueantes) o 'cdp'
+# (Chrome DevTools Protocol asíncrono: un solo Chrome y un event loop que maneja varias pestañas;
+# requiere el paquete `websockets`). Se puede sobrescribir con el argumento --backend.
+BACKENDS_CAPTURA = ('selenium', 'cdp')
+BACKEND_CAPTURA = 'selenium'
+# Modo pareado (solo backend 'cdp'): V1 y V2 de cada página se abren en dos pestañas del mismo
+# Chrome que cargan y se estabilizan a la vez, y se extraen/capturan en el mismo punto.
+# Se puede sobrescribir con el argumento --pareada.
+CAPTURA_PAREADA = False
+# Binario de Chrome para el backend CDP (None: variable CHROME_BIN o el primero que aparezca en el PATH)
+CHROME_BINARIO = None
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# Espera adaptativa de estabilización ("layout settled"): la página se considera estable
+# cuando pasa una ventana de silencio sin mutaciones del DOM, sin cargas de red/imágenes
+# pendientes y sin cambios en document.body.scrollHeight. El tope evita esperas infinitas.
+ESTABILIZACION_VENTANA_QUIETA_MS = 1500
+ESTABILIZACION_TOPE_S = 20
+
+# Modo de navegación de cada captura (se puede sobrescribir con --recarga):
+#   'ninguna'        -> UNA sola navegación (por defecto).
+#   'cache_caliente' -> navega, y recarga para medir con la caché HTTP ya caliente.
+#   'sin_cache'      -> deshabilita la caché vía CDP (Network.setCacheDisabled) y navega una vez.
+MODOS_RECARGA = ('ninguna', 'cache_caliente', 'sin_cache')
+MODO_RECARGA = 'ninguna'
+
+# Formato de la captura V2 marcada (se codifica UNA sola vez): 'png' (sin pérdida) o 'webp'/'avif'
+# (más livianas para el reporte). Si el formato no admite la altura de la página, se usa PNG.
+FORMATOS_CAPTURA_MARCADA = ('png', 'webp', 'avif')
+FORMATO_CAPTURA_MARCADA = 'png'
+PNG_NIVEL_COMPRESION = 3 # 0 (rápido, más grande) a 9 (lento, más chico)
+CALIDAD_WEBP = 90
+CALIDAD_AVIF = 80
+
+# Modo de captura de pantalla (se puede sobrescribir con --captura):
+#   'completa' -> agranda la ventana al alto total de la página y toma una sola captura.
+#   'teselas'  -> captura de a un viewport con scroll y escribe el PNG por filas en disco
+#                 (memoria acotada sin importar el alto de la página).
+#   'auto'     -> 'teselas' solo si la página supera ALTURA_MAX_CAPTURA_COMPLETA píxeles.
+MODOS_CAPTURA = ('auto', 'completa', 'teselas')
+MODO_CAPTURA = 'auto'
+ALTURA_MAX_CAPTURA_COMPLETA = 10000
+
+# Bloqueo de red (CDP Network.setBlockedURLs): anuncios, trackers, players de video y fuentes de
+# terceros dominan el tiempo de carga y agregan ruido de layout entre V1 y V2. --sin-bloqueo-red lo desactiva.
+BLOQUEO_RED_HABILITADO = True
+PATRONES_BLOQUEADOS = [
+    '*doubleclick.net*', '*googlesyndication.com*', '*googleadservices.com*', '*adservice.google.*',
+    '*amazon-adsystem.com*', '*google-analytics.com*', '*googletagmanager.com*', '*scorecardresearch.com*',
+    '*chartbeat.com*', '*chartbeat.net*', '*facebook.net*', '*connect.facebook.com*', '*hotjar.com*',
+    '*onesignal.com*', '*taboola.com*', '*outbrain.com*', '*jwplayer.com*', '*jwpcdn.com*',
+    '*fonts.googleapis.com*', '*fonts.gstatic.com*',
+]
+
+# Grabación/reproducción de respuestas propias con CDP Fetch (se puede sobrescribir con --grabacion):
+#   'grabar'     -> guarda en DIRECTORIO_GRABACION las respuestas del host de la página y DOMINIOS_GRABABLES.
+#   'reproducir' -> sirve las respuestas grabadas; con REPRODUCCION_ESTRICTA lo no grabado falla
+#                   (corrida offline y repetible contra un snapshot grabado).
+MODOS_GRABACION = ('desactivada', 'grabar', 'reproducir')
+MODO_GRABACION = 'desactivada'
+DOMINIOS_GRABABLES = []
+REPRODUCCION_ESTRICTA = True
+
+# Modo incremental (--incremental): se omiten las páginas cuyas variantes V1 y V2 sirven los mismos
+# bundles JS/CSS y se reutiliza su último resultado (guardado en CACHE_DIR/resultados).
+MODO_INCREMENTAL = False
+
+# Caché persistente de capturas base (V2, sin versión) entre ejecuciones (desactivable con --sin-cache-base).
+# Se invalida por huella del contenido servido, antigüedad y tamaño total del directorio.
+CACHE_DIR = ".cache_regresion"
+# Archivos temporales (capturas por teselas); se mueven al reporte o se borran al procesar cada página
+DIRECTORIO_TEMPORAL = os.path.join(CACHE_DIR, 'tmp')
+DIRECTORIO_GRABACION = os.path.join(CACHE_DIR, 'grabacion')
+CACHE_BASE_HABILITADA = True
+CACHE_BASE_MAX_EDAD_H = 12
+CACHE_BASE_MAX_MB = 500
+# Incrementar si cambia el formato de la estructura/captura guardada (invalida la caché anterior)
+VERSION_FORMATO_CACHE = 1
+# Incrementar si cambia el formato de los resultados por página (NDJSON de la corrida e historial incremental)
+VERSION_FORMATO_RESULTADOS = 3
+
 # Lista de IDs/Clases de contenedores de anuncios para neutralizar (OCULTAR).
 AD_CONTAINER_IDS = [
     'ad-slot-header', 'parent-ad-slot-header', 'parent-ad-slot-caja', 
@@ -34,6 +154,33 @@ AD_CONTAINER_IDS = [
     'banner-container',
 ]
 
+# Neutralización de popups inyectada con CDP antes de los scripts de la página (--sin-neutralizacion
+# vuelve a los barridos de `limpiar_entorno_robusto`). Con RESERVAR_CAJAS_ADS (--reservar-ads) cada
+# contenedor de AD_CONTAINER_IDS ocupa una caja fija, sin importar qué anuncio se sirvió.
+NEUTRALIZACION_INYECTADA = True
+RESERVAR_CAJAS_ADS = False
+TAMANO_CAJA_AD_POR_DEFECTO = (300, 250) # (ancho, alto) en px
+TAMANOS_CAJAS_ADS = {
+    'ad-slot-header': (970, 250),
+    'parent-ad-slot-header': (970, 250),
+    'ad-slot-megalateral': (160, 600),
+}
+
+# Diferencia visual por píxeles entre V1 y V2 (además de la geometría DOM). Detecta cambios de
+# color, tipografía, imágenes o superposición que no alteran los rectángulos de los DIVs.
+DIFF_PIXELES_HABILITADO = True
+DIFF_PIXELES_UMBRAL_CANAL = 24 # Diferencia mínima (0-255) en algún canal para contar un píxel como cambiado
+DIFF_PIXELES_TESELA = 64 # Lado de las teselas que se descartan enteras si no cambiaron
+DIFF_PIXELES_ESCALA = 4 # Resolución de la grilla de componentes conexos (px por celda)
+DIFF_PIXELES_DISTANCIA_AGRUPAR = 16 # Cambios a menos de esta distancia (px) forman una sola región
+DIFF_PIXELES_AREA_MINIMA = 64 # Píxeles cambiados mínimos para reportar una región
+DIFF_PIXELES_MAX_REGIONES = 25
+# Distancia de Hamming (bits de 64) del hash perceptual a partir de la cual una tesela se considera
+# visualmente distinta en el resumen del reporte (ver `resumen_teselas`)
+DISTANCIA_PERCEPTUAL_MAX = 5
+# Regiones fijas (x, y, w, h) a ignorar en el diff de píxeles, además de los contenedores de AD_CONTAINER_IDS
+MASCARAS_REGIONES = []
+
 # ---
 ## Funciones de Utilidad
 # ---
@@ -46,6 +193,10 @@ def format_time(seconds):
     except (ValueError, TypeError):
         return "00:00:00"
 
+def format_viewport(viewport):
+    """(1920, 1080) -> '1920x1080'."""
+    return f"{viewport[0]}x{viewport[1]}"
+
 def format_date(timestamp):
     """Convierte un timestamp (YYYYMMDD_HHMMSS) a formato DD/MM/AAAA."""
     try:
@@ -55,6 +206,93 @@ def format_date(timestamp):
     except ValueError:
         return timestamp.split('_')[0]
 
+def format_segundos_variantes(tiempos):
+    """Formatea segundos por variante (Ej: {'V1': 4.2, 'V2': 3.1} -> 'V1: 4.2s | V2: 3.1s')."""
+    partes = []
+    for variante in ('V1', 'V2'):
+        segundos = tiempos.get(variante)
+        partes.append(f"{variante}: {segundos:.1f}s" if isinstance(segundos, (int, float)) else f"{variante}: N/A")
+    return " | ".join(partes)
+
+def format_estabilizacion(estabilizacion):
+    """Igual que `format_segundos_variantes`, avisando si alguna variante alcanzó el tope de espera."""
+    texto = format_segundos_variantes(estabilizacion)
+    if estabilizacion.get('tope'):
+        texto += f" ⚠️ (se alcanzó el tope de {ESTABILIZACION_TOPE_S}s)"
+    return texto
+
+# ---
+## Perfil de Tiempos (Fases, Bytes por WebDriver y Memoria)
+# ---
+
+@contextmanager
+def medir_fase(metricas, fase, driver=None):
+    """
+    Mide una fase y la agrega a metricas['fases'] como {'fase', 'inicio', 'duracion_s'}.
+    'inicio' es epoch para poder alinear fases medidas en hilos distintos (V1/V2 en paralelo).
+    Con `driver` también registra los bytes que viajaron por WebDriver durante la fase.
+    Sin `metricas` no mide nada.
+    """
+    if metricas is None:
+        yield
+        return
+    bytes_inicio = bytes_webdriver(driver)
+    inicio = time.time()
+    inicio_perf = time.perf_counter()
+    try:
+        yield
+    finally:
+        span = {'fase': fase, 'inicio': inicio, 'duracion_s': time.perf_counter() - inicio_perf}
+        if driver is not None:
+            span['bytes'] = bytes_webdriver(driver) - bytes_inicio
+        metricas.setdefault('fases', []).append(span)
+
+def instrumentar_webdriver(driver):
+    """
+    Cuenta los bytes de cada petición/respuesta HTTP entre Selenium y chromedriver (comandos,
+    execute_script, capturas, CDP) en `driver.bytes_webdriver`. Si la versión de Selenium no
+    expone la conexión, el contador queda en None.
+    """
+    conexion = getattr(driver.command_executor, '_conn', None)
+    if conexion is None:
+        driver.bytes_webdriver = None
+        return
+    driver.bytes_webdriver = 0
+    request_original = conexion.request
+
+    def request(method, url, *args, **kwargs):
+        respuesta = request_original(method, url, *args, **kwargs)
+        driver.bytes_webdriver += len(kwargs.get('body') or b'') + len(respuesta.data or b'')
+        return respuesta
+
+    conexion.request = request
+
+def bytes_webdriver(driver):
+    """Bytes acumulados por WebDriver en la sesión (0 si no está instrumentada)."""
+    return getattr(driver, 'bytes_webdriver', None) or 0
+
+def pico_rss_mb():
+    """
+    Pico acumulado de memoria residente del proceso en MB desde que arrancó (ru_maxrss; None si el
+    sistema no lo expone). Nunca baja: tomado al terminar una página es el pico del proceso hasta
+    esa página inclusive, no el consumo de esa página.
+    """
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB; macOS, bytes
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+def format_bytes(cantidad):
+    """1536 -> '1.5 KB'."""
+    if not isinstance(cantidad, (int, float)):
+        return "N/A"
+    for unidad in ('B', 'KB', 'MB'):
+        if cantidad < 1024:
+            return f"{cantidad:.0f} {unidad}" if unidad == 'B' else f"{cantidad:.1f} {unidad}"
+        cantidad /= 1024
+    return f"{cantidad:.1f} GB"
+
 def ejecutar_js_manipulacion(driver, script):
     """Ejecuta un script JavaScript, ignorando errores."""
     try:
@@ -66,15 +304,8 @@ def ejecutar_js_manipulacion(driver, script):
 ## Función CRÍTICA de Limpieza Estructural
 # ---
 
-def limpiar_entorno_robusto(driver):
-    """
-    Realiza la ELIMINACIÓN de popups flotantes (cookies, notificaciones, suscripciones) 
-    pero MANTIENE visible el contenido de ADS para medir su impacto estructural.
-    """
-    print("    🧹 Eliminación de Popups Flotantes (Si existen)...")
-
-    # 1. ELIMINACIÓN FORZADA DE POPUPS Y ELEMENTOS FIJOS
-    js_eliminar_popups = """
+# Barrido completo de popups (también lo usa el backend CDP cuando no hay neutralización inyectada)
+JS_ELIMINAR_POPUPS = """
         // Intenta hacer click y eliminar
         var btn_close = document.querySelector('button.onetrust-close-btn-handler'); if (btn_close) { btn_close.click(); }
         var os_cancel = document.getElementById('onesignal-slidedown-cancel-button'); if (os_cancel) { os_cancel.click(); }
@@ -107,121 +338,454 @@ def limpiar_entorno_robusto(driver):
         document.body.style.overflowX = 'hidden'; 
         document.body.style.maxWidth = '100vw'; 
     """
-    ejecutar_js_manipulacion(driver, js_eliminar_popups)
+
+def limpiar_entorno_robusto(driver):
+    """
+    Realiza la ELIMINACIÓN de popups flotantes (cookies, notificaciones, suscripciones) 
+    pero MANTIENE visible el contenido de ADS para medir su impacto estructural.
+    """
+    print("    🧹 Eliminación de Popups Flotantes (Si existen)...")
+
+    # 1. ELIMINACIÓN FORZADA DE POPUPS Y ELEMENTOS FIJOS
+    ejecutar_js_manipulacion(driver, JS_ELIMINAR_POPUPS)
     
-def forzar_carga_contenido(driver):
+# ---
+## Neutralización de Popups Inyectada (Antes de los Scripts de la Página)
+# ---
+
+# Popups conocidos: se ocultan por CSS desde el primer render (el navegador aplica la regla a
+# los elementos nuevos sin que haya que buscarlos)
+SELECTORES_POPUPS = (
+    '#onesignal-slidedown-container', '#alertNews', '#onetrust-consent-sdk',
+    '.modal-content-subscribe', '.modal-backdrop', '.popup',
+)
+# Botones que se cliquean apenas aparecen (cierran el popup y liberan el scroll del body)
+SELECTORES_BOTONES_CIERRE = ('button.onetrust-close-btn-handler', '#onesignal-slidedown-cancel-button')
+
+JS_NEUTRALIZACION = """
+(function() {
+    if (window.__regresionNeutralizacion) { return; }
+    var estado = window.__regresionNeutralizacion = { ocultos: 0 };
+    var CSS = %(css)s;
+    var BOTONES = %(botones)s;
+
+    var estilo = document.createElement('style');
+    estilo.id = '__regresion-neutralizacion';
+    estilo.textContent = CSS;
+    function asegurarEstilo() {
+        if (!estilo.isConnected) { (document.head || document.documentElement).appendChild(estilo); }
+    }
+
+    // Popups flotantes sin selector conocido: z-index alto en línea (solo se mira el elemento que cambió)
+    function revisar(el) {
+        if (el.nodeType !== 1 || el === document.body || el === document.documentElement) { return; }
+        if (BOTONES && el.matches(BOTONES)) { el.click(); }
+        if (el.style && el.style.zIndex && parseInt(window.getComputedStyle(el).zIndex, 10) > 1000) {
+            el.style.setProperty('display', 'none', 'important');
+            estado.ocultos++;
+        }
+    }
+
+    var observador = new MutationObserver(function(registros) {
+        asegurarEstilo();
+        for (var i = 0; i < registros.length; i++) {
+            var registro = registros[i];
+            if (registro.type === 'attributes') {
+                revisar(registro.target);
+                continue;
+            }
+            for (var j = 0; j < registro.addedNodes.length; j++) {
+                var nodo = registro.addedNodes[j];
+                if (nodo.nodeType !== 1) { continue; }
+                revisar(nodo);
+                if (BOTONES) { nodo.querySelectorAll(BOTONES).forEach(function(b) { b.click(); }); }
+            }
+        }
+    });
+    observador.observe(document, { childList: true, subtree: true, attributes: true, attributeFilter: ['style'] });
+    asegurarEstilo();
+})();
+"""
+
+def construir_script_neutralizacion(reservar_ads=None):
+    """
+    Script que se registra una vez por sesión con `Page.addScriptToEvaluateOnNewDocument` y corre
+    antes que los scripts de cada página: hoja de estilos para los popups conocidos + un único
+    MutationObserver que revisa solo los nodos nuevos o con `style` modificado. Con `reservar_ads`
+    los contenedores de AD_CONTAINER_IDS ocupan siempre una caja fija (layout determinista).
+    """
+    reservar_ads = RESERVAR_CAJAS_ADS if reservar_ads is None else reservar_ads
+    reglas = [", ".join(SELECTORES_POPUPS) + " { display: none !important; }",
+              "body { overflow-x: hidden !important; max-width: 100vw !important; }"]
+    if reservar_ads:
+        for id_contenedor in AD_CONTAINER_IDS:
+            ancho, alto = TAMANOS_CAJAS_ADS.get(id_contenedor, TAMANO_CAJA_AD_POR_DEFECTO)
+            reglas.append(f'[id^="{id_contenedor}"] {{ width: {ancho}px !important; height: {alto}px !important; '
+                          f'min-height: 0 !important; max-height: none !important; overflow: hidden !important; }}')
+    return JS_NEUTRALIZACION % {'css': json.dumps("\n".join(reglas)), 'botones': json.dumps(", ".join(SELECTORES_BOTONES_CIERRE))}
+
+def registrar_neutralizacion(driver):
+    """Registra el script de neutralización en la sesión (persiste en todas sus navegaciones)."""
+    if not NEUTRALIZACION_INYECTADA:
+        return False
+    try:
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': construir_script_neutralizacion()})
+        return True
+    except Exception as e:
+        print(f"  ⚠️ No se pudo registrar la neutralización de popups (se usará la limpieza completa): {e}")
+        return False
+
+def neutralizacion_activa(driver):
+    """True si el script inyectado está corriendo en la página actual."""
+    try:
+        return bool(driver.execute_script("return !!window.__regresionNeutralizacion;"))
+    except Exception:
+        return False
+
+def limpiar_entorno(driver):
     """
-    Ejecuta scrolls suaves para forzar la carga de lazy loading y estabilizar el DOM.
+    Limpieza previa a medir: si la neutralización inyectada está activa no hace falta recorrer la
+    página; si no (CDP no disponible), recurre a `limpiar_entorno_robusto`.
     """
-    # 1. Scroll al final
-    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);") 
-    time.sleep(8) 
-    # 2. Scroll al inicio
-    driver.execute_script("window.scrollTo(0, 0);") 
-    time.sleep(8) 
-    # 3. Scroll a la mitad para forzar carga central
-    driver.execute_script("window.scrollTo(0, document.body.scrollHeight / 2);") 
-    time.sleep(8)
-    # 4. Volver al inicio antes de medir
-    driver.execute_script("window.scrollTo(0, 0);") 
-    time.sleep(12) 
+    if not neutralizacion_activa(driver):
+        limpiar_entorno_robusto(driver)
 
 # ---
-## Función Clave: Extracción de Datos del DOM (4 Puntos: X, Y, W, H)
+## Espera Adaptativa de Estabilización del Layout
 # ---
 
-def obtener_estructura_dom(driver):
-    
+JS_ESPERAR_ESTABILIZACION = """
+    var ventanaQuietaMs = arguments[0];
+    var topeMs = arguments[1];
+    var callback = arguments[arguments.length - 1];
+
+    var inicio = performance.now();
+    var ultimoCambio = inicio;
+    var ultimaAltura = document.body ? document.body.scrollHeight : 0;
+    var ultimosRecursos = performance.getEntriesByType('resource').length;
+    var mutaciones = 0;
+
+    // Inserciones/remociones de nodos en cualquier parte del documento
+    var observer = new MutationObserver(function(records) { mutaciones += records.length; });
+    observer.observe(document.documentElement, { childList: true, subtree: true });
+
+    function imagenesPendientes() {
+        var pendientes = 0;
+        var alto = window.innerHeight;
+        for (var i = 0; i < document.images.length; i++) {
+            var img = document.images[i];
+            if (img.complete) continue;
+            // Las imágenes lazy fuera del viewport nunca cargan: solo cuentan las visibles
+            var r = img.getBoundingClientRect();
+            if (img.loading !== 'lazy' || (r.bottom >= 0 && r.top <= alto)) pendientes++;
+        }
+        return pendientes;
+    }
+
+    function verificar() {
+        var ahora = performance.now();
+        var altura = document.body ? document.body.scrollHeight : 0;
+        var recursos = performance.getEntriesByType('resource').length;
+
+        if (mutaciones > 0 || altura !== ultimaAltura || recursos !== ultimosRecursos ||
+            document.readyState !== 'complete' || imagenesPendientes() > 0) {
+            ultimoCambio = ahora;
+        }
+        mutaciones = 0;
+        ultimaAltura = altura;
+        ultimosRecursos = recursos;
+
+        var estable = (ahora - ultimoCambio) >= ventanaQuietaMs;
+        if (estable || (ahora - inicio) >= topeMs) {
+            observer.disconnect();
+            callback({ estable: estable, ms: ahora - inicio });
+        } else {
+            setTimeout(verificar, 100);
+        }
+    }
+    setTimeout(verificar, 100);
+"""
+
+def esperar_estabilizacion(driver, ventana_quieta_ms=None, tope_s=None):
     """
-    Ejecuta JavaScript para obtener el selector CSS, la posición (X, Y) y la dimensión (W, H) de CADA DIV.
+    Espera (dentro de la página) a que el layout se estabilice, en lugar de dormir un tiempo fijo.
+    Devuelve un dict {'segundos': tiempo hasta estabilizar, 'estable': False si se alcanzó el tope}.
     """
-    js_script_css_selector = """
-        function getCssSelector(el) {
-            if (!(el instanceof Element)) return;
-            var path = [];
-            while (el.nodeType === Node.ELEMENT_NODE) {
-                var selector = el.tagName.toLowerCase();
-                if (el.id) {
-                    selector += '#' + el.id;
-                    path.unshift(selector);
-                    break;
-                } else {
-                    var sib = el, nth = 1;
-                    while (sib = sib.previousElementSibling) {
-                        if (sib.tagName.toLowerCase() == selector) nth++;
-                    }
-                    if (nth != 1) selector += ":nth-child(" + nth + ")";
-                }
-                path.unshift(selector);
-                el = el.parentNode;
+    ventana_quieta_ms = ESTABILIZACION_VENTANA_QUIETA_MS if ventana_quieta_ms is None else ventana_quieta_ms
+    tope_s = ESTABILIZACION_TOPE_S if tope_s is None else tope_s
+
+    inicio = time.time()
+    try:
+        driver.set_script_timeout(tope_s + 10)
+        resultado = driver.execute_async_script(JS_ESPERAR_ESTABILIZACION, ventana_quieta_ms, tope_s * 1000)
+        return {'segundos': resultado['ms'] / 1000.0, 'estable': bool(resultado['estable'])}
+    except Exception:
+        return {'segundos': time.time() - inicio, 'estable': False}
+
+# Secuencia de scrolls de `forzar_carga_contenido` (compartida por los dos backends de captura)
+SCROLLS_CARGA_CONTENIDO = (
+    "window.scrollTo(0, document.body.scrollHeight);",    # 1. Scroll al final
+    "window.scrollTo(0, 0);",                             # 2. Scroll al inicio
+    "window.scrollTo(0, document.body.scrollHeight / 2);",  # 3. Scroll a la mitad para forzar carga central
+    "window.scrollTo(0, 0);",                             # 4. Volver al inicio antes de medir
+)
+
+def forzar_carga_contenido(driver):
+    """
+    Ejecuta scrolls para forzar la carga de lazy loading y espera a que el DOM se estabilice
+    después de cada uno. Devuelve la lista de esperas (ver `esperar_estabilizacion`).
+    """
+    esperas = []
+    for scroll in SCROLLS_CARGA_CONTENIDO:
+        driver.execute_script(scroll) 
+        esperas.append(esperar_estabilizacion(driver))
+    return esperas
+
+# ---
+## Función Clave: Extracción de Datos del DOM (4 Puntos: X, Y, W, H)
+# ---
+
+# Extractor de estructura en UNA sola pasada sobre el árbol (tiempo lineal):
+# - El recorrido en preorden reproduce el orden de document.querySelectorAll('div').
+# - El índice :nth-child (entre hermanos del mismo tag) se calcula una vez por padre.
+# - El camino CSS de cada ancestro se calcula una sola vez y se reutiliza como prefijo de sus hijos.
+# - Las lecturas de layout (getBoundingClientRect) se hacen todas juntas, después de armar los selectores.
+# Devuelve un payload columnar (arrays paralelos) con las clases internadas en una tabla.
+JS_EXTRAER_ESTRUCTURA = """
+    var CLASES_EXCLUIDAS = ['fusion-app', 'common-layout', 'col-megalateral', 'default-article-color', 'col-content'];
+
+    // 1. Recorrido único: selectores de todos los DIV
+    var divs = [], selectores = [];
+    var raiz = document.documentElement;
+    var raizTag = raiz.tagName.toLowerCase();
+    var pilaNodos = [raiz];
+    var pilaCaminos = [raiz.id ? raizTag + '#' + raiz.id : raizTag];
+
+    while (pilaNodos.length) {
+        var el = pilaNodos.pop();
+        var camino = pilaCaminos.pop();
+        if (el.tagName.toLowerCase() === 'div') {
+            divs.push(el);
+            selectores.push(camino);
+        }
+
+        var hijos = el.children;
+        if (!hijos || !hijos.length) continue;
+        var cuenta = Object.create(null);
+        var caminosHijos = new Array(hijos.length);
+        for (var i = 0; i < hijos.length; i++) {
+            var hijo = hijos[i];
+            var tag = hijo.tagName.toLowerCase();
+            var nth = cuenta[tag] = (cuenta[tag] || 0) + 1;
+            if (hijo.id) {
+                caminosHijos[i] = tag + '#' + hijo.id;
+            } else {
+                caminosHijos[i] = camino + ' > ' + (nth !== 1 ? tag + ':nth-child(' + nth + ')' : tag);
             }
-            return path.join(' > ');
         }
+        // Se apilan en orden inverso para visitar en preorden
+        for (var j = hijos.length - 1; j >= 0; j--) {
+            pilaNodos.push(hijos[j]);
+            pilaCaminos.push(caminosHijos[j]);
+        }
+    }
 
-        var elements = document.querySelectorAll('div');
-        var data = [];
-        for (var i = 0; i < elements.length; i++) {
-            var el = elements[i];
-            var rect = el.getBoundingClientRect();
-            
-            // Filtra elementos muy pequeños o invisibles
-            if (rect.height < 5 || rect.width < 5 || rect.height === 0 || rect.width === 0) continue;
-            
-            // FILTRAR 'fusion-app', 'common-layout', 'col-megalateral', 'col-content', 'default-article-color'
-            if (el.classList && (
-    el.classList.contains('fusion-app') ||
-    el.classList.contains('common-layout') ||
-    el.classList.contains('col-megalateral') ||
-    el.classList.contains('default-article-color') ||
-    el.classList.contains('col-content')
-)) continue;
-            
+    // 2. Lecturas de layout en bloque
+    var scrollX = window.pageXOffset, scrollY = window.pageYOffset;
+    var out = { selector: [], id_attr: [], clase: [], tabla_clases: [], x: [], y: [], w: [], h: [] };
+    var indiceClases = new Map();
 
-            data.push({
-                selector: getCssSelector(el),
-                // --- Extracción de ID y Clase ---
-                id_attr: el.id, 
-                class_attr: el.className, 
-                // ---------------------------------
-                y: window.pageYOffset + rect.top,       // Posición Vertical ABSOLUTA
-                height: rect.height,                     // Altura (Dimensión Vertical)
-                x: window.pageXOffset + rect.left,       // Posición Horizontal ABSOLUTA
-                width: rect.width                      // Ancho (Dimensión Horizontal)
-            });
+    for (var k = 0; k < divs.length; k++) {
+        var div = divs[k];
+        var rect = div.getBoundingClientRect();
+
+        // Filtra elementos muy pequeños o invisibles
+        if (rect.height < 5 || rect.width < 5) continue;
+
+        var excluido = false;
+        for (var c = 0; c < CLASES_EXCLUIDAS.length; c++) {
+            if (div.classList.contains(CLASES_EXCLUIDAS[c])) { excluido = true; break; }
+        }
+        if (excluido) continue;
+
+        var clase = typeof div.className === 'string' ? div.className : '';
+        var idClase = indiceClases.get(clase);
+        if (idClase === undefined) {
+            idClase = out.tabla_clases.length;
+            out.tabla_clases.push(clase);
+            indiceClases.set(clase, idClase);
+        }
+
+        out.selector.push(selectores[k]);
+        out.id_attr.push(div.id);
+        out.clase.push(idClase);
+        out.x.push(scrollX + rect.left);     // Posición Horizontal ABSOLUTA
+        out.y.push(scrollY + rect.top);      // Posición Vertical ABSOLUTA
+        out.w.push(rect.width);              // Ancho (Dimensión Horizontal)
+        out.h.push(rect.height);             // Altura (Dimensión Vertical)
+    }
+    return out;
+"""
+
+# Columnas de la estructura DOM en Python (mismos nombres que usaba cada elemento como dict)
+COLUMNAS_ESTRUCTURA = ('selector', 'id_attr', 'class_attr', 'x', 'y', 'width', 'height')
+
+def estructura_vacia():
+    """Estructura DOM columnar sin elementos."""
+    return {columna: [] for columna in COLUMNAS_ESTRUCTURA}
+
+def estructura_error():
+    """Estructura centinela de una captura fallida (selector 'FATAL ERROR')."""
+    return {'selector': ['FATAL ERROR'], 'id_attr': [''], 'class_attr': [''], 'x': [0], 'y': [0], 'width': [0], 'height': [0]}
+
+def decodificar_estructura(payload):
+    """Convierte el payload columnar de JS_EXTRAER_ESTRUCTURA en la estructura columnar de Python."""
+    tabla_clases = payload['tabla_clases']
+    return {
+        'selector': payload['selector'],
+        'id_attr': payload['id_attr'],
+        'class_attr': [tabla_clases[i] for i in payload['clase']],
+        'x': payload['x'],
+        'y': payload['y'],
+        'width': payload['w'],
+        'height': payload['h'],
+    }
+
+def normalizar_estructura(data):
+    """Acepta una estructura columnar o una lista de dicts (formato anterior) y devuelve la columnar."""
+    if isinstance(data, dict):
+        return data
+    estructura = estructura_vacia()
+    for item in data:
+        for columna in COLUMNAS_ESTRUCTURA:
+            estructura[columna].append(item.get(columna, '' if columna in ('id_attr', 'class_attr') else 0))
+    return estructura
+
+def filas_estructura(estructura):
+    """Itera la estructura columnar elemento por elemento (un dict por DIV)."""
+    columnas = [estructura[columna] for columna in COLUMNAS_ESTRUCTURA]
+    for valores in zip(*columnas):
+        yield dict(zip(COLUMNAS_ESTRUCTURA, valores))
+
+def estructura_tiene_error(estructura):
+    """True si la estructura corresponde a una captura fallida."""
+    return 'FATAL ERROR' in estructura['selector']
+
+JS_ALTURA_TOTAL = "return Math.max( document.body.scrollHeight, document.body.offsetHeight, document.documentElement.clientHeight, document.documentElement.scrollHeight, document.documentElement.offsetHeight );"
+
+# Oculta (y luego restaura) los elementos fixed/sticky para que no se repitan en cada tesela
+JS_OCULTAR_FIJOS = """
+    var ocultos = [];
+    var elementos = document.body.getElementsByTagName('*');
+    for (var i = 0; i < elementos.length; i++) {
+        var posicion = window.getComputedStyle(elementos[i]).position;
+        if (posicion === 'fixed' || posicion === 'sticky') {
+            ocultos.push([elementos[i], elementos[i].style.visibility]);
+            elementos[i].style.visibility = 'hidden';
         }
-        return data;
+    }
+    window.__regresionFijosOcultos = ocultos;
+"""
+JS_RESTAURAR_FIJOS = """
+    (window.__regresionFijosOcultos || []).forEach(function(par) { par[0].style.visibility = par[1]; });
+    window.__regresionFijosOcultos = [];
+"""
+
+def capturar_pagina_por_teselas(driver, ruta_destino, total_height):
+    """
+    Captura la página completa de a una tesela (alto del viewport) haciendo scroll, y la
+    escribe fila por fila en `ruta_destino` con `EscritorPNGPorFilas`. Chrome nunca tiene que
+    crear una superficie del alto total de la página y Python solo retiene una tesela por vez.
+    """
+    escritor = None
+    fijos_ocultos = False
+    y = 0
+    try:
+        while y < total_height:
+            driver.execute_script("window.scrollTo(0, arguments[0]);", y)
+            y_real = driver.execute_script("return window.pageYOffset;")
+            tesela = cv2.imdecode(np.frombuffer(driver.get_screenshot_as_png(), np.uint8), cv2.IMREAD_COLOR)
+            if escritor is None:
+                escritor = EscritorPNGPorFilas(ruta_destino, tesela.shape[1], total_height)
+
+            # En la última tesela el scroll no llega a `y`: se descarta la parte ya capturada
+            desde = int(round(y - y_real))
+            filas = min(tesela.shape[0] - desde, total_height - y)
+            if filas <= 0:
+                break
+            escritor.agregar_filas(tesela[desde:desde + filas])
+            y += filas
+
+            if not fijos_ocultos:
+                ejecutar_js_manipulacion(driver, JS_OCULTAR_FIJOS)
+                fijos_ocultos = True
+    finally:
+        if fijos_ocultos:
+            ejecutar_js_manipulacion(driver, JS_RESTAURAR_FIJOS)
+        ejecutar_js_manipulacion(driver, "window.scrollTo(0, 0);")
+
+    return escritor.cerrar() if escritor else None
+
+def usar_captura_por_teselas(total_height, modo_captura=None):
+    """Decide según MODO_CAPTURA si la página se captura por teselas o en una sola imagen."""
+    modo_captura = MODO_CAPTURA if modo_captura is None else modo_captura
+    if modo_captura == 'auto':
+        return total_height > ALTURA_MAX_CAPTURA_COMPLETA
+    return modo_captura == 'teselas'
+
+def obtener_estructura_dom(driver, etiqueta="", metricas=None):
+    
+    """
+    Ejecuta JavaScript para obtener el selector CSS, la posición (X, Y) y la dimensión (W, H) de CADA DIV.
+    `etiqueta` identifica la captura en la consola (las capturas corren en paralelo).
+    Si se pasa `metricas` (dict), se completa con el tiempo real de estabilización de la página.
+    Devuelve (estructura, png), con la estructura en formato columnar (ver `decodificar_estructura`).
+    En modo por teselas `png` es la ruta del PNG temporal en disco en lugar de los bytes.
     """
     
-    data = []
+    data = estructura_vacia()
     png = None
     
     try:
-        driver.get(driver.current_url) 
-        # Espera de 20 segundos para document.readyState
-        WebDriverWait(driver, 20).until(lambda d: d.execute_script("return document.readyState") == "complete")
-        
-        # === USO DE LA LIMPIZA ROBUSTA ===
-        limpiar_entorno_robusto(driver)
-        # TIEMPO DE ESPERA ADICIONAL AÑADIDO
-        time.sleep(10) 
-        limpiar_entorno_robusto(driver) 
-        forzar_carga_contenido(driver) 
+        # === LIMPIEZA (incremental si la neutralización inyectada está activa) ===
+        with medir_fase(metricas, 'limpieza', driver):
+            limpiar_entorno(driver)
+        # ESPERA ADAPTATIVA (reemplaza el sleep fijo de 10s)
+        with medir_fase(metricas, 'estabilización', driver):
+            esperas = [esperar_estabilizacion(driver)]
+        with medir_fase(metricas, 'limpieza', driver):
+            limpiar_entorno(driver) 
+        with medir_fase(metricas, 'carga lazy (scrolls)', driver):
+            esperas += forzar_carga_contenido(driver) 
         # =================================
 
-        print("     📐 Extrayendo posiciones y dimensiones del DOM (X, Y, W, H)...")
-        data = driver.execute_script(js_script_css_selector)
+        segundos_estabilizacion = sum(e['segundos'] for e in esperas)
+        alcanzo_tope = not all(e['estable'] for e in esperas)
+        print(f"     ⏱️ [{etiqueta}] Página estabilizada en {segundos_estabilizacion:.1f}s" + (" (se alcanzó el tope de espera)" if alcanzo_tope else ""))
+        if metricas is not None:
+            metricas['estabilizacion_s'] = segundos_estabilizacion
+            metricas['estabilizacion_tope'] = alcanzo_tope
+
+        print(f"     📐 [{etiqueta}] Extrayendo posiciones y dimensiones del DOM (X, Y, W, H)...")
+        with medir_fase(metricas, 'extracción DOM', driver):
+            data = decodificar_estructura(driver.execute_script(JS_EXTRAER_ESTRUCTURA))
         
         # Tomar captura de pantalla 
-        print("     📸 Tomando captura de pantalla para el reporte...")
-        total_height = driver.execute_script("return Math.max( document.body.scrollHeight, document.body.offsetHeight, document.documentElement.clientHeight, document.documentElement.scrollHeight, document.documentElement.offsetHeight );")
-        original_size = driver.get_window_size()
-        driver.set_window_size(original_size['width'], total_height)
-        png = driver.get_screenshot_as_png()
-        driver.set_window_size(original_size['width'], original_size['height'])
+        print(f"     📸 [{etiqueta}] Tomando captura de pantalla para el reporte...")
+        with medir_fase(metricas, 'captura de pantalla', driver):
+            total_height = driver.execute_script(JS_ALTURA_TOTAL)
+            if usar_captura_por_teselas(total_height):
+                print(f"     🧩 [{etiqueta}] Página de {total_height}px: captura por teselas en disco.")
+                png = capturar_pagina_por_teselas(driver, ruta_temporal_captura(), total_height)
+            else:
+                original_size = driver.get_window_size()
+                driver.set_window_size(original_size['width'], total_height)
+                png = driver.get_screenshot_as_png()
+                driver.set_window_size(original_size['width'], original_size['height'])
 
     except Exception as e:
-        print(f"     ❌ Error en la extracción/captura: {e}")
-        data = [{'selector': 'FATAL ERROR', 'y': 0, 'height': 0, 'x': 0, 'width': 0}] 
+        print(f"     ❌ [{etiqueta}] Error en la extracción/captura: {e}")
+        data = estructura_error() 
         
     return data, png
 
@@ -230,548 +794,2765 @@ def obtener_estructura_dom(driver):
 ## Función Clave: Comparación Estructural DOM (Agrupación de Errores)
 # ---
 
-def comparar_estructura_dom(data_v1, data_v2, umbral_pixeles):
+# Comprobaciones geométricas, en el orden en que se listan en el detalle del reporte
+CHEQUEOS_GEOMETRIA = (
+    ('height', 'DIFERENCIA ALTURA (H)'),
+    ('y', 'DIFERENCIA POSICIÓN (Y)'),
+    ('width', 'DIFERENCIA ANCHO (W)'),
+    ('x', 'DIFERENCIA POSICIÓN (X)'),
+)
+# Columnas de CHEQUEOS_GEOMETRIA que son cambios de dimensión (el resto son de posición)
+ES_CHEQUEO_DIMENSION = (True, False, True, False)
+
+SELECTORES_ERROR = ('ERROR', 'FATAL ERROR')
+
+# Emparejar los DIVs de V1/V2 alineando los árboles (ver `alinear_arboles_dom`) en lugar de por
+# selector exacto: una inserción temprana ya no se reporta como cientos de AUSENTE/NUEVO.
+ALINEACION_ESTRUCTURAL = True
+
+def _matriz_geometria(estructura):
+    """Matriz (n, 4) float64 con las columnas de CHEQUEOS_GEOMETRIA (H, Y, W, X)."""
+    n = len(estructura['selector'])
+    if n == 0:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.column_stack([np.fromiter(estructura[columna], dtype=np.float64, count=n) for columna, _ in CHEQUEOS_GEOMETRIA])
+
+def _coords(estructura, i):
+    return {'x': estructura['x'][i], 'y': estructura['y'][i], 'width': estructura['width'][i], 'height': estructura['height'][i]}
+
+def _atributos_v2(estructura, j):
+    """id/class del elemento j de V2 (lo que muestra el reporte), o None si no está en V2."""
+    if j is None:
+        return None
+    return {'id_attr': estructura['id_attr'][j], 'class_attr': estructura['class_attr'][j]}
+
+def _formatear_detalle(tipo, diff, v1, v2):
+    """Línea de detalle de una falla (con formato condicional para N/A)."""
+    v1_display = f"{v1:.2f}" if isinstance(v1, (int, float)) else str(v1)
+    v2_display = f"{v2:.2f}" if isinstance(v2, (int, float)) else str(v2)
+    diff_display = f"{diff:.2f}px" if isinstance(diff, (int, float)) else str(diff)
+    return f"Tipo: <b>{tipo}</b> | V1: {v1_display} | V2: {v2_display} | Diff: {diff_display}"
+
+# ---
+## Alineación Estructural de Árboles DOM (Inserciones/Remociones Reales)
+# ---
+
+def _arbol_desde_selectores(estructura):
+    """
+    Reconstruye el árbol de DIVs a partir de los selectores (caminos ' > ').
+    El padre de cada DIV es su ancestro más cercano presente en la estructura (-1 = raíz virtual).
+    Devuelve (hijos por padre, cantidad de descendientes por elemento).
+    """
+    selectores = estructura['selector']
+    n = len(selectores)
+    padres = [-1] * n
+    hijos = {-1: []}
+    indice = {}
+    for i, selector in enumerate(selectores):
+        if selector is None or selector in SELECTORES_ERROR:
+            padres[i] = None
+            continue
+        # El recorrido es en preorden: los ancestros ya están en `indice`
+        corte = selector.rfind(' > ')
+        while corte != -1:
+            padre = indice.get(selector[:corte])
+            if padre is not None:
+                padres[i] = padre
+                break
+            corte = selector.rfind(' > ', 0, corte)
+        hijos.setdefault(padres[i], []).append(i)
+        indice[selector] = i
+
+    descendientes = [0] * n
+    for i in range(n - 1, -1, -1):
+        padre = padres[i]
+        if padre is not None and padre >= 0:
+            descendientes[padre] += descendientes[i] + 1
+    return hijos, descendientes
+
+def _firmas(estructura, indices, hijos):
+    """Firma de cada DIV para alinear hermanos: id, clases y cantidad de DIVs hijos."""
+    ids = estructura['id_attr']
+    clases = estructura['class_attr']
+    return [(ids[i], clases[i], len(hijos.get(i, ()))) for i in indices]
+
+def _primer_segmento_distinto(selector_v1, selector_v2):
+    """Primer tramo del camino CSS que difiere entre V1 y V2 (Ej: 'div:nth-child(3)' vs 'div:nth-child(4)')."""
+    for segmento_v1, segmento_v2 in zip(selector_v1.split(' > '), selector_v2.split(' > ')):
+        if segmento_v1 != segmento_v2:
+            return segmento_v1, segmento_v2
+    return selector_v1.split(' > ')[-1], selector_v2.split(' > ')[-1]
+
+def alinear_arboles_dom(data_v1, data_v2):
+    """
+    Alinea los árboles de DIVs de V1 y V2 (diff de árboles): para cada par de padres emparejados
+    se alinean sus listas de hijos con una LCS (difflib) sobre las firmas id/clase/hijos.
+
+    Un DIV insertado al principio de la página cambia el :nth-child de todos sus hermanos
+    posteriores; con esta alineación esos hermanos siguen emparejados (reubicados) y solo la
+    inserción/remoción real se reporta, una vez, en la raíz del subárbol afectado.
+
+    Devuelve un dict con:
+      - 'idx_v2': np.array con el índice en V2 emparejado a cada fila de V1 (-1 si no tiene pareja).
+      - 'ausentes': {fila V1: descendientes} raíces de subárboles removidos.
+      - 'nuevos': [(fila V2, descendientes)] raíces de subárboles insertados, en orden de V2.
+    """
+    hijos_v1, descendientes_v1 = _arbol_desde_selectores(data_v1)
+    hijos_v2, descendientes_v2 = _arbol_desde_selectores(data_v2)
+
+    idx_v2 = np.full(len(data_v1['selector']), -1, dtype=np.int64)
+    ausentes = {}
+    nuevos = []
+
+    pendientes = [(-1, -1)]
+    while pendientes:
+        padre_v1, padre_v2 = pendientes.pop()
+        a = hijos_v1.get(padre_v1, [])
+        b = hijos_v2.get(padre_v2, [])
+        firmas_a = _firmas(data_v1, a, hijos_v1)
+        firmas_b = _firmas(data_v2, b, hijos_v2)
+
+        if firmas_a == firmas_b:
+            pares = list(zip(a, b))
+        else:
+            pares = []
+            matcher = difflib.SequenceMatcher(None, firmas_a, firmas_b, autojunk=False)
+            for operacion, a1, a2, b1, b2 in matcher.get_opcodes():
+                # 'replace' de igual longitud = los mismos DIVs modificados (ej. cambió la clase)
+                if operacion == 'equal' or (operacion == 'replace' and a2 - a1 == b2 - b1):
+                    pares.extend(zip(a[a1:a2], b[b1:b2]))
+                    continue
+                for i in a[a1:a2]:
+                    ausentes[i] = descendientes_v1[i]
+                for j in b[b1:b2]:
+                    nuevos.append((j, descendientes_v2[j]))
+
+        for i, j in pares:
+            idx_v2[i] = j
+            pendientes.append((i, j))
+
+    nuevos.sort()
+    return {'idx_v2': idx_v2, 'ausentes': ausentes, 'nuevos': nuevos}
+
+def _alinear_por_selector(data_v1, data_v2):
+    """
+    Alineación por selector exacto (comportamiento original): cada selector sin pareja se
+    reporta como AUSENTE/NUEVO. Devuelve el mismo formato que `alinear_arboles_dom`.
+    """
+    selectores_v1 = data_v1['selector']
+    selectores_v2 = data_v2['selector']
+
+    # Ante duplicados en V2 gana el último, como un dict
+    indice_v2 = dict(zip(selectores_v2, range(len(selectores_v2))))
+    indice_v2.pop(None, None)
+    idx_v2 = np.fromiter(map(indice_v2.get, selectores_v1, itertools.repeat(-1)), dtype=np.int64, count=len(selectores_v1))
+    emparejados = idx_v2 >= 0
+
+    ausentes = {}
+    for i in np.flatnonzero(~emparejados).tolist():
+        if selectores_v1[i] is not None and selectores_v1[i] not in SELECTORES_ERROR:
+            ausentes[i] = 0
+
+    # Un selector de V2 está en V1 si su índice canónico (el último, el de `indice_v2`) quedó emparejado.
+    # Solo se revisan en Python las filas de V2 sin pareja directa (nuevas o selectores duplicados).
+    emparejados_v2 = np.zeros(len(selectores_v2), dtype=bool)
+    emparejados_v2[idx_v2[emparejados]] = True
+    nuevos = []
+    for j in np.flatnonzero(~emparejados_v2).tolist():
+        selector = selectores_v2[j]
+        if selector is None or selector in SELECTORES_ERROR or emparejados_v2[indice_v2[selector]]:
+            continue
+        nuevos.append((j, 0))
+
+    return {'idx_v2': idx_v2, 'ausentes': ausentes, 'nuevos': nuevos}
+
+# ---
+## Función Clave: Comparación Estructural DOM (Agrupación de Errores)
+# ---
+
+def comparar_estructura_dom(data_v1, data_v2, umbral_pixeles, alineacion_estructural=None, metricas=None):
     """
     Compara la estructura de los DIVs usando sus 4 puntos (X, Y, W, H).
     Agrupa todas las fallas de un selector CSS en una sola entrada.
+
+    Motor vectorizado: V1 y V2 se alinean en matrices NumPy (n, 4), todas las diferencias y
+    máscaras de umbral se calculan en una sola pasada, y solo se recorren los elementos que se
+    reportan. Cada falla lleva sus cambios estructurados ('cambios'); el texto del detalle lo arma
+    el reporte (`detalle_falla_html`).
+
+    Con `alineacion_estructural` (por defecto ALINEACION_ESTRUCTURAL) los DIVs se emparejan con
+    `alinear_arboles_dom` en lugar de por selector exacto.
+    Con `metricas` (dict) se miden las fases de alineación, diferencias y consolidación.
     """
-    v2_map = {item['selector']: item for item in data_v2 if item['selector'] is not None}
-    
-    # Diccionario para agrupar fallas por selector
+    if alineacion_estructural is None:
+        alineacion_estructural = ALINEACION_ESTRUCTURAL
+
+    data_v1 = normalizar_estructura(data_v1)
+    data_v2 = normalizar_estructura(data_v2)
+    selectores_v1 = data_v1['selector']
+    selectores_v2 = data_v2['selector']
+
+    # 1. Alineación V1 -> V2
+    with medir_fase(metricas, 'alineación DOM'):
+        if alineacion_estructural:
+            alineacion = alinear_arboles_dom(data_v1, data_v2)
+        else:
+            alineacion = _alinear_por_selector(data_v1, data_v2)
+    idx_v2 = alineacion['idx_v2']
+    ausentes = alineacion['ausentes']
+    emparejados = idx_v2 >= 0
+
+    # 2. Diferencias absolutas y máscaras de umbral (H, Y, W, X) en una sola pasada
+    with medir_fase(metricas, 'diferencias DOM'):
+        geometria_v1 = _matriz_geometria(data_v1)
+        geometria_v2 = _matriz_geometria(data_v2)
+        diffs = np.zeros_like(geometria_v1)
+        diffs[emparejados] = np.abs(geometria_v1[emparejados] - geometria_v2[idx_v2[emparejados]])
+        mascaras = diffs > umbral_pixeles
+
+        # Filas de V1 a reportar: emparejadas con alguna diferencia sobre el umbral, o ausentes en V2
+        reportar = emparejados & mascaras.any(axis=1)
+        reportar[list(ausentes)] = True
+        filas = np.flatnonzero(reportar)
+        mascaras_filas = mascaras[filas].tolist()
+        diffs_filas = diffs[filas].tolist()
+        idx_v2_filas = idx_v2[filas].tolist()
+
+    # Diccionario para agrupar fallas por selector (respeta el orden de aparición).
+    # Con alineación estructural un selector de V1 (ausente) puede coincidir con el de otro DIV
+    # de V2 reubicado, por eso la clave incluye la versión.
     errores_agrupados = {}
-    
-    # Función de ayuda para añadir una falla a la agrupación
-    def add_falla(selector, tipo, diff, v1, v2, coords_v2):
-        # Asegurarse de que los valores sean números antes de formatear
-        v1_val = v1 if isinstance(v1, (int, float)) else 0
-        v2_val = v2 if isinstance(v2, (int, float)) else 0
-        
-        # Inicialización de la entrada (gravedad inicial: 'menor')
-        if selector not in errores_agrupados:
-            errores_agrupados[selector] = {
+
+    # `j` es la fila del elemento en V2; los ausentes en V2 no tienen (ni muestran) atributos de V2
+    def grupo(selector, coords_v2, version, j=None):
+        clave = (version, selector) if alineacion_estructural else selector
+        if clave not in errores_agrupados:
+            errores_agrupados[clave] = {
                 'selector': selector,
-                'tipos': [],
+                'cambios': [],
                 'coords_v2': coords_v2,
-                'cambio_dimension': 0, # Nuevo contador
-                'cambio_posicion': 0,  # Nuevo contador
-                'gravedad': 'menor' 
+                'atributos_v2': _atributos_v2(data_v2, j),
+                'grave': False,
             }
-        
-        # Añadir el detalle de la falla (con formato condicional para N/A)
-        v1_display = f"{v1:.2f}" if isinstance(v1, (int, float)) else str(v1)
-        v2_display = f"{v2:.2f}" if isinstance(v2, (int, float)) else str(v2)
-        diff_display = f"{diff:.2f}px" if isinstance(diff, (int, float)) else str(diff)
+        return errores_agrupados[clave]
 
-        detalle = f"Tipo: <b>{tipo}</b> | V1: {v1_display} | V2: {v2_display} | Diff: {diff_display}"
-        errores_agrupados[selector]['tipos'].append(detalle)
-        
-        # Actualización de contadores de cambios
-        if 'ALTURA (H)' in tipo or 'ANCHO (W)' in tipo:
-             errores_agrupados[selector]['cambio_dimension'] += 1
-        elif 'POSICIÓN (Y)' in tipo or 'POSICIÓN (X)' in tipo:
-             errores_agrupados[selector]['cambio_posicion'] += 1
-        
-        # Fallas de existencia son siempre graves
-        if tipo in ['AUSENTE V2', 'NUEVO EN V2']:
-            errores_agrupados[selector]['gravedad'] = 'grave'
+    def agregar_existencia(entrada, tipo, internos):
+        entrada['cambios'].append({'tipo': tipo, 'diff': None, 'v1': None, 'v2': None, 'internos': internos})
+        entrada['grave'] = True
 
+    # 3-5. Agrupación por selector y consolidación (solo los elementos con fallas)
+    with medir_fase(metricas, 'agrupación de fallas'):
+        # 3. Solo se recorren los elementos de V1 con fallas
+        for i, j, mascara, diff in zip(filas.tolist(), idx_v2_filas, mascaras_filas, diffs_filas):
+            selector = selectores_v1[i]
+            if j < 0:
+                # Elemento presente en V1, ausente en V2 (FALLA GRAVE)
+                entrada = grupo(selector, _coords(data_v1, i), 'V1')
+                agregar_existencia(entrada, 'AUSENTE V2', ausentes[i])
+                continue
 
-    for item1 in data_v1:
-        selector = item1['selector']
-        
-        if selector in v2_map and selector is not None:
-            item2 = v2_map[selector]
-            
-            # 1. ALTURA (H)
-            diff_height = abs(item1['height'] - item2['height'])
-            if diff_height > umbral_pixeles:
-                add_falla(selector, 'DIFERENCIA ALTURA (H)', diff_height, item1['height'], item2['height'], item2)
-
-            # 2. POSICIÓN Y
-            diff_y = abs(item1['y'] - item2['y'])
-            if diff_y > umbral_pixeles:
-                 add_falla(selector, 'DIFERENCIA POSICIÓN (Y)', diff_y, item1['y'], item2['y'], item2)
-            
-            # 3. ANCHO (W)
-            diff_width = abs(item1['width'] - item2['width'])
-            if diff_width > umbral_pixeles:
-                add_falla(selector, 'DIFERENCIA ANCHO (W)', diff_width, item1['width'], item2['width'], item2)
-            
-            # 4. POSICIÓN X
-            diff_x = abs(item1['x'] - item2['x'])
-            if diff_x > umbral_pixeles:
-                 add_falla(selector, 'DIFERENCIA POSICIÓN (X)', diff_x, item1['x'], item2['x'], item2)
-        
-        elif selector not in ['ERROR', 'FATAL ERROR'] and selector is not None:
-            # 5. Elemento presente en V1, ausente en V2 (FALLA GRAVE)
-             coords_v1_for_mark = {'x': item1['x'], 'y': item1['y'], 'width': item1['width'], 'height': item1['height']} 
-             add_falla(selector, 'AUSENTE V2', "N/A", "N/A", "N/A", coords_v1_for_mark)
-            
-    # 6. Elementos en V2 que no están en V1 (FALLA GRAVE)
-    v1_selectors = set(item['selector'] for item in data_v1 if item['selector'] is not None)
-    for item2 in data_v2:
-        selector = item2['selector']
-        if selector not in v1_selectors and selector not in ['ERROR', 'FATAL ERROR'] and selector is not None:
-            coords_v2_for_mark = {'x': item2['x'], 'y': item2['y'], 'width': item2['width'], 'height': item2['height']} 
-            add_falla(selector, 'NUEVO EN V2', "N/A", "N/A", "N/A", coords_v2_for_mark)
-
-    # 7. CONSOLIDACIÓN FINAL Y CLASIFICACIÓN DE GRAVEDAD
-    fallas_final = []
-    selectores_fallidos = []
-    
-    for selector, data in errores_agrupados.items():
-        
-        # *** LÓGICA DE CLASIFICACIÓN REFINADA ***
-        # Si ya se marcó como 'grave' (p. ej. por Ausente/Nuevo) O si cambió W o H, ES GRAVE.
-        if data['gravedad'] == 'grave' or data['cambio_dimension'] > 0:
-            data['gravedad'] = 'grave'
-        # Si NO cambió W ni H, pero sí cambió X y/o Y, es MENOR (Efecto Dominó).
-        elif data['cambio_posicion'] > 0:
-            data['gravedad'] = 'menor'
-        else:
-             # Si no hay cambios significativos, se podría omitir, 
-             # pero por seguridad, mantenemos el menor si entró en el bucle
-             data['gravedad'] = 'menor'
-        # *************************************************
+            selector_v2 = selectores_v2[j]
+            entrada = grupo(selector_v2, _coords(data_v2, j), 'V2', j)
+            if selector_v2 != selector:
+                # Mismo DIV, pero su camino :nth-child cambió por una inserción/remoción previa
+                segmento_v1, segmento_v2 = _primer_segmento_distinto(selector, selector_v2)
+                entrada['cambios'].append({'tipo': 'REUBICADO EN EL DOM', 'diff': None, 'v1': segmento_v1, 'v2': segmento_v2})
+            for k, (columna, tipo) in enumerate(CHEQUEOS_GEOMETRIA):
+                if mascara[k]:
+                    entrada['cambios'].append({'tipo': tipo, 'diff': diff[k], 'v1': data_v1[columna][i], 'v2': data_v2[columna][j]})
+                    # Si cambió W o H, ES GRAVE. Si solo cambió X y/o Y, es MENOR (Efecto Dominó).
+                    if ES_CHEQUEO_DIMENSION[k]:
+                        entrada['grave'] = True
 
-        descripcion_consolidada = "<div style='margin-top: 5px; border-left: 2px solid #ccc; padding-left: 5px;'>"+ "<br>".join(data['tipos']) + "</div>"
-        
-        # Usar el resultado de la lógica refinada
-        tipo_marcado = 'DIFERENCIA AGRUPADA GRAVE' if data['gravedad'] == 'grave' else 'DIFERENCIA AGRUPADA MENOR'
+        # 4. Elementos en V2 que no están en V1 (FALLA GRAVE)
+        for j, internos in alineacion['nuevos']:
+            entrada = grupo(selectores_v2[j], _coords(data_v2, j), 'V2', j)
+            agregar_existencia(entrada, 'NUEVO EN V2', internos)
+
+        # 5. CONSOLIDACIÓN FINAL Y CLASIFICACIÓN DE GRAVEDAD
+        fallas_final = []
+        selectores_fallidos = []
+    
+        for data in errores_agrupados.values():
+            selector = data['selector']
+            tipo_marcado = 'DIFERENCIA AGRUPADA GRAVE' if data['grave'] else 'DIFERENCIA AGRUPADA MENOR'
         
-        fallas_final.append({
-            'selector': selector,
-            'tipo': tipo_marcado, 
-            'diff': 1, 
-            'v1': "Consolidado", 
-            'v2': descripcion_consolidada, 
-            'coords_v2': data['coords_v2']
-        })
-        selectores_fallidos.append(selector)
+            fallas_final.append({
+                'selector': selector,
+                'tipo': tipo_marcado, 
+                'coords_v2': data['coords_v2'],
+                'atributos_v2': data['atributos_v2'],
+                'gravedad': 'grave' if data['grave'] else 'menor',
+                # Deltas numéricos sin formatear (el reporte arma el detalle a partir de ellos)
+                'cambios': data['cambios'],
+            })
+            selectores_fallidos.append(selector)
 
     return fallas_final, selectores_fallidos
 
 
 # ---
-## Función para Marcado Visual (OpenCV)
+## Entrada/Salida de Imágenes (Sin Decodificar/Recodificar de Más)
 # ---
 
-def marcar_fallas_en_captura(png_data, fallas, data_v2): 
+def codificar_imagen(img, formato=None):
     """
-    Toma el PNG de V2 y dibuja un rectángulo ROJO (diferencia grave) o AZUL (diferencia menor)
-    sobre cada elemento que falló la prueba DOM.
+    Codifica una imagen BGR de OpenCV una sola vez en el formato del reporte
+    (FORMATO_CAPTURA_MARCADA). Si falla (ej. WebP admite hasta 16383 px de alto) se usa PNG.
     """
-    if not png_data or not fallas:
-        return None 
-        
-    img_np = np.frombuffer(png_data, np.uint8)
-    img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
-    
-    selectores_ya_marcados = set()
-    
-    for f in fallas:
-        selector = f.get('selector')
-        tipo = f.get('tipo') 
-        
-        item_coords = f.get('coords_v2') 
-        
-        if selector in selectores_ya_marcados or item_coords is None:
-            continue
-            
-        # 1. Determinar el color del rectángulo (BGR: OpenCV usa BGR)
-        if 'GRAVE' in tipo:
-            color_bgr = (0, 0, 255) # ROJO
-            thickness = 5
-        elif 'MENOR' in tipo:
-            color_bgr = (255, 0, 0) # AZUL
-            thickness = 3
-        else:
-            continue 
+    formato = FORMATO_CAPTURA_MARCADA if formato is None else formato
+    if formato == 'webp':
+        parametros = [cv2.IMWRITE_WEBP_QUALITY, CALIDAD_WEBP]
+    elif formato == 'avif':
+        parametros = [cv2.IMWRITE_AVIF_QUALITY, CALIDAD_AVIF]
+    else:
+        formato = 'png'
+        parametros = [cv2.IMWRITE_PNG_COMPRESSION, PNG_NIVEL_COMPRESION]
 
-        # 2. Coordenadas
-        x1 = int(item_coords['x'])
-        y1 = int(item_coords['y'])
-        x2 = int(item_coords['x'] + item_coords['width'])
-        y2 = int(item_coords['y'] + item_coords['height'])
-        
-        # 3. Dibujar
-        height, width, _ = img.shape
-        # Aplicar límites (Clip)
-        x1 = max(0, x1)
-        y1 = max(0, y1)
-        x2 = min(width - 1, x2)
-        y2 = min(height - 1, y2)
-        
-        if x2 > x1 and y2 > y1:
-            cv2.rectangle(img, (x1, y1), (x2, y2), color_bgr, thickness) 
-            selectores_ya_marcados.add(selector) 
-        else:
-            # Eliminado el aviso de 'coordenadas inválidas'.
-            pass
-
-    is_success, buffer = cv2.imencode(".png", img)
+    try:
+        is_success, buffer = cv2.imencode(f".{formato}", img, parametros)
+    except cv2.error:
+        is_success = False
     if is_success:
         return buffer.tobytes()
+    if formato != 'png':
+        print(f"    ⚠️ No se pudo codificar la captura en {formato.upper()} ({img.shape[1]}x{img.shape[0]} px); se usa PNG.")
+        return codificar_imagen(img, 'png')
     return None
 
+def extension_imagen(contenido):
+    """Extensión de archivo según la firma de los bytes de la imagen ('png', 'webp' o 'avif')."""
+    if contenido[:4] == b'RIFF' and contenido[8:12] == b'WEBP':
+        return 'webp'
+    if contenido[4:8] == b'ftyp' and contenido[8:12] in (b'avif', b'avis'):
+        return 'avif'
+    return 'png'
+
+def guardar_bytes(ruta, contenido):
+    """Escribe la imagen ya codificada tal cual (sin decodificar ni recodificar)."""
+    with open(ruta, 'wb') as f:
+        f.write(contenido)
+
+FIRMA_PNG = b'\x89PNG\r\n\x1a\n'
+
 # ---
-## Función para Inicializar y Cerrar Selenium
+## PNG por Filas en Disco (Capturas de Páginas Muy Altas con Memoria Acotada)
 # ---
 
-def ejecutar_selenium_para_estructura(url):
-    """Maneja la inicialización del driver, llama a la extracción y lo cierra."""
-    
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless=new") 
-    options.add_argument("--window-size=1920,1080")
+def _chunk_png(tipo, datos):
+    return struct.pack('>I', len(datos)) + tipo + datos + struct.pack('>I', zlib.crc32(tipo + datos) & 0xffffffff)
+
+class EscritorPNGPorFilas:
+    """
+    Escribe un PNG RGB de 8 bits agregando bandas de filas (BGR de OpenCV) a medida que llegan,
+    sin tener nunca la imagen completa en memoria. Usa el filtro PNG 'Up' (diferencia con la fila
+    anterior), que comprime bien las capturas y se invierte de forma vectorizada al leer.
+    Si al cerrar faltan filas para completar `alto`, se completan en blanco.
+    """
+
+    TAMANO_IDAT = 1024 * 1024
+
+    def __init__(self, ruta, ancho, alto, nivel_compresion=None):
+        self.ruta = ruta
+        self.ancho = ancho
+        self.alto = alto
+        self.filas_escritas = 0
+        self._fila_anterior = np.zeros((ancho, 3), dtype=np.uint8)
+        self._compresor = zlib.compressobj(PNG_NIVEL_COMPRESION if nivel_compresion is None else nivel_compresion)
+        self._pendiente = bytearray()
+        self._archivo = open(ruta, 'wb')
+        self._archivo.write(FIRMA_PNG)
+        self._archivo.write(_chunk_png(b'IHDR', struct.pack('>IIBBBBB', ancho, alto, 8, 2, 0, 0, 0)))
+
+    def agregar_filas(self, banda_bgr):
+        """Agrega una banda (alto, ancho, 3) BGR; se recorta si excede el alto declarado."""
+        banda = banda_bgr[:self.alto - self.filas_escritas, :self.ancho, ::-1]
+        if banda.shape[0] == 0:
+            return
+        if banda.shape[1] < self.ancho:
+            relleno = np.full((banda.shape[0], self.ancho - banda.shape[1], 3), 255, dtype=np.uint8)
+            banda = np.concatenate([banda, relleno], axis=1)
+
+        anteriores = np.concatenate([self._fila_anterior[np.newaxis], banda[:-1]], axis=0)
+        filtrada = (banda - anteriores).reshape(banda.shape[0], self.ancho * 3)
+        crudo = np.empty((banda.shape[0], self.ancho * 3 + 1), dtype=np.uint8)
+        crudo[:, 0] = 2 # Filtro 'Up'
+        crudo[:, 1:] = filtrada
+
+        self._fila_anterior = banda[-1].copy()
+        self.filas_escritas += banda.shape[0]
+        self._emitir(self._compresor.compress(crudo.tobytes()))
+
+    def _emitir(self, comprimido, forzar=False):
+        self._pendiente += comprimido
+        if self._pendiente and (forzar or len(self._pendiente) >= self.TAMANO_IDAT):
+            self._archivo.write(_chunk_png(b'IDAT', bytes(self._pendiente)))
+            self._pendiente.clear()
+
+    def cerrar(self):
+        while self.filas_escritas < self.alto:
+            self.agregar_filas(np.full((min(1024, self.alto - self.filas_escritas), self.ancho, 3), 255, dtype=np.uint8))
+        self._emitir(self._compresor.flush(), forzar=True)
+        self._archivo.write(_chunk_png(b'IEND', b''))
+        self._archivo.close()
+        return self.ruta
+
+def dimensiones_png(ruta):
+    """(ancho, alto) leídos del encabezado IHDR, sin decodificar la imagen."""
+    with open(ruta, 'rb') as f:
+        cabecera = f.read(24)
+    if cabecera[:8] != FIRMA_PNG or cabecera[12:16] != b'IHDR':
+        raise ValueError(f"{ruta} no es un PNG válido")
+    return struct.unpack('>II', cabecera[16:24])
+
+def leer_png_por_bandas(ruta, filas_por_banda=1024):
+    """
+    Genera (y_inicio, banda BGR) leyendo un PNG RGB/RGBA de 8 bits por bandas, con memoria acotada.
+    Soporta los filtros por fila None/Sub/Up (los que usa `EscritorPNGPorFilas`); ante otros
+    filtros o formatos lanza ValueError para que el llamador use la decodificación completa.
+    """
+    with open(ruta, 'rb') as f:
+        if f.read(8) != FIRMA_PNG:
+            raise ValueError(f"{ruta} no es un PNG válido")
+        descompresor = zlib.decompressobj()
+        pendiente = bytearray()
+        ancho = alto = canales = None
+        fila_anterior = None
+        y = 0
+        banda = []
+
+        while True:
+            largo, tipo = struct.unpack('>I4s', f.read(8))
+            datos = f.read(largo)
+            f.read(4) # CRC
+            if tipo == b'IHDR':
+                ancho, alto, profundidad, tipo_color, _, _, entrelazado = struct.unpack('>IIBBBBB', datos)
+                if profundidad != 8 or tipo_color not in (2, 6) or entrelazado:
+                    raise ValueError("Solo se soportan PNG RGB/RGBA de 8 bits sin entrelazado")
+                canales = 3 if tipo_color == 2 else 4
+                fila_anterior = np.zeros(ancho * canales, dtype=np.uint8)
+            elif tipo == b'IDAT':
+                pendiente += descompresor.decompress(datos)
+                largo_fila = ancho * canales + 1
+                completas = len(pendiente) // largo_fila
+                if completas:
+                    filas = np.frombuffer(bytes(pendiente[:completas * largo_fila]), dtype=np.uint8).reshape(completas, largo_fila)
+                    del pendiente[:completas * largo_fila]
+                    for fila in filas:
+                        filtro, valores = fila[0], fila[1:]
+                        if filtro == 0:
+                            actual = valores.copy()
+                        elif filtro == 1:
+                            actual = np.cumsum(valores.reshape(ancho, canales), axis=0, dtype=np.uint8).reshape(-1)
+                        elif filtro == 2:
+                            actual = valores + fila_anterior
+                        else:
+                            raise ValueError(f"Filtro PNG {filtro} no soportado en lectura por bandas")
+                        banda.append(actual)
+                        fila_anterior = actual
+                        if len(banda) == filas_por_banda:
+                            yield y, _banda_a_bgr(banda, ancho, canales)
+                            y += len(banda)
+                            banda = []
+            elif tipo == b'IEND':
+                break
+
+        if banda:
+            yield y, _banda_a_bgr(banda, ancho, canales)
+
+def _banda_a_bgr(filas, ancho, canales):
+    return np.ascontiguousarray(np.stack(filas).reshape(len(filas), ancho, canales)[:, :, 2::-1])
+
+def es_captura_en_disco(captura):
+    """True si la captura es la ruta a un PNG en disco (modo por teselas) en lugar de bytes."""
+    return isinstance(captura, str)
+
+def ruta_temporal_captura():
+    """Ruta de un archivo PNG temporal para capturas por teselas."""
+    os.makedirs(DIRECTORIO_TEMPORAL, exist_ok=True)
+    descriptor, ruta = tempfile.mkstemp(suffix='.png', dir=DIRECTORIO_TEMPORAL)
+    os.close(descriptor)
+    return ruta
+
+def guardar_captura(captura, ruta):
+    """
+    Guarda una captura en `ruta`: los bytes se escriben tal cual y los archivos temporales
+    (capturas por teselas) se mueven sin volver a leerlos. Otros archivos se copian.
+    """
+    if not es_captura_en_disco(captura):
+        guardar_bytes(ruta, captura)
+    elif os.path.dirname(os.path.abspath(captura)) == os.path.abspath(DIRECTORIO_TEMPORAL):
+        os.replace(captura, ruta)
+    else:
+        shutil.copyfile(captura, ruta)
+
+def descartar_captura_temporal(captura):
+    """Borra el archivo temporal de una captura por teselas, si todavía existe."""
+    if es_captura_en_disco(captura) and os.path.dirname(os.path.abspath(captura)) == os.path.abspath(DIRECTORIO_TEMPORAL):
+        try:
+            os.remove(captura)
+        except OSError:
+            pass
+
+
+# ---
+## Diferencia Visual por Píxeles (Teselas + Componentes Conexos)
+# ---
+
+def _reducir_bloques(mascara, tam):
+    """Suma una máscara booleana (alto, ancho) por bloques de tam x tam (rellena los bordes con ceros)."""
+    alto, ancho = mascara.shape
+    relleno_alto, relleno_ancho = -alto % tam, -ancho % tam
+    if relleno_alto or relleno_ancho:
+        mascara = np.pad(mascara, ((0, relleno_alto), (0, relleno_ancho)))
+    bloques = mascara.reshape((alto + relleno_alto) // tam, tam, (ancho + relleno_ancho) // tam, tam)
+    return bloques.sum(axis=(1, 3), dtype=np.int32)
+
+def _bandas_captura(captura, filas_por_banda):
+    """
+    Genera (y_inicio, banda BGR) de una captura en bytes, en disco o ya decodificada (ndarray BGR).
+    Las capturas en disco se leen por bandas; si el PNG usa filtros no soportados se continúa con
+    la imagen decodificada completa.
+    """
+    if not es_captura_en_disco(captura):
+        img = captura if isinstance(captura, np.ndarray) else cv2.imdecode(np.frombuffer(captura, np.uint8), cv2.IMREAD_COLOR)
+        for y in range(0, img.shape[0], filas_por_banda):
+            yield y, img[y:y + filas_por_banda]
+        return
+
+    y_siguiente = 0
+    try:
+        for y, banda in leer_png_por_bandas(captura, filas_por_banda):
+            yield y, banda
+            y_siguiente = y + banda.shape[0]
+    except ValueError:
+        img = cv2.imread(captura, cv2.IMREAD_COLOR)
+        for y in range(y_siguiente, img.shape[0], filas_por_banda):
+            yield y, img[y:y + filas_por_banda]
+
+def _tramos(fila):
+    """(inicio, fin) de cada tramo de valores True consecutivos de un vector booleano."""
+    bordes = np.flatnonzero(np.diff(np.concatenate(([0], fila.astype(np.int8), [0]))))
+    return zip(bordes[::2].tolist(), bordes[1::2].tolist())
+
+def _cambio_en_teselas(a, b, candidatas, tesela, umbral_canal):
+    """
+    Máscara de píxeles cambiados de una banda calculando |V1 - V2| SOLO sobre las teselas
+    candidatas (tramos de teselas contiguas de cada fila de la grilla); el resto queda en False.
+    """
+    filas, ancho = a.shape[:2]
+    cambio = np.zeros((filas, ancho), dtype=bool)
+    for fila_tesela, fila in enumerate(candidatas):
+        y1, y2 = fila_tesela * tesela, min(filas, (fila_tesela + 1) * tesela)
+        for inicio, fin in _tramos(fila):
+            x1, x2 = inicio * tesela, min(ancho, fin * tesela)
+            cambio[y1:y2, x1:x2] = cv2.absdiff(a[y1:y2, x1:x2], b[y1:y2, x1:x2]).max(axis=2) > umbral_canal
+    return cambio
+
+def regiones_dinamicas(*estructuras):
+    """
+    Rectángulos (x, y, w, h) que se excluyen del diff de píxeles: los contenedores de anuncios
+    (id con alguno de los prefijos de AD_CONTAINER_IDS) de cada estructura más MASCARAS_REGIONES.
+    """
+    prefijos = tuple(AD_CONTAINER_IDS)
+    regiones = [tuple(region) for region in MASCARAS_REGIONES]
+    for estructura in estructuras:
+        for fila in filas_estructura(estructura):
+            if fila['id_attr'] and fila['id_attr'].startswith(prefijos):
+                regiones.append((fila['x'], fila['y'], fila['width'], fila['height']))
+    return regiones
+
+def _contenida_en(region, coords):
+    x, y, w, h = region
+    return (coords['x'] <= x and coords['y'] <= y and
+            x + w <= coords['x'] + coords['width'] and y + h <= coords['y'] + coords['height'])
+
+def diferencia_visual_pixeles(captura_v1, captura_v2, mascaras=(), fallas_dom=(), umbral_canal=None, indices=None):
+    """
+    Compara V1/V2 píxel a píxel y devuelve las regiones cambiadas como fallas 'DIFERENCIA VISUAL'
+    (mismo formato que `comparar_estructura_dom`), ordenadas de mayor a menor.
+
+    - Se recorre por bandas (memoria acotada también para capturas por teselas). Las bandas
+      idénticas se descartan con una comparación directa y del resto solo se conservan las
+      teselas de DIFF_PIXELES_TESELA px con algún cambio.
+    - Un píxel cambia si en algún canal |V1 - V2| > umbral_canal; las `mascaras` (x, y, w, h)
+      se ignoran.
+    - Los píxeles cambiados se acumulan en una grilla reducida (bloques de DIFF_PIXELES_ESCALA px)
+      y se agrupan con componentes conexos, uniendo cambios a menos de DIFF_PIXELES_DISTANCIA_AGRUPAR px.
+    - Se descartan regiones con menos de DIFF_PIXELES_AREA_MINIMA píxeles cambiados y las que
+      quedan dentro de un elemento que ya reportó la comparación DOM.
+    Solo se compara el área común a ambas capturas (la diferencia de alto ya la reporta el DOM).
+    Con `indices` (V1, V2) de `construir_indice_teselas` se consultan primero los hashes exactos:
+    si no difiere ninguna tesela no se decodifica nada, |V1 - V2| se calcula solo sobre las
+    teselas distintas (las bandas sin teselas distintas ni se comparan) y la lectura se corta
+    después de la última fila de teselas distintas. El PNG no permite saltear filas (zlib y los
+    filtros por fila son secuenciales), así que lo que está por encima sí se decodifica.
+    """
+    umbral_canal = DIFF_PIXELES_UMBRAL_CANAL if umbral_canal is None else umbral_canal
+    escala = DIFF_PIXELES_ESCALA
+    tesela = DIFF_PIXELES_TESELA
+    filas_por_banda = tesela * max(1, 1024 // tesela)
+
+    distintas = teselas_distintas(*indices) if indices else None
+    if distintas is not None and indices[0]['tesela'] != tesela:
+        distintas = None
+    if distintas is not None and not distintas.any():
+        return []
+    y_limite = (int(np.flatnonzero(distintas.any(axis=1))[-1]) + 1) * tesela if distintas is not None else None
+
+    reducidas = []
+    teselas_cambiadas = 0
+    ancho = 0
+    for (y, banda_v1), (_, banda_v2) in zip(_bandas_captura(captura_v1, filas_por_banda), _bandas_captura(captura_v2, filas_por_banda)):
+        if y_limite is not None and y >= y_limite:
+            break # Debajo de la última tesela distinta no hay cambios
+        filas = min(banda_v1.shape[0], banda_v2.shape[0])
+        ancho = min(banda_v1.shape[1], banda_v2.shape[1])
+        a, b = banda_v1[:filas, :ancho], banda_v2[:filas, :ancho]
+
+        if distintas is not None:
+            candidatas = distintas[y // tesela:y // tesela + -(-filas // tesela), :-(-ancho // tesela)]
+            sin_cambios = not candidatas.any()
+        else:
+            candidatas = None
+            sin_cambios = np.array_equal(a, b)
+        if sin_cambios:
+            reducidas.append(np.zeros((-(-filas // escala), -(-ancho // escala)), dtype=np.int32))
+            continue
+
+        if candidatas is not None:
+            cambio = _cambio_en_teselas(a, b, candidatas, tesela, umbral_canal)
+        else:
+            cambio = cv2.absdiff(a, b).max(axis=2) > umbral_canal
+        for x_m, y_m, w_m, h_m in mascaras:
+            y1, y2 = max(0, int(y_m) - y), min(filas, int(y_m + h_m) - y)
+            if y2 > y1:
+                cambio[y1:y2, max(0, int(x_m)):max(0, int(x_m + w_m))] = False
+
+        # Teselas sin cambios: no aportan a la grilla reducida
+        teselas = _reducir_bloques(cambio, tesela) > 0
+        teselas_cambiadas += int(teselas.sum())
+        if not teselas.any():
+            reducidas.append(np.zeros((-(-filas // escala), -(-ancho // escala)), dtype=np.int32))
+            continue
+        cambio &= np.repeat(np.repeat(teselas, tesela, axis=0), tesela, axis=1)[:filas, :ancho]
+        reducidas.append(_reducir_bloques(cambio, escala))
+
+    if not reducidas or not teselas_cambiadas:
+        return []
+
+    conteos = np.concatenate(reducidas, axis=0)
+    cambiadas = conteos > 0
+    radio = max(1, DIFF_PIXELES_DISTANCIA_AGRUPAR // escala)
+    dilatada = cv2.dilate(cambiadas.astype(np.uint8), np.ones((2 * radio + 1, 2 * radio + 1), np.uint8))
+    n_etiquetas, etiquetas = cv2.connectedComponents(dilatada, connectivity=8)
+
+    # Caja y píxeles cambiados de cada componente (solo sobre las celdas realmente cambiadas)
+    ys, xs = np.nonzero(cambiadas)
+    etiquetas_celdas = etiquetas[ys, xs]
+    pixeles = np.bincount(etiquetas_celdas, weights=conteos[ys, xs], minlength=n_etiquetas)
+    y_min = np.full(n_etiquetas, np.iinfo(np.int64).max); np.minimum.at(y_min, etiquetas_celdas, ys)
+    x_min = np.full(n_etiquetas, np.iinfo(np.int64).max); np.minimum.at(x_min, etiquetas_celdas, xs)
+    y_max = np.full(n_etiquetas, -1); np.maximum.at(y_max, etiquetas_celdas, ys)
+    x_max = np.full(n_etiquetas, -1); np.maximum.at(x_max, etiquetas_celdas, xs)
+
+    alto_total = conteos.shape[0] * escala
+    regiones = []
+    for k in range(1, n_etiquetas):
+        if pixeles[k] < DIFF_PIXELES_AREA_MINIMA:
+            continue
+        x, y = int(x_min[k]) * escala, int(y_min[k]) * escala
+        w = min((int(x_max[k]) + 1) * escala, ancho) - x
+        h = min((int(y_max[k]) + 1) * escala, alto_total) - y
+        region = (x, y, w, h)
+        if any(f.get('coords_v2') and _contenida_en(region, f['coords_v2']) for f in fallas_dom):
+            continue
+        regiones.append((int(pixeles[k]), region))
+
+    regiones.sort(key=lambda r: r[0], reverse=True)
+    fallas_visuales = []
+    for pixeles_region, (x, y, w, h) in regiones[:DIFF_PIXELES_MAX_REGIONES]:
+        fallas_visuales.append({
+            'selector': f"REGIÓN VISUAL {x},{y} ({w}x{h})",
+            'tipo': 'DIFERENCIA VISUAL',
+            'coords_v2': {'x': x, 'y': y, 'width': w, 'height': h},
+            'gravedad': 'visual',
+            'cambios': [{'tipo': 'PÍXELES DISTINTOS', 'diff': pixeles_region, 'v1': None, 'v2': None}],
+        })
+    return fallas_visuales
+
+# ---
+## Índice de Teselas (Hash Exacto + Hash Perceptual por Tesela)
+# ---
+
+def _hashes_banda(banda, tesela):
+    """
+    Hash exacto (BLAKE2b de 64 bits) y hash perceptual (aHash 8x8 de 64 bits) de cada tesela
+    de una banda BGR. Los bordes se completan en blanco hasta un múltiplo de `tesela`.
+    """
+    alto, ancho = banda.shape[:2]
+    relleno_alto, relleno_ancho = -alto % tesela, -ancho % tesela
+    if relleno_alto or relleno_ancho:
+        banda = cv2.copyMakeBorder(banda, 0, relleno_alto, 0, relleno_ancho, cv2.BORDER_CONSTANT, value=(255, 255, 255))
+    filas, columnas = banda.shape[0] // tesela, banda.shape[1] // tesela
+
+    # Exacto: una copia contigua por tesela y un digest de 8 bytes cada una
+    teselas = np.ascontiguousarray(banda.reshape(filas, tesela, columnas, tesela * 3).transpose(0, 2, 1, 3))
+    digests = b''.join(hashlib.blake2b(teselas[i, j], digest_size=8).digest() for i in range(filas) for j in range(columnas))
+    exacto = np.frombuffer(digests, dtype='<u8').reshape(filas, columnas)
+
+    # Perceptual: promedio de bloques 8x8 por tesela (INTER_AREA con factor entero) vs. su media
+    gris = cv2.cvtColor(banda, cv2.COLOR_BGR2GRAY)
+    reducida = cv2.resize(gris, (columnas * 8, filas * 8), interpolation=cv2.INTER_AREA)
+    bloques = reducida.reshape(filas, 8, columnas, 8).transpose(0, 2, 1, 3).reshape(filas, columnas, 64)
+    bits = bloques > bloques.mean(axis=2, keepdims=True)
+    perceptual = np.packbits(bits, axis=2).view('>u8').reshape(filas, columnas).astype('<u8')
+    return exacto, perceptual
+
+def construir_indice_teselas(captura, tesela=None):
+    """
+    Índice de la captura (bytes o ruta en disco) con un hash exacto y uno perceptual por tesela de
+    `tesela` px (por defecto DIFF_PIXELES_TESELA). Se arma una sola vez al capturar; después las
+    comparaciones consultan los hashes antes de decodificar píxeles.
+    """
+    tesela = DIFF_PIXELES_TESELA if tesela is None else tesela
+    exactos, perceptuales = [], []
+    ancho = alto = 0
+    for y, banda in _bandas_captura(captura, tesela * max(1, 1024 // tesela)):
+        exacto, perceptual = _hashes_banda(banda, tesela)
+        exactos.append(exacto)
+        perceptuales.append(perceptual)
+        alto, ancho = y + banda.shape[0], banda.shape[1]
+    if not exactos:
+        return None
+    return {'tesela': tesela, 'ancho': ancho, 'alto': alto, 'exacto': np.vstack(exactos), 'perceptual': np.vstack(perceptuales)}
+
+def guardar_indice_teselas(indice, ruta):
+    """Guarda el índice como .npz (sin comprimir: los hashes no comprimen)."""
+    with open(ruta, 'wb') as f:
+        np.savez(f, tesela=indice['tesela'], ancho=indice['ancho'], alto=indice['alto'],
+                 exacto=indice['exacto'], perceptual=indice['perceptual'])
+
+def cargar_indice_teselas(ruta):
+    """Lee un índice guardado con `guardar_indice_teselas`; None si no existe o está dañado."""
+    try:
+        with np.load(ruta) as datos:
+            return {'tesela': int(datos['tesela']), 'ancho': int(datos['ancho']), 'alto': int(datos['alto']),
+                    'exacto': datos['exacto'], 'perceptual': datos['perceptual']}
+    except (OSError, ValueError, KeyError):
+        return None
+
+def ruta_indice_teselas(ruta_captura):
+    """Ruta del índice que acompaña a una captura: `<nombre>.teselas.npz`."""
+    return f"{os.path.splitext(ruta_captura)[0]}.teselas.npz"
+
+def _grilla_comun(indice_v1, indice_v2, clave):
+    """Recorta ambas grillas al área común; None si los índices no son comparables."""
+    if indice_v1 is None or indice_v2 is None or indice_v1['tesela'] != indice_v2['tesela']:
+        return None
+    tesela = indice_v1['tesela']
+    filas = -(-min(indice_v1['alto'], indice_v2['alto']) // tesela)
+    columnas = -(-min(indice_v1['ancho'], indice_v2['ancho']) // tesela)
+    return indice_v1[clave][:filas, :columnas], indice_v2[clave][:filas, :columnas]
+
+def teselas_distintas(indice_v1, indice_v2):
+    """
+    Grilla booleana (área común) de teselas cuyo hash exacto difiere; None si no hay índices
+    comparables. Si las capturas tienen distinto tamaño, la última fila/columna del área común
+    (tesela parcial con relleno distinto) se considera distinta.
+    """
+    grillas = _grilla_comun(indice_v1, indice_v2, 'exacto')
+    if grillas is None:
+        return None
+    distintas = grillas[0] != grillas[1]
+    if indice_v1['alto'] != indice_v2['alto']:
+        distintas[-1, :] = True
+    if indice_v1['ancho'] != indice_v2['ancho']:
+        distintas[:, -1] = True
+    return distintas
+
+def resumen_teselas(indice_v1, indice_v2):
+    """
+    Resumen para el reporte: teselas totales, con hash exacto distinto y perceptualmente distintas
+    (distancia de Hamming del aHash mayor a DISTANCIA_PERCEPTUAL_MAX). None sin índices.
+    """
+    distintas = teselas_distintas(indice_v1, indice_v2)
+    if distintas is None:
+        return None
+    perceptual_v1, perceptual_v2 = _grilla_comun(indice_v1, indice_v2, 'perceptual')
+    xor = np.bitwise_xor(perceptual_v1, perceptual_v2)
+    distancia = np.unpackbits(xor.view(np.uint8).reshape(xor.shape + (8,)), axis=-1).sum(axis=-1)
+    return {
+        'total': int(distintas.size),
+        'exactas': int(distintas.sum()),
+        'perceptuales': int((distancia > DISTANCIA_PERCEPTUAL_MAX).sum()),
+    }
+
+def format_resumen_teselas(resumen):
+    """Texto del reporte para `resumen_teselas`."""
+    if not resumen:
+        return "N/A"
+    return f"{resumen['exactas']}/{resumen['total']} con píxeles distintos, {resumen['perceptuales']} perceptualmente distintas"
+
+# ---
+## Snapshots Binarios de la Estructura DOM (Tablas Internadas y Columnas Mapeables)
+# ---
+
+# Cada captura deja, junto a su PNG, un snapshot de su estructura DOM (`<nombre>.dom.snap`):
+#   - cabecera: MAGIA_SNAPSHOT_DOM, versión y largo de un JSON con los metadatos y el directorio
+#     de columnas {nombre: [dtype, desplazamiento, cantidad]};
+#   - columnas crudas alineadas a 8 bytes: x/y/w/h en float32, índices int32 a las tablas y
+#     tablas de cadenas (bytes UTF-8 + desplazamientos uint32).
+# Los selectores se guardan como un árbol de caminos (padre + segmento internado): los prefijos
+# "html > body > div:nth-child(2) > ..." se comparten en lugar de repetirse en cada DIV.
+# `cargar_snapshot_dom` mapea el archivo en memoria: las columnas son vistas sin copia.
+MAGIA_SNAPSHOT_DOM = b'DOMSNAP\x00'
+VERSION_FORMATO_SNAPSHOT = 1
+CABECERA_SNAPSHOT = struct.Struct('<8sII')
+SEPARADOR_SELECTOR = ' > '
+# Guardar un snapshot de la estructura DOM junto a cada captura (se puede desactivar con --sin-snapshots)
+SNAPSHOTS_DOM_HABILITADOS = True
+
+def ruta_snapshot_dom(ruta_captura):
+    """Ruta del snapshot que acompaña a una captura: `<nombre>.dom.snap`."""
+    return f"{os.path.splitext(ruta_captura)[0]}.dom.snap"
+
+def _internar(valores):
+    """(índices int32, tabla de valores distintos en orden de aparición)."""
+    tabla = {}
+    codigos = np.fromiter((tabla.setdefault(v, len(tabla)) for v in valores), dtype=np.int32, count=len(valores))
+    return codigos, list(tabla)
+
+def _arbol_caminos(selectores):
+    """
+    Interna los selectores como nodos de un árbol de caminos. Devuelve (nodo de cada selector,
+    padre de cada nodo, segmento de cada nodo, tabla de segmentos). Los padres siempre tienen un
+    índice menor que sus hijos; -1 es la raíz (y el selector vacío).
+    """
+    nodos, padres, segmentos_nodo, segmentos = {}, [], [], {}
+
+    def nodo(camino):
+        # Se sube hasta el primer prefijo conocido y se crean los que faltan de arriba hacia abajo
+        faltantes = []
+        while camino and camino not in nodos:
+            prefijo, _, segmento = camino.rpartition(SEPARADOR_SELECTOR)
+            faltantes.append((camino, segmento))
+            camino = prefijo
+        padre = nodos[camino] if camino else -1
+        for camino_faltante, segmento in reversed(faltantes):
+            padres.append(padre)
+            segmentos_nodo.append(segmentos.setdefault(segmento, len(segmentos)))
+            padre = nodos[camino_faltante] = len(padres) - 1
+        return padre
+
+    columna = np.fromiter((nodo(s) for s in selectores), dtype=np.int32, count=len(selectores))
+    return columna, np.asarray(padres, dtype=np.int32), np.asarray(segmentos_nodo, dtype=np.int32), list(segmentos)
+
+def _tabla_cadenas(cadenas):
+    """(bytes UTF-8 concatenados, desplazamientos uint32 de inicio/fin) de una tabla de cadenas."""
+    codificadas = [c.encode('utf-8') for c in cadenas]
+    desplazamientos = np.zeros(len(codificadas) + 1, dtype=np.uint32)
+    np.cumsum([len(c) for c in codificadas], out=desplazamientos[1:])
+    return np.frombuffer(b''.join(codificadas), dtype=np.uint8), desplazamientos
+
+def guardar_snapshot_dom(estructura, ruta, metadatos=None):
+    """Escribe la estructura columnar en el formato de snapshot (de forma atómica)."""
+    selector, padres, segmentos_nodo, segmentos = _arbol_caminos(estructura['selector'])
+    id_attr, ids = _internar(estructura['id_attr'])
+    clase, clases = _internar(estructura['class_attr'])
+    columnas = {
+        'x': np.asarray(estructura['x'], dtype=np.float32),
+        'y': np.asarray(estructura['y'], dtype=np.float32),
+        'width': np.asarray(estructura['width'], dtype=np.float32),
+        'height': np.asarray(estructura['height'], dtype=np.float32),
+        'selector': selector, 'camino_padre': padres, 'camino_segmento': segmentos_nodo,
+        'id_attr': id_attr, 'clase': clase,
+    }
+    for nombre, tabla in (('segmentos', segmentos), ('ids', ids), ('clases', clases)):
+        columnas[f'{nombre}_bytes'], columnas[f'{nombre}_desplazamientos'] = _tabla_cadenas(tabla)
+
+    directorio, desplazamiento = {}, 0
+    for nombre, columna in columnas.items():
+        directorio[nombre] = [columna.dtype.str, desplazamiento, len(columna)]
+        desplazamiento += -(-columna.nbytes // 8) * 8
+    cabecera = json.dumps({'elementos': len(selector), 'columnas': directorio, 'metadatos': metadatos or {}}).encode('utf-8')
+    cabecera += b' ' * (-(CABECERA_SNAPSHOT.size + len(cabecera)) % 8)
+
+    temporal = f"{ruta}.{threading.get_ident()}.tmp"
+    with open(temporal, 'wb') as f:
+        f.write(CABECERA_SNAPSHOT.pack(MAGIA_SNAPSHOT_DOM, VERSION_FORMATO_SNAPSHOT, len(cabecera)))
+        f.write(cabecera)
+        for columna in columnas.values():
+            f.write(columna.tobytes())
+            f.write(b'\x00' * (-columna.nbytes % 8))
+    os.replace(temporal, ruta)
+
+class SnapshotDOM:
+    """
+    Snapshot de una estructura DOM mapeado en memoria (ver `cargar_snapshot_dom`).
+    `x`, `y`, `width`, `height` y los índices son vistas float32/int32 del archivo; las tablas de
+    cadenas se decodifican recién cuando se piden (y una sola vez).
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._mapa = np.memmap(ruta, dtype=np.uint8, mode='r')
+        magia, version, largo = CABECERA_SNAPSHOT.unpack(bytes(self._mapa[:CABECERA_SNAPSHOT.size]))
+        if magia != MAGIA_SNAPSHOT_DOM or version != VERSION_FORMATO_SNAPSHOT:
+            raise ValueError(f"'{ruta}' no es un snapshot DOM con formato {VERSION_FORMATO_SNAPSHOT}.")
+        inicio = CABECERA_SNAPSHOT.size + largo
+        cabecera = json.loads(bytes(self._mapa[CABECERA_SNAPSHOT.size:inicio]))
+        self.metadatos = cabecera['metadatos']
+        self.elementos = cabecera['elementos']
+        self.columnas = {}
+        for nombre, (dtype, desplazamiento, cantidad) in cabecera['columnas'].items():
+            tipo = np.dtype(dtype)
+            desde = inicio + desplazamiento
+            self.columnas[nombre] = self._mapa[desde:desde + cantidad * tipo.itemsize].view(tipo)
+        self._tablas = {}
+
+    def __len__(self):
+        return self.elementos
+
+    def __getattr__(self, nombre):
+        if nombre in ('x', 'y', 'width', 'height'):
+            return self.columnas[nombre]
+        raise AttributeError(nombre)
+
+    def tabla(self, nombre):
+        """Tabla de cadenas 'segmentos', 'ids' o 'clases', decodificada."""
+        if nombre not in self._tablas:
+            datos = self.columnas[f'{nombre}_bytes'].tobytes()
+            limites = self.columnas[f'{nombre}_desplazamientos'].tolist()
+            self._tablas[nombre] = [datos[a:b].decode('utf-8') for a, b in zip(limites, limites[1:])]
+        return self._tablas[nombre]
+
+    def selectores(self):
+        """Selectores completos, reconstruidos recorriendo el árbol de caminos una sola vez."""
+        segmentos = self.tabla('segmentos')
+        caminos = []
+        for padre, segmento in zip(self.columnas['camino_padre'].tolist(), self.columnas['camino_segmento'].tolist()):
+            caminos.append(segmentos[segmento] if padre < 0 else caminos[padre] + SEPARADOR_SELECTOR + segmentos[segmento])
+        caminos.append('')  # nodo -1: selector vacío
+        return [caminos[nodo] for nodo in self.columnas['selector'].tolist()]
+
+    def estructura(self):
+        """
+        Estructura columnar (como la de `obtener_estructura_dom`) lista para `comparar_estructura_dom`;
+        la geometría queda como vistas float32 del archivo.
+        """
+        ids, clases = self.tabla('ids'), self.tabla('clases')
+        return {
+            'selector': self.selectores(),
+            'id_attr': [ids[i] for i in self.columnas['id_attr'].tolist()],
+            'class_attr': [clases[i] for i in self.columnas['clase'].tolist()],
+            'x': self.x, 'y': self.y, 'width': self.width, 'height': self.height,
+        }
+
+def cargar_snapshot_dom(ruta):
+    """Abre un snapshot escrito con `guardar_snapshot_dom`; None si no existe o está dañado."""
+    try:
+        return SnapshotDOM(ruta)
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+        return None
+
+# ---
+## Función para Marcado Visual (OpenCV)
+# ---
+
+def _es_marcable(coords):
+    """True si las coordenadas (en V2) encierran un área dibujable."""
+    if not coords:
+        return False
+    return int(coords['x'] + coords['width']) > int(coords['x']) and int(coords['y'] + coords['height']) > int(coords['y'])
+
+def _rectangulos_a_marcar(fallas, width, height):
+    """
+    Rectángulos (x1, y1, x2, y2, color BGR, grosor) a dibujar, ya recortados a la imagen.
+    Cada selector se marca una sola vez (la primera falla dibujable gana).
+    """
+    rectangulos = []
+    selectores_ya_marcados = set()
+    
+    for f in fallas:
+        selector = f.get('selector')
+        tipo = f.get('tipo') 
+        
+        item_coords = f.get('coords_v2') 
+        
+        if selector in selectores_ya_marcados or item_coords is None:
+            continue
+            
+        # 1. Determinar el color del rectángulo (BGR: OpenCV usa BGR)
+        if 'GRAVE' in tipo:
+            color_bgr = (0, 0, 255) # ROJO
+            thickness = 5
+        elif 'MENOR' in tipo:
+            color_bgr = (255, 0, 0) # AZUL
+            thickness = 3
+        elif 'VISUAL' in tipo:
+            color_bgr = (0, 140, 255) # NARANJA
+            thickness = 4
+        else:
+            continue 
+
+        # 2. Coordenadas, con límites (Clip)
+        x1 = max(0, int(item_coords['x']))
+        y1 = max(0, int(item_coords['y']))
+        x2 = min(width - 1, int(item_coords['x'] + item_coords['width']))
+        y2 = min(height - 1, int(item_coords['y'] + item_coords['height']))
+        
+        if x2 > x1 and y2 > y1:
+            rectangulos.append((x1, y1, x2, y2, color_bgr, thickness))
+            selectores_ya_marcados.add(selector) 
+
+    return rectangulos
+
+def marcar_fallas_en_captura(png_data, fallas, data_v2, metricas=None): 
+    """
+    Toma el PNG de V2 y dibuja un rectángulo ROJO (diferencia grave), AZUL (diferencia menor)
+    o NARANJA (diferencia visual de píxeles) sobre cada elemento o región que falló la prueba.
+    Si la captura está en disco (modo por teselas) se marca por bandas y devuelve la ruta de un
+    PNG nuevo; si no, devuelve los bytes codificados en FORMATO_CAPTURA_MARCADA.
+    Con `metricas` (dict) se miden la decodificación, el dibujo y la codificación.
+    """
+    if not png_data or not fallas:
+        return None 
+
+    if es_captura_en_disco(png_data):
+        with medir_fase(metricas, 'marcado por bandas'):
+            return _marcar_fallas_por_bandas(png_data, fallas)
+        
+    # Única decodificación de la captura V2
+    with medir_fase(metricas, 'decodificación V2'):
+        img_np = np.frombuffer(png_data, np.uint8)
+        img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
+    
+    with medir_fase(metricas, 'marcado'):
+        height, width, _ = img.shape
+        for x1, y1, x2, y2, color_bgr, thickness in _rectangulos_a_marcar(fallas, width, height):
+            cv2.rectangle(img, (x1, y1), (x2, y2), color_bgr, thickness) 
+
+    # Única codificación de la imagen marcada
+    with medir_fase(metricas, 'codificación marcada'):
+        return codificar_imagen(img)
+
+def _marcar_fallas_por_bandas(ruta_png, fallas):
+    """
+    Marca las fallas sobre un PNG en disco leyéndolo y reescribiéndolo por bandas, sin cargar
+    la página completa en memoria. Cada rectángulo se dibuja (desplazado) en todas las bandas que
+    toca, incluido el grosor del trazo, así que el resultado es idéntico al marcado en memoria.
+    La salida es siempre PNG (los codificadores WebP/AVIF necesitan la imagen completa).
+    """
+    width, height = dimensiones_png(ruta_png)
+    rectangulos = _rectangulos_a_marcar(fallas, width, height)
+    ruta_marcada = ruta_temporal_captura()
+    escritor = EscritorPNGPorFilas(ruta_marcada, width, height)
+    try:
+        bandas = leer_png_por_bandas(ruta_png)
+        for y_inicio, banda in bandas:
+            y_fin = y_inicio + banda.shape[0] - 1
+            for x1, y1, x2, y2, color_bgr, thickness in rectangulos:
+                if y1 - thickness <= y_fin and y2 + thickness >= y_inicio:
+                    cv2.rectangle(banda, (x1, y1 - y_inicio), (x2, y2 - y_inicio), color_bgr, thickness)
+            escritor.agregar_filas(banda)
+    except ValueError:
+        # PNG con filtros no soportados en lectura por bandas (p. ej. uno que no generó este script)
+        escritor.cerrar()
+        img = cv2.imread(ruta_png, cv2.IMREAD_COLOR)
+        for x1, y1, x2, y2, color_bgr, thickness in rectangulos:
+            cv2.rectangle(img, (x1, y1), (x2, y2), color_bgr, thickness)
+        guardar_bytes(ruta_marcada, codificar_imagen(img, 'png'))
+        return ruta_marcada
+    return escritor.cerrar()
+
+# ---
+## Pool de Sesiones de Chrome (WebDriver Reutilizable)
+# ---
+
+def crear_opciones_chrome():
+    """Opciones de Chrome headless usadas por todas las sesiones."""
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless=new") 
+    options.add_argument(f"--window-size={VENTANA_ANCHO},{VENTANA_ALTO}")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
     options.add_argument("--disable-gpu") 
     options.add_argument("--log-level=3") 
     options.add_experimental_option('excludeSwitches', ['enable-logging']) 
-    options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-    
-    driver = None
-    data = []
-    png = None
-    
+    options.add_argument(f"--user-agent={USER_AGENT}")
+    return options
+
+def sesion_saludable(driver):
+    """Health check: True si el navegador sigue respondiendo a comandos WebDriver."""
     try:
-        os.environ['WDM_LOG_LEVEL'] = '0' 
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=options)
+        return driver.execute_script("return 1;") == 1
+    except Exception:
+        return False
+
+def resetear_estado_sesion(driver):
+    """
+    Deja la sesión limpia para la próxima captura SIN reiniciar el proceso de Chrome:
+    borra cookies y storage (local/session/IndexedDB/service workers), navega a about:blank
+    y restaura el tamaño de ventana. La caché HTTP se conserva (acelera las capturas siguientes).
+    """
+    try:
+        origen = driver.execute_script("return window.location.origin;")
+        if origen and origen.startswith('http'):
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {
+                'origin': origen,
+                'storageTypes': 'local_storage,session_storage,indexeddb,websql,service_workers,cache_storage',
+            })
+    except Exception:
+        pass
+    ejecutar_js_manipulacion(driver, "try { localStorage.clear(); sessionStorage.clear(); } catch (e) {}")
+    try:
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+    except Exception:
+        driver.delete_all_cookies()
+    driver.get("about:blank")
+    driver.set_window_size(VENTANA_ANCHO, VENTANA_ALTO)
+
+class PoolDrivers:
+    """
+    Pool de sesiones de Chrome que viven durante toda la ejecución.
+
+    - El binario de chromedriver se resuelve UNA sola vez por corrida.
+    - Cada navegador se inicia una vez y se presta a las capturas con `with pool.sesion() as driver:`.
+    - Entre capturas se resetea el estado (cookies, storage, ventana) en lugar de reiniciar Chrome.
+    - Las sesiones caídas se detectan con un health check y se reemplazan automáticamente.
+    """
+
+    def __init__(self, max_sesiones):
+        self.max_sesiones = max_sesiones
+        self._ruta_chromedriver = None
+        self._lock = threading.Lock()
+        self._libres = queue.Queue()
+        self._creadas = 0
+        self._cerrado = False
+
+    def _resolver_chromedriver(self):
+        with self._lock:
+            if self._ruta_chromedriver is None:
+                os.environ['WDM_LOG_LEVEL'] = '0' 
+                self._ruta_chromedriver = ChromeDriverManager().install()
+            return self._ruta_chromedriver
+
+    def _iniciar_driver(self):
+        service = Service(self._resolver_chromedriver())
+        driver = webdriver.Chrome(service=service, options=crear_opciones_chrome())
         driver.set_page_load_timeout(60) 
-        driver.get(url)
-        
-        data, png = obtener_estructura_dom(driver)
-        
+        instrumentar_webdriver(driver)
+        registrar_neutralizacion(driver)
+        return driver
+
+    def _descartar(self, driver):
+        """Cierra una sesión rota y libera su lugar en el pool."""
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self._creadas -= 1
+
+    def _adquirir(self):
+        while True:
+            try:
+                driver = self._libres.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    puede_crear = self._creadas < self.max_sesiones
+                    if puede_crear:
+                        self._creadas += 1
+                if puede_crear:
+                    try:
+                        return self._iniciar_driver()
+                    except Exception:
+                        with self._lock:
+                            self._creadas -= 1
+                        raise
+                # Pool completo: esperar una sesión libre (re-evaluando por si se descartó alguna)
+                try:
+                    driver = self._libres.get(timeout=1)
+                except queue.Empty:
+                    continue
+
+            if sesion_saludable(driver):
+                return driver
+            print("    ♻️ Sesión de Chrome caída detectada: se reemplaza por una nueva.")
+            self._descartar(driver)
+
+    def _liberar(self, driver):
+        if self._cerrado:
+            self._descartar(driver)
+            return
+        try:
+            resetear_estado_sesion(driver)
+        except Exception:
+            pass
+        if sesion_saludable(driver):
+            self._libres.put(driver)
+        else:
+            self._descartar(driver)
+
+    @contextmanager
+    def sesion(self):
+        """Presta una sesión sana del pool y la devuelve reseteada al terminar."""
+        driver = self._adquirir()
+        try:
+            yield driver
+        finally:
+            self._liberar(driver)
+
+    def cerrar(self):
+        """Cierra todos los navegadores del pool."""
+        self._cerrado = True
+        while True:
+            try:
+                driver = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(driver)
+
+# ---
+## Intercepción de Red (Bloqueo de Terceros y Grabación/Reproducción)
+# ---
+
+class ClienteCDP:
+    """
+    Conexión CDP propia (websocket) a la pestaña de una sesión de Chrome, además de la de
+    chromedriver. `execute_cdp_cmd` no recibe eventos, y `Fetch.requestPaused` hace falta para
+    servir respuestas grabadas. Los eventos se atienden en un pool chico de hilos para que un
+    handler pueda enviar comandos y esperar su respuesta sin bloquear la lectura.
+    """
+
+    def __init__(self, ws_url, manejar_evento, hilos=4):
+        self._ws = websocket.create_connection(ws_url, timeout=30, suppress_origin=True, enable_multithread=True)
+        # El timeout es solo para conectarse: la lectura espera sin límite (puede no haber mensajes
+        # durante toda la estabilización) y `cerrar()` la destraba cerrando el socket
+        self._ws.settimeout(None)
+        self._ids = itertools.count(1)
+        self._respuestas = {}
+        self._lock = threading.Lock()
+        self._manejar_evento = manejar_evento
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos)
+        self._abierto = True
+        self._lector = threading.Thread(target=self._leer, daemon=True)
+        self._lector.start()
+
+    @staticmethod
+    def url_pestana(driver):
+        """webSocketDebuggerUrl de la pestaña de la sesión (cada sesión del pool tiene una sola)."""
+        direccion = driver.capabilities['goog:chromeOptions']['debuggerAddress']
+        with urllib.request.urlopen(f"http://{direccion}/json/list", timeout=10) as respuesta:
+            objetivos = json.loads(respuesta.read().decode('utf-8'))
+        return next(o['webSocketDebuggerUrl'] for o in objetivos if o.get('type') == 'page')
+
+    def _leer(self):
+        while self._abierto:
+            try:
+                mensaje = json.loads(self._ws.recv())
+            except websocket.WebSocketTimeoutException:
+                continue
+            except Exception:
+                break
+            if 'id' in mensaje:
+                with self._lock:
+                    espera = self._respuestas.pop(mensaje['id'], None)
+                if espera is not None:
+                    espera.put(mensaje)
+            elif 'method' in mensaje:
+                self._ejecutor.submit(self._manejar_evento, self, mensaje['method'], mensaje.get('params', {}))
+        self._abierto = False
+
+    def enviar(self, metodo, params=None, timeout=30):
+        """Envía un comando y espera su resultado; lanza RuntimeError si CDP responde con error."""
+        id_mensaje = next(self._ids)
+        espera = queue.Queue(maxsize=1)
+        with self._lock:
+            self._respuestas[id_mensaje] = espera
+        self._ws.send(json.dumps({'id': id_mensaje, 'method': metodo, 'params': params or {}}))
+        try:
+            mensaje = espera.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError(f"Sin respuesta CDP para {metodo}")
+        if 'error' in mensaje:
+            raise RuntimeError(f"{metodo}: {mensaje['error'].get('message')}")
+        return mensaje.get('result', {})
+
+    def cerrar(self):
+        self._abierto = False
+        try:
+            self._ws.close()
+        except Exception:
+            pass
+        self._ejecutor.shutdown(wait=True)
+
+class GrabacionRed:
+    """
+    Respuestas grabadas en disco, indexadas por método + URL: `<clave>.json` (estado y headers)
+    y `<clave>.body` (cuerpo ya decodificado). Se graban solo las de dominios propios.
+    """
+
+    # Headers que dejan de ser válidos al servir el cuerpo decodificado desde disco
+    HEADERS_DESCARTADOS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+    def __init__(self, directorio=None):
+        self.directorio = DIRECTORIO_GRABACION if directorio is None else directorio
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def _ruta(self, metodo, url):
+        clave = hashlib.sha256(f"{metodo} {url}".encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.directorio, clave)
+
+    @staticmethod
+    def es_grabable(url, url_pagina):
+        """Dominio propio: el host de la página o alguno de DOMINIOS_GRABABLES (o un subdominio)."""
+        host = urllib.parse.urlsplit(url).hostname or ''
+        propios = (urllib.parse.urlsplit(url_pagina).hostname or '',) + tuple(DOMINIOS_GRABABLES)
+        return any(host == dominio or host.endswith('.' + dominio) for dominio in propios if dominio)
+
+    def guardar(self, metodo, url, estado, headers, cuerpo):
+        base = self._ruta(metodo, url)
+        headers = [h for h in headers if h['name'].lower() not in self.HEADERS_DESCARTADOS]
+        _escribir_atomico(f"{base}.body", cuerpo)
+        _escribir_atomico(f"{base}.json", json.dumps({'url': url, 'estado': estado, 'headers': headers}).encode('utf-8'))
+
+    def obtener(self, metodo, url):
+        """(estado, headers, cuerpo) grabados para esa petición; None si no hay."""
+        base = self._ruta(metodo, url)
+        try:
+            with open(f"{base}.json", 'r', encoding='utf-8') as f:
+                entrada = json.load(f)
+            with open(f"{base}.body", 'rb') as f:
+                cuerpo = f.read()
+        except (OSError, ValueError):
+            return None
+        return entrada['estado'], entrada['headers'], cuerpo
+
+class InterceptorRed:
+    """
+    Intercepta las peticiones de una captura con CDP Fetch según MODO_GRABACION:
+    'grabar' guarda las respuestas propias (etapa Response) y 'reproducir' las sirve desde disco
+    (etapa Request). Al reproducir, lo no grabado falla si REPRODUCCION_ESTRICTA (corrida offline).
+    """
+
+    def __init__(self, driver, url_pagina, modo, grabacion):
+        self.url_pagina = url_pagina
+        self.modo = modo
+        self.grabacion = grabacion
+        self.conteos = {'grabadas': 0, 'reproducidas': 0, 'fallidas': 0, 'continuadas': 0}
+        self._lock = threading.Lock()
+        self._cliente = ClienteCDP(ClienteCDP.url_pestana(driver), self._manejar_evento)
+        etapa = 'Response' if modo == 'grabar' else 'Request'
+        self._cliente.enviar('Fetch.enable', {'patterns': [{'urlPattern': '*', 'requestStage': etapa}]})
+
+    def _contar(self, clave):
+        with self._lock:
+            self.conteos[clave] += 1
+
+    def _manejar_evento(self, cliente, metodo, params):
+        if metodo != 'Fetch.requestPaused':
+            return
+        id_peticion = params['requestId']
+        peticion = params['request']
+        try:
+            if self.modo == 'grabar':
+                self._grabar(cliente, id_peticion, peticion, params)
+            else:
+                self._reproducir(cliente, id_peticion, peticion)
+        except Exception:
+            # La página nunca debe quedar con una petición pausada
+            try:
+                cliente.enviar('Fetch.continueRequest', {'requestId': id_peticion})
+            except Exception:
+                pass
+
+    def _grabar(self, cliente, id_peticion, peticion, params):
+        estado = params.get('responseStatusCode')
+        if (estado is not None and 200 <= estado < 300 and peticion['method'] == 'GET'
+                and GrabacionRed.es_grabable(peticion['url'], self.url_pagina)):
+            resultado = cliente.enviar('Fetch.getResponseBody', {'requestId': id_peticion})
+            cuerpo = base64.b64decode(resultado['body']) if resultado.get('base64Encoded') else resultado['body'].encode('utf-8')
+            self.grabacion.guardar(peticion['method'], peticion['url'], estado, params.get('responseHeaders', []), cuerpo)
+            self._contar('grabadas')
+        cliente.enviar('Fetch.continueRequest', {'requestId': id_peticion})
+
+    def _reproducir(self, cliente, id_peticion, peticion):
+        grabada = self.grabacion.obtener(peticion['method'], peticion['url'])
+        if grabada is not None:
+            estado, headers, cuerpo = grabada
+            cliente.enviar('Fetch.fulfillRequest', {'requestId': id_peticion, 'responseCode': estado, 'responseHeaders': headers,
+                                                    'body': base64.b64encode(cuerpo).decode('ascii')})
+            self._contar('reproducidas')
+        elif REPRODUCCION_ESTRICTA:
+            cliente.enviar('Fetch.failRequest', {'requestId': id_peticion, 'errorReason': 'InternetDisconnected'})
+            self._contar('fallidas')
+        else:
+            cliente.enviar('Fetch.continueRequest', {'requestId': id_peticion})
+            self._contar('continuadas')
+
+    def cerrar(self):
+        try:
+            self._cliente.enviar('Fetch.disable', timeout=5)
+        except Exception:
+            pass
+        self._cliente.cerrar()
+
+def aplicar_bloqueo_red(driver, patrones=None):
+    """Bloquea (o desbloquea, con lista vacía) las URLs de PATRONES_BLOQUEADOS en la sesión."""
+    patrones = (PATRONES_BLOQUEADOS if BLOQUEO_RED_HABILITADO else []) if patrones is None else patrones
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(patrones)})
     except Exception as e:
-        print(f"❌ Error al inicializar/ejecutar Selenium en {url}: {e}")
-        data = [{'selector': 'FATAL ERROR', 'y': 0, 'height': 0, 'x': 0, 'width': 0}]
-    
+        if patrones:
+            print(f"    ⚠️ No se pudo aplicar el bloqueo de red vía CDP: {e}")
+
+@contextmanager
+def interceptar_red(driver, url, etiqueta="", metricas=None, modo_grabacion=None):
+    """
+    Aplica el bloqueo de terceros y, si MODO_GRABACION lo pide, intercepta la captura para grabar
+    o reproducir respuestas. Los conteos de la intercepción quedan en `metricas['red']`.
+    """
+    modo_grabacion = MODO_GRABACION if modo_grabacion is None else modo_grabacion
+    aplicar_bloqueo_red(driver)
+    interceptor = None
+    if modo_grabacion != 'desactivada':
+        try:
+            interceptor = InterceptorRed(driver, url, modo_grabacion, GrabacionRed())
+        except Exception as e:
+            print(f"    ⚠️ [{etiqueta}] No se pudo iniciar la intercepción de red ({modo_grabacion}): {e}")
+    try:
+        yield interceptor
     finally:
-        if driver:
-            driver.quit()
-            
+        if interceptor is not None:
+            interceptor.cerrar()
+            print(f"    🛰️ [{etiqueta}] Red ({modo_grabacion}): " + ", ".join(f"{v} {k}" for k, v in interceptor.conteos.items() if v))
+            if metricas is not None:
+                metricas['red'] = dict(interceptor.conteos)
+
+# ---
+## Función para Ejecutar una Captura sobre una Sesión del Pool
+# ---
+
+def navegar_a_url(driver, url, modo_recarga=None):
+    """
+    Navega a la URL según el modo de recarga (ver MODOS_RECARGA) y espera document.readyState.
+    Devuelve los segundos de navegación (separados del tiempo de estabilización).
+    """
+    modo_recarga = MODO_RECARGA if modo_recarga is None else modo_recarga
+    inicio = time.time()
+
+    # El estado de la caché se fija en cada captura porque las sesiones del pool se reutilizan
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setCacheDisabled', {'cacheDisabled': modo_recarga == 'sin_cache'})
+    except Exception:
+        if modo_recarga == 'sin_cache':
+            print("    ⚠️ No se pudo deshabilitar la caché vía CDP; se navega con la caché por defecto.")
+
+    driver.get(url)
+    if modo_recarga == 'cache_caliente':
+        driver.refresh()
+
+    # Espera de 20 segundos para document.readyState
+    WebDriverWait(driver, 20).until(lambda d: d.execute_script("return document.readyState") == "complete")
+    return time.time() - inicio
+
+def ajustar_viewport(driver, viewport):
+    """Lleva la ventana de la sesión al viewport (ancho, alto) sin relanzar Chrome."""
+    ancho, alto = viewport
+    actual = driver.get_window_size()
+    if (actual['width'], actual['height']) != (ancho, alto):
+        driver.set_window_size(ancho, alto)
+
+def ejecutar_selenium_por_viewports(url, etiqueta="", viewports=None, pool=None):
+    """
+    Toma UNA sesión del pool y captura la URL en cada viewport, redimensionando la ventana entre
+    uno y otro (la caché HTTP de la sesión queda caliente para los siguientes).
+    Devuelve una lista (data, png, metricas, segundos) en el orden de `viewports`.
+    Sin `pool` se usa un pool temporal de una sola sesión (inicia y cierra Chrome).
+    """
+    viewports = viewports or [(VENTANA_ANCHO, VENTANA_ALTO)]
+    pool_propio = pool is None
+    if pool_propio:
+        pool = PoolDrivers(1)
+
+    resultados = []
+    try:
+        with pool.sesion() as driver:
+            for viewport in viewports:
+                inicio = time.time()
+                metricas = {}
+                bytes_inicio = bytes_webdriver(driver)
+                etiqueta_viewport = etiqueta if len(viewports) == 1 else f"{etiqueta} {format_viewport(viewport)}"
+                try:
+                    with medir_fase(metricas, 'ajuste de viewport', driver):
+                        ajustar_viewport(driver, viewport)
+                    with interceptar_red(driver, url, etiqueta_viewport, metricas):
+                        with medir_fase(metricas, 'navegación', driver):
+                            metricas['navegacion_s'] = navegar_a_url(driver, url)
+                        print(f"  [{etiqueta_viewport}] Obteniendo datos estructurales...")
+                        data, png = obtener_estructura_dom(driver, etiqueta_viewport, metricas)
+                except Exception as e:
+                    print(f"❌ [{etiqueta_viewport}] Error al ejecutar Selenium en {url}: {e}")
+                    data, png = estructura_error(), None
+                metricas['webdriver_bytes'] = bytes_webdriver(driver) - bytes_inicio
+                resultados.append((data, png, metricas, time.time() - inicio))
+
+    except Exception as e:
+        print(f"❌ [{etiqueta}] Error al inicializar Selenium para {url}: {e}")
+
+    finally:
+        if pool_propio:
+            pool.cerrar()
+
+    # Viewports que no llegaron a capturarse (la sesión no pudo iniciarse)
+    resultados += [(estructura_error(), None, {}, 0.0)] * (len(viewports) - len(resultados))
+    return resultados
+
+def ejecutar_selenium_para_estructura(url, etiqueta="", pool=None, metricas=None, viewport=None):
+    """
+    Toma una sesión del pool, navega a la URL y llama a la extracción (un solo viewport).
+    Sin `pool` se usa un pool temporal de una sola sesión (inicia y cierra Chrome).
+    `metricas` (dict opcional) recibe los tiempos medidos durante la captura.
+    """
+    data, png, metricas_captura, _ = ejecutar_selenium_por_viewports(url, etiqueta, [viewport] if viewport else None, pool)[0]
+    if metricas is not None:
+        metricas.update(metricas_captura)
     return data, png
 
-# === SCRIPT PRINCIPAL ===
+# ---
+## Backend de Captura CDP Asíncrono (Varias Pestañas desde un Solo Event Loop)
+# ---
 
-if __name__ == "__main__":
-    
-    # 1. MAPEO DE URLS A TESTEAR 
-    BASE_URLS_MAP = {
-          "https://artear-tn-sandbox.cdn.arcpublishing.com/": "Homepage",
-          "https://artear-tn-sandbox.cdn.arcpublishing.com/ultimas-noticias/": "Listado",
-          "https://artear-tn-sandbox.cdn.arcpublishing.com/videos/": "Videos",
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/envivo/24hs/": "Vivo",
-          "https://artear-tn-sandbox.cdn.arcpublishing.com/clima/": "Clima",
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/economia/divisas/dolar-oficial-hoy/": "Divisas",
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/podcasts/2025/05/14/soy-adoptada-una-identidad-dicha-con-orgullo/": "Podcast",
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/deportes/estadisticas/": "Estadisticas",
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/quinielas-loterias/": "Quinielas",
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/juegos/": "Juegos",
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/elecciones-2025/": "Elecciones",
-          # TIPOS DE NOTAS
-          # Article
-          "https://artear-tn-sandbox.cdn.arcpublishing.com/internacional/2024/12/09/los-rebeldes-sirios-apuran-la-transicion-para-evitar-conflictos-internos-y-la-irrupcion-del-estado-islamico/": "Article",
-          # AMP
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/politica/2024/12/09/el-gobierno-salio-al-cruce-de-kicillof-tras-el-anuncio-de-que-quiere-quedarse-con-aerolineas-argentinas/?outputType=amp": "AMP",
-          # Video
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/videos/deportes/futbol/2025/11/10/preocupacion-en-river-maxi-meza-se-lesiono-en-el-superclasico-y-salio-de-la-cancha-llorando/": "Video",
-          # Video Dark
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/videos/autos/clasicos/2024/05/09/la-inedita-foto-del-nuevo-suv-con-estilo-coupe-que-este-ano-llegara-a-la-argentina/": "Video Dark",
-          # Longform c/fondo
-          "https://artear-tn-sandbox.cdn.arcpublishing.com/policiales/2025/05/13/estafadores-de-america-asi-opera-la-banda-que-ofrece-prestamos-millonarios-con-el-cuento-de-la-caja-fuerte/": "Longform c/fondo",
-          # Longform s/fondo
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/deportes/2025/01/30/se-avecina-un-temporal-que-pondra-a-prueba-a-varias-regiones-del-pais/": "Longform s/fondo",
-          # Liveblogging
-          "https://artear-tn-sandbox.cdn.arcpublishing.com/deportes/futbol/2025/11/13/inglaterra-vs-serbia-en-vivo-por-la-fase-de-grupos-de-las-eliminatorias-uefa-hora-donde-ver-y-formaciones/": "Liveblogging",
-          # Newsletter
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/policiales/2024/03/26/suscribite-y-recibi-los-newsletters-de-canaletti-los-casos-policiales-que-mas-repercusion-traen-a-la-sociedad-argentina/": "Newsletter",
-          # Historia
-         # "https://artear-tn-sandbox.cdn.arcpublishing.com/autor/2025/02/21/test-historia/": "Historia",
-          # Recipe
-          # No aplica a TN. 
-              }
-    
-    
-    # 2. MANEJO DEL ARGUMENTO DE LÍNEA DE COMANDOS (Recibe la versión)
-    
-    if len(sys.argv) < 2:
-        print("\n❌ ERROR: Debe proporcionar el número de versión como argumento.")
-        print("Uso: python regresion3.py [NUMERO_DE_VERSION]")
-        print("Ejemplo: python regresion3.py 170")
-        sys.exit(1)
+def _js_como_expresion(script, *args, asincrono=False):
+    """
+    Adapta un script escrito para Selenium (usa `return` y `arguments`) a una expresión de
+    Runtime.evaluate. Con `asincrono` el último argumento es el callback (execute_async_script)
+    y la expresión devuelve una promesa.
+    """
+    funcion = f"(function() {{ {script} \n}})"
+    argumentos = json.dumps(list(args))
+    if asincrono:
+        return f"new Promise(function(resolver) {{ {funcion}.apply(null, {argumentos}.concat([resolver])); }})"
+    return f"{funcion}.apply(null, {argumentos})"
 
-    version_number = sys.argv[1]
-    
+def buscar_binario_chrome():
+    """Ruta del ejecutable de Chrome/Chromium para el backend CDP (RuntimeError si no hay)."""
+    candidatos = [CHROME_BINARIO, os.environ.get('CHROME_BIN')]
+    candidatos += [shutil.which(nombre) for nombre in ('google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser', 'chrome')]
+    candidatos += [os.path.join(os.environ.get(variable, ''), 'Google', 'Chrome', 'Application', 'chrome.exe')
+                   for variable in ('PROGRAMFILES', 'PROGRAMFILES(X86)', 'LOCALAPPDATA')]
+    for candidato in candidatos:
+        if candidato and os.path.isfile(candidato):
+            return candidato
+    raise RuntimeError("No se encontró Chrome para el backend CDP (definir CHROME_BIN o CHROME_BINARIO).")
+
+class NavegadorCDP:
+    """
+    Chrome headless lanzado por el script y manejado por CDP sobre UN websocket (sesiones
+    'flatten' por pestaña). Las respuestas se resuelven por id (los eventos no se usan: la espera
+    de carga y la extracción van por Runtime.evaluate); los bytes de cada pestaña se acumulan en
+    su `bytes_webdriver`.
+    """
+
+    def __init__(self, binario=None):
+        self.binario = binario
+        self._proceso = None
+        self._directorio = None
+        self._ws = None
+        self._lector = None
+        self._siguiente_id = 0
+        self._pendientes = {}
+        self._pestanas = {}
+
+    async def iniciar(self, timeout=30):
+        binario = self.binario or buscar_binario_chrome()
+        os.makedirs(DIRECTORIO_TEMPORAL, exist_ok=True)
+        self._directorio = tempfile.mkdtemp(prefix='chrome_cdp_', dir=DIRECTORIO_TEMPORAL)
+        argumentos = [a for a in crear_opciones_chrome().arguments if not a.startswith('--log-level')]
+        self._proceso = subprocess.Popen(
+            [binario, *argumentos, '--remote-debugging-port=0', f'--user-data-dir={self._directorio}',
+             '--no-first-run', '--no-default-browser-check', '--hide-scrollbars', '--mute-audio', 'about:blank'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Chrome escribe el puerto y la ruta del websocket del navegador en DevToolsActivePort
+        archivo_puerto = os.path.join(self._directorio, 'DevToolsActivePort')
+        limite = time.time() + timeout
+        while True:
+            try:
+                with open(archivo_puerto, 'r', encoding='utf-8') as f:
+                    puerto, ruta = f.read().split()[:2]
+                break
+            except (OSError, ValueError):
+                if self._proceso.poll() is not None or time.time() > limite:
+                    raise RuntimeError("Chrome no abrió el puerto de depuración remota.")
+                await asyncio.sleep(0.1)
+
+        self._ws = await websockets.connect(f"ws://127.0.0.1:{puerto}{ruta}", max_size=None)
+        self._lector = asyncio.create_task(self._leer())
+
+    async def _leer(self):
+        try:
+            async for mensaje in self._ws:
+                datos = json.loads(mensaje)
+                pestana = self._pestanas.get(datos.get('sessionId'))
+                if pestana is not None:
+                    pestana.bytes_webdriver += len(mensaje)
+                futuro = self._pendientes.pop(datos.get('id'), None)
+                if futuro is not None and not futuro.done():
+                    if 'error' in datos:
+                        futuro.set_exception(RuntimeError(f"CDP: {datos['error'].get('message')}"))
+                    else:
+                        futuro.set_result(datos.get('result', {}))
+        finally:
+            # Conexión cerrada: nadie va a responder lo pendiente
+            for futuro in list(self._pendientes.values()):
+                if not futuro.done():
+                    futuro.set_exception(RuntimeError("CDP: se cerró la conexión con Chrome."))
+
+    async def enviar(self, metodo, params=None, sesion=None, timeout=60):
+        self._siguiente_id += 1
+        mensaje = {'id': self._siguiente_id, 'method': metodo, 'params': params or {}}
+        if sesion:
+            mensaje['sessionId'] = sesion
+        futuro = asyncio.get_running_loop().create_future()
+        self._pendientes[self._siguiente_id] = futuro
+        texto = json.dumps(mensaje)
+        if sesion in self._pestanas:
+            self._pestanas[sesion].bytes_webdriver += len(texto)
+        await self._ws.send(texto)
+        try:
+            return await asyncio.wait_for(futuro, timeout)
+        finally:
+            self._pendientes.pop(mensaje['id'], None)
+
+    async def nueva_pestana(self):
+        """Pestaña en un contexto de navegador propio (cookies/storage aislados, como una sesión limpia)."""
+        contexto = (await self.enviar('Target.createBrowserContext', {'disposeOnDetach': True}))['browserContextId']
+        objetivo = (await self.enviar('Target.createTarget', {'url': 'about:blank', 'browserContextId': contexto}))['targetId']
+        sesion = (await self.enviar('Target.attachToTarget', {'targetId': objetivo, 'flatten': True}))['sessionId']
+        pestana = PestanaCDP(self, sesion, objetivo, contexto)
+        self._pestanas[sesion] = pestana
+        return pestana
+
+    async def cerrar_pestana(self, pestana):
+        self._pestanas.pop(pestana.sesion, None)
+        try:
+            await self.enviar('Target.closeTarget', {'targetId': pestana.objetivo}, timeout=10)
+            await self.enviar('Target.disposeBrowserContext', {'browserContextId': pestana.contexto}, timeout=10)
+        except Exception:
+            pass
+
+    async def cerrar(self):
+        try:
+            if self._ws is not None:
+                await self._ws.close()
+            if self._lector is not None:
+                await asyncio.gather(self._lector, return_exceptions=True)
+        finally:
+            if self._proceso is not None:
+                self._proceso.terminate()
+                try:
+                    self._proceso.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self._proceso.kill()
+            if self._directorio:
+                shutil.rmtree(self._directorio, ignore_errors=True)
+
+class PestanaCDP:
+    """Una pestaña del `NavegadorCDP` con los pasos de captura equivalentes a los de Selenium."""
+
+    def __init__(self, navegador, sesion, objetivo, contexto):
+        self.navegador = navegador
+        self.sesion = sesion
+        self.objetivo = objetivo
+        self.contexto = contexto
+        # Bytes CDP de la pestaña (mismo nombre que el contador de WebDriver, para `medir_fase`)
+        self.bytes_webdriver = 0
+
+    def enviar(self, metodo, params=None, timeout=60):
+        return self.navegador.enviar(metodo, params, self.sesion, timeout)
+
+    async def evaluar(self, script, *args, asincrono=False, timeout=60):
+        """Equivalente a execute_script / execute_async_script sobre la pestaña."""
+        resultado = await self.enviar('Runtime.evaluate', {
+            'expression': _js_como_expresion(script, *args, asincrono=asincrono),
+            'returnByValue': True,
+            'awaitPromise': asincrono,
+        }, timeout)
+        if 'exceptionDetails' in resultado:
+            raise RuntimeError(f"JS: {resultado['exceptionDetails'].get('text')}")
+        return resultado.get('result', {}).get('value')
+
+    async def preparar(self):
+        """Bloqueo de red, caché, neutralización de popups y user agent (una vez por pestaña)."""
+        await self.enviar('Network.enable')
+        await self.enviar('Network.setBlockedURLs', {'urls': list(PATRONES_BLOQUEADOS) if BLOQUEO_RED_HABILITADO else []})
+        await self.enviar('Network.setCacheDisabled', {'cacheDisabled': MODO_RECARGA == 'sin_cache'})
+        await self.enviar('Network.setUserAgentOverride', {'userAgent': USER_AGENT})
+        if NEUTRALIZACION_INYECTADA:
+            await self.enviar('Page.addScriptToEvaluateOnNewDocument', {'source': construir_script_neutralizacion()})
+
+    async def ajustar_viewport(self, viewport):
+        ancho, alto = viewport
+        await self.enviar('Emulation.setDeviceMetricsOverride', {'width': ancho, 'height': alto, 'deviceScaleFactor': 1, 'mobile': False})
+
+    async def _esperar_document_completo(self, timeout=20):
+        limite = time.time() + timeout
+        while await self.evaluar("return document.readyState;") != 'complete':
+            if time.time() > limite:
+                raise TimeoutError("document.readyState no llegó a 'complete'.")
+            await asyncio.sleep(0.1)
+
+    async def navegar(self, url):
+        """Igual que `navegar_a_url`: navega según MODO_RECARGA y espera document.readyState."""
+        inicio = time.time()
+        respuesta = await self.enviar('Page.navigate', {'url': url}, timeout=60)
+        if respuesta.get('errorText'):
+            raise RuntimeError(f"Navegación fallida: {respuesta['errorText']}")
+        if MODO_RECARGA == 'cache_caliente':
+            await self._esperar_document_completo()
+            await self.enviar('Page.reload')
+        await self._esperar_document_completo()
+        return time.time() - inicio
+
+    async def esperar_estabilizacion(self):
+        """Igual que `esperar_estabilizacion` (mismo script de página), sobre CDP."""
+        inicio = time.time()
+        try:
+            resultado = await self.evaluar(JS_ESPERAR_ESTABILIZACION, ESTABILIZACION_VENTANA_QUIETA_MS, ESTABILIZACION_TOPE_S * 1000,
+                                           asincrono=True, timeout=ESTABILIZACION_TOPE_S + 10)
+            return {'segundos': resultado['ms'] / 1000.0, 'estable': bool(resultado['estable'])}
+        except Exception:
+            return {'segundos': time.time() - inicio, 'estable': False}
+
+    async def limpiar(self):
+        if not await self.evaluar("return !!window.__regresionNeutralizacion;"):
+            await self.evaluar(JS_ELIMINAR_POPUPS)
+
+    async def capturar_pantalla(self, viewport, etiqueta=""):
+        """
+        Captura de la página completa (bytes PNG) con Page.captureScreenshot más allá del viewport.
+        En modo por teselas cada tesela es un recorte (clip) de la página, sin scroll, y se escribe
+        por filas en un PNG temporal en disco, igual que `capturar_pagina_por_teselas`.
+        """
+        ancho, alto_tesela = viewport
+        # Misma altura que el backend Selenium (JS_ALTURA_TOTAL) para que V1/V2 sean comparables
+        total_height = int(await self.evaluar(JS_ALTURA_TOTAL))
+
+        async def recorte(y, alto):
+            respuesta = await self.enviar('Page.captureScreenshot', {
+                'format': 'png', 'captureBeyondViewport': True,
+                'clip': {'x': 0, 'y': y, 'width': ancho, 'height': alto, 'scale': 1},
+            }, timeout=120)
+            return base64.b64decode(respuesta['data'])
+
+        if not usar_captura_por_teselas(total_height):
+            return await recorte(0, total_height)
+
+        print(f"     🧩 [{etiqueta}] Página de {total_height}px: captura por teselas en disco.")
+        escritor = EscritorPNGPorFilas(ruta_temporal_captura(), ancho, total_height)
+        for y in range(0, total_height, alto_tesela):
+            alto = min(alto_tesela, total_height - y)
+            tesela = cv2.imdecode(np.frombuffer(await recorte(y, alto), np.uint8), cv2.IMREAD_COLOR)
+            escritor.agregar_filas(tesela[:alto, :ancho])
+        return escritor.cerrar()
+
+    async def estabilizar(self, etiqueta, metricas):
+        """Limpieza, espera adaptativa y scrolls de carga lazy (la primera mitad de `obtener_estructura_dom`)."""
+        with medir_fase(metricas, 'limpieza', self):
+            await self.limpiar()
+        with medir_fase(metricas, 'estabilización', self):
+            esperas = [await self.esperar_estabilizacion()]
+        with medir_fase(metricas, 'limpieza', self):
+            await self.limpiar()
+        with medir_fase(metricas, 'carga lazy (scrolls)', self):
+            for scroll in SCROLLS_CARGA_CONTENIDO:
+                await self.evaluar(scroll)
+                esperas.append(await self.esperar_estabilizacion())
+
+        metricas['estabilizacion_s'] = sum(e['segundos'] for e in esperas)
+        metricas['estabilizacion_tope'] = not all(e['estable'] for e in esperas)
+        print(f"     ⏱️ [{etiqueta}] Página estabilizada en {metricas['estabilizacion_s']:.1f}s" + (" (se alcanzó el tope de espera)" if metricas['estabilizacion_tope'] else ""))
+
+    async def extraer_y_capturar(self, etiqueta, metricas, viewport):
+        """Extracción del DOM y captura de pantalla (la segunda mitad de `obtener_estructura_dom`)."""
+        print(f"     📐 [{etiqueta}] Extrayendo posiciones y dimensiones del DOM (X, Y, W, H)...")
+        with medir_fase(metricas, 'extracción DOM', self):
+            data = decodificar_estructura(await self.evaluar(JS_EXTRAER_ESTRUCTURA))
+        print(f"     📸 [{etiqueta}] Tomando captura de pantalla para el reporte...")
+        with medir_fase(metricas, 'captura de pantalla', self):
+            png = await self.capturar_pantalla(viewport, etiqueta)
+        return data, png
+
+class _PuntoEncuentro:
+    """Espera a que lleguen las `partes` pestañas de un par antes de seguir (barrera de un solo uso)."""
+
+    def __init__(self, partes):
+        self.faltan = partes
+        self._evento = asyncio.Event()
+
+    async def llegar(self):
+        self.faltan -= 1
+        if self.faltan <= 0:
+            self._evento.set()
+        await self._evento.wait()
+
+class MotorCDP:
+    """
+    Backend de captura asíncrono: un solo Chrome headless (se lanza con la primera captura) y un
+    event loop en un hilo propio que maneja hasta `max_pestanas` trabajos a la vez (un trabajo
+    pareado usa dos pestañas).
+    `capturar` es sincrónica y devuelve lo mismo que `ejecutar_selenium_por_viewports`, así que
+    el planificador, la caché y la comparación no cambian; `capturar_par` hace lo mismo para
+    V1 y V2 a la vez.
+    """
+
+    def __init__(self, max_pestanas):
+        if websockets is None:
+            raise RuntimeError("El backend CDP requiere el paquete 'websockets' (pip install websockets).")
+        self.max_pestanas = max_pestanas
+        self._loop = asyncio.new_event_loop()
+        self._hilo = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._hilo.start()
+        self._navegador = None
+        self._inicio = None
+        self._semaforo = None
+
+    async def _obtener_navegador(self):
+        # Un único arranque aunque lleguen varias capturas a la vez
+        if self._inicio is None:
+            self._semaforo = asyncio.Semaphore(self.max_pestanas)
+            self._navegador = NavegadorCDP()
+            self._inicio = asyncio.ensure_future(self._navegador.iniciar())
+        await asyncio.shield(self._inicio)
+        return self._navegador
+
+    async def _capturar_viewport(self, pestana, url, etiqueta, viewport, encuentro=None):
+        """
+        Captura la URL en un viewport. Con `encuentro` (modo pareado) espera a la otra pestaña
+        del par entre la estabilización y la extracción, para que V1 y V2 se midan en el mismo
+        momento; se llega al encuentro aunque la carga falle, así la otra pestaña no queda esperando.
+        """
+        inicio = time.time()
+        metricas = {}
+        try:
+            try:
+                with medir_fase(metricas, 'ajuste de viewport', pestana):
+                    await pestana.ajustar_viewport(viewport)
+                with medir_fase(metricas, 'navegación', pestana):
+                    metricas['navegacion_s'] = await pestana.navegar(url)
+                print(f"  [{etiqueta}] Obteniendo datos estructurales (CDP)...")
+                await pestana.estabilizar(etiqueta, metricas)
+            finally:
+                if encuentro is not None:
+                    with medir_fase(metricas, 'sincronización V1/V2', pestana):
+                        await encuentro.llegar()
+            data, png = await pestana.extraer_y_capturar(etiqueta, metricas, viewport)
+        except Exception as e:
+            print(f"❌ [{etiqueta}] Error en la captura CDP de {url}: {e}")
+            data, png = estructura_error(), None
+        metricas['webdriver_bytes'] = sum(span.get('bytes', 0) for span in metricas.get('fases', []))
+        return data, png, metricas, time.time() - inicio
+
+    async def _capturar(self, urls, etiquetas, viewports):
+        """Una pestaña por URL (todas a la vez, cada una en su contexto); una lista de capturas por URL."""
+        navegador = await self._obtener_navegador()
+        resultados = [[] for _ in urls]
+        async with self._semaforo:
+            pestanas = []
+            try:
+                for _ in urls:
+                    pestanas.append(await navegador.nueva_pestana())
+                await asyncio.gather(*(pestana.preparar() for pestana in pestanas))
+                for viewport in viewports:
+                    encuentro = _PuntoEncuentro(len(pestanas)) if len(pestanas) > 1 else None
+                    capturas = await asyncio.gather(*(
+                        self._capturar_viewport(pestana, url, etiqueta if len(viewports) == 1 else f"{etiqueta} {format_viewport(viewport)}", viewport, encuentro)
+                        for pestana, url, etiqueta in zip(pestanas, urls, etiquetas)))
+                    for lista, captura in zip(resultados, capturas):
+                        lista.append(captura)
+            finally:
+                await asyncio.gather(*(navegador.cerrar_pestana(pestana) for pestana in pestanas))
+        return resultados
+
+    def _ejecutar(self, urls, etiquetas, viewports):
+        viewports = viewports or [(VENTANA_ANCHO, VENTANA_ALTO)]
+        try:
+            return asyncio.run_coroutine_threadsafe(self._capturar(urls, etiquetas, viewports), self._loop).result()
+        except Exception as e:
+            print(f"❌ [{' / '.join(etiquetas)}] Error al inicializar el backend CDP para {', '.join(urls)}: {e}")
+            return [[(estructura_error(), None, {}, 0.0)] * len(viewports) for _ in urls]
+
+    def capturar(self, url, etiqueta="", viewports=None):
+        """Captura la URL en cada viewport en UNA pestaña. Devuelve una lista (data, png, metricas, segundos)."""
+        return self._ejecutar([url], [etiqueta], viewports)[0]
+
+    def capturar_par(self, url1, url2, etiquetas=("V1", "V2"), viewports=None):
+        """
+        Captura V1 y V2 en dos pestañas del mismo Chrome que cargan y se estabilizan a la vez y
+        se extraen/capturan en el mismo punto. Devuelve (capturas_v1, capturas_v2) como `capturar`.
+        """
+        return tuple(self._ejecutar([url1, url2], list(etiquetas), viewports))
+
+    def cerrar(self):
+        """Cierra Chrome y detiene el event loop."""
+        if self._navegador is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._navegador.cerrar(), self._loop).result(timeout=30)
+            except Exception:
+                pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._hilo.join(timeout=10)
+
+def capturar_por_viewports(url, etiqueta, viewports, pool):
+    """Captura con el backend del pool: `MotorCDP` (asíncrono) o `PoolDrivers` (Selenium)."""
+    if isinstance(pool, MotorCDP):
+        return pool.capturar(url, etiqueta, viewports)
+    return ejecutar_selenium_por_viewports(url, etiqueta, viewports, pool)
+
+# ---
+## Huella de Página y Caché Persistente de Capturas Base (V2)
+# ---
+
+def _descargar_html(url, timeout=20):
+    """(ETag, HTML) de la URL; None si no se pudo descargar."""
     try:
-        if not version_number.isdigit() or not version_number:
-            raise ValueError("El argumento de versión debe ser numérico y no puede estar vacío.")
-    except ValueError as e:
-        print(f"❌ Error: {e}")
-        sys.exit(1)
-        
-    # --- FIN DE MANEJO DEL ARGUMENTO ---
+        pedido = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+        with urllib.request.urlopen(pedido, timeout=timeout) as respuesta:
+            return respuesta.headers.get('ETag'), respuesta.read().decode('utf-8', errors='replace')
+    except Exception as e:
+        print(f"    ⚠️ No se pudo calcular la huella de {url}: {e}")
+        return None
 
-    # GENERAR TIMESTAMP ÚNICO PARA ESTA EJECUCIÓN
-    TIMESTAMP_EJECUCION = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+def _urls_bundles(html):
+    """URLs (ordenadas, sin repetir) de los bundles JS/CSS referenciados en el HTML."""
+    return sorted(set(re.findall(r'<(?:script|link)\b[^>]*?(?:src|href)=["\']([^"\']+\.(?:js|css)(?:\?[^"\']*)?)["\']', html, re.IGNORECASE)))
 
-    all_comparisons_data = [] 
-    start_time_global = time.time()
+def huella_pagina(url, timeout=20):
+    """
+    Huella del contenido servido para una URL, usada para saber si el sandbox cambió:
+    el ETag del HTML si el servidor lo envía o, si no, un hash de las URLs de los bundles
+    JS/CSS referenciados (incluyen el hash/número de deploy). None si no se pudo obtener.
+    """
+    descargado = _descargar_html(url, timeout)
+    if descargado is None:
+        return None
+    etag, html = descargado
 
-    print(f"\n INICIANDO PROCESO DE REGRESIÓN DESKTOP - SBX VERSIÓN {version_number}\n ")    
-    
-    # 3. LOOPEAR Y EJECUTAR PRUEBA PARA CADA URL BASE
-    for idx, (base_url, url_description) in enumerate(BASE_URLS_MAP.items()):
-        
-        start_time_url = time.time() 
-        url_id = re.sub(r'[^a-zA-Z0-9]', '_', url_description).lower()
+    if etag and not etag.startswith('W/'):
+        return f"etag:{etag}"
+    bundles = _urls_bundles(html)
+    if bundles:
+        return "bundles:" + hashlib.sha256("\n".join(bundles).encode('utf-8')).hexdigest()
+    return "html:" + hashlib.sha256(html.encode('utf-8')).hexdigest()
 
-        # 3.1 Construir URLs
-        
-        # V1: URL con el parámetro de versión (la que quieres probar)
-        if '?' in base_url:
-            url1 = f"{base_url}&d={version_number}"
-        else:
-            url1 = f"{base_url}?d={version_number}"
+def _escribir_atomico(ruta, contenido):
+    """Escribe bytes en `ruta` a través de un archivo temporal (nunca deja archivos a medias)."""
+    temporal = f"{ruta}.{threading.get_ident()}.tmp"
+    with open(temporal, 'wb') as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
 
-        # V2: URL sin el parámetro de versión (la base actual/sbx)
-        url2 = base_url
-        
-        domain_name = re.sub(r'[^a-zA-Z0-9]', '_', url1.split('//')[-1]).strip('_')
-        if not domain_name: domain_name = "home"
-        domain_name = domain_name[:40]
+def huella_configuracion_captura():
+    """
+    Hash de todas las opciones que cambian lo que captura Chrome (backend, recarga, captura por
+    teselas, neutralización/reserva de ads, bloqueo y grabación de red, user agent, esperas y
+    extractor). Forma parte de la clave de la `CacheCapturasBase`: una captura base tomada con
+    otra configuración no se compara contra una V1 nueva.
+    """
+    opciones = {
+        'backend': BACKEND_CAPTURA,
+        'recarga': MODO_RECARGA,
+        'captura': [MODO_CAPTURA, ALTURA_MAX_CAPTURA_COMPLETA],
+        'neutralizacion': construir_script_neutralizacion() if NEUTRALIZACION_INYECTADA else JS_ELIMINAR_POPUPS,
+        'reservar_ads': RESERVAR_CAJAS_ADS,
+        'bloqueo': sorted(PATRONES_BLOQUEADOS) if BLOQUEO_RED_HABILITADO else None,
+        'grabacion': [MODO_GRABACION, sorted(DOMINIOS_GRABABLES)] if MODO_GRABACION != 'desactivada' else None,
+        'user_agent': USER_AGENT,
+        'estabilizacion': [ESTABILIZACION_VENTANA_QUIETA_MS, ESTABILIZACION_TOPE_S],
+        'extractor': JS_EXTRAER_ESTRUCTURA,
+    }
+    return hashlib.sha256(json.dumps(opciones, sort_keys=True).encode('utf-8')).hexdigest()[:16]
 
-        print(f"\n==================================================================================")
-        print(f"[{idx + 1}/{len(BASE_URLS_MAP)}] | Página: {url_description}")
+class CacheCapturasBase:
+    """
+    Caché en disco de las capturas V2 (URL base sin versión) entre ejecuciones.
 
+    Cada entrada (estructura DOM en JSON + PNG + índice de teselas) se indexa por URL, viewport, huella del
+    contenido servido (`huella_pagina`) y configuración de captura (`huella_configuracion_captura`): mientras el sandbox no se redeploye, las corridas
+    siguientes reutilizan la captura base en lugar de volver a abrir Chrome. Las entradas
+    vencen por antigüedad y, si el directorio supera el tamaño máximo, se borran las más viejas.
+    Si el índice de teselas de una captura nueva coincide con el de la entrada anterior de la misma
+    página, el PNG se enlaza (hardlink) en lugar de volver a escribirse.
+    """
 
-        # 3.2 Obtener Datos DOM y Capturas
-        print("  [V1] Obteniendo datos estructurales...")
-        data_v1, png_v1 = ejecutar_selenium_para_estructura(url1)
-        
-        print("\n  [V2] Obteniendo datos estructurales...")
-        data_v2, png_v2 = ejecutar_selenium_para_estructura(url2)
+    def __init__(self, directorio=None, max_edad_h=None, max_mb=None):
+        self.directorio = os.path.join(CACHE_DIR, 'capturas_base') if directorio is None else directorio
+        self.max_edad_s = (CACHE_BASE_MAX_EDAD_H if max_edad_h is None else max_edad_h) * 3600
+        self.max_bytes = (CACHE_BASE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+        self._lock = threading.Lock()
+        # Las opciones se fijan antes de la corrida (argumentos de línea de comandos)
+        self.configuracion = huella_configuracion_captura()
+        os.makedirs(self.directorio, exist_ok=True)
 
-        
-        # 3.3 Comparar Estructuras
-        if 'FATAL ERROR' in [d['selector'] for d in data_v1 + data_v2 if isinstance(d.get('selector'), str)]:
-            fallas = [{'selector': 'FATAL ERROR (Revisar logs)', 'tipo': 'DIFERENCIA AGRUPADA GRAVE', 'diff': 'N/A', 'v1': 'N/A', 'v2': 'Error grave en la ejecución de Selenium.', 'coords_v2': {'x':0, 'y':0, 'width':0, 'height':0}}]
-            selectores_fallidos = []
-        else:
-            print("\n  🔍 Comparando estructuras DOM (X, Y, W, H)...")
-            fallas, selectores_fallidos = comparar_estructura_dom(data_v1, data_v2, UMBRAL_PIXELES_TOLERANCIA)
-
-
-        # 3.4 Filtrado de fallas no marcables
-        fallas_filtradas = []
-        for f in fallas:
-            coords = f.get('coords_v2', {'x':0, 'y':0, 'width':0, 'height':0})
-            x1 = int(coords['x'])
-            y1 = int(coords['y'])
-            x2 = int(coords['x'] + coords['width'])
-            y2 = int(coords['y'] + coords['height'])
-            
-            if x2 > x1 and y2 > y1:
-                fallas_filtradas.append(f)
-        
-        fallas = fallas_filtradas 
-        
-        # 3.5 Marcado Visual en la Captura de V2 (Ahora usa la lista filtrada)
-        png_v2_marcado = png_v2
-        # Las fallas graves son aquellas cuyo tipo contiene 'GRAVE'
-        fallas_graves = [f for f in fallas if 'GRAVE' in f['tipo']] 
-        
-        if fallas:
-            print(f"  🔴🔵 Marcando visualmente las diferencias en la captura V2 (si existen)")
-            png_v2_marcado = marcar_fallas_en_captura(png_v2, fallas, data_v2) 
-            
-        
-        # 3.6 Reporte y Métrica
-        end_time_url = time.time()
-        time_elapsed_url = end_time_url - start_time_url
-        
-        final_alert_color = "red" if fallas_graves else "green"
-        
-        # Guardar capturas de pantalla 
-        # NOTA: Nombres y asignación para el reporte invertido:
-        # filename2_diff: V1 (Con versión) SIN marcar.
-        # filename1: V2 (Base sin versión) MARCADA.
-        # --- CORRECCIÓN SOLICITADA: Usar 'url_id' en lugar de 'domain_name' ---
-        filename2_diff = f"{url_id}_V{version_number}_base_{TIMESTAMP_EJECUCION}.png" 
-        filename1 = f"{url_id}_V{version_number}_diff_{TIMESTAMP_EJECUCION}.png" 
-        # ---------------------------------------------------------------------
-        
-        if png_v1: Image.open(io.BytesIO(png_v1)).save(os.path.join(output_dir, filename2_diff)) 
-        if png_v2_marcado: 
-            Image.open(io.BytesIO(png_v2_marcado)).save(os.path.join(output_dir, filename1)) 
+    def _clave(self, url, viewport, huella):
+        crudo = json.dumps([VERSION_FORMATO_CACHE, url, list(viewport), huella, self.configuracion])
+        return hashlib.sha256(crudo.encode('utf-8')).hexdigest()[:32]
 
-        # Generar HTML de las fallas detallado
-        fallas_html_detalle = "<ul>"
-        
-        for i, f in enumerate(fallas):
-            coords = f.get('coords_v2', {'x':0, 'y':0, 'width':0, 'height':0})
-            
-            item_v2_original = next((item for item in data_v2 if item['selector'] == f['selector']), None)
-            
-            # --- Construcción del selector simplificado ---
-            display_selector = ""
-            if item_v2_original:
-                if item_v2_original.get('class_attr'):
-                    display_selector += f"class={item_v2_original['class_attr'][:50]}"
-                
-                if item_v2_original.get('id_attr'):
-                    if display_selector:
-                        display_selector += " / "
-                    display_selector += f"id={item_v2_original['id_attr']}"
-                
-                if not display_selector:
-                    display_selector = f['selector'].split(' > ')[-1]
+    def _rutas(self, clave):
+        base = os.path.join(self.directorio, clave)
+        return f"{base}.json", f"{base}.png", f"{base}.npz"
+
+    def _ruta_ultima(self, url, viewport):
+        """Archivo con la clave de la última entrada guardada para la página (sin importar la huella)."""
+        crudo = json.dumps([VERSION_FORMATO_CACHE, url, list(viewport), self.configuracion])
+        return os.path.join(self.directorio, f"{hashlib.sha256(crudo.encode('utf-8')).hexdigest()[:32]}.ultima")
+
+    def _png_previo_identico(self, ruta_ultima, indice):
+        """
+        PNG de la última entrada de la página si su índice de teselas coincide tesela a tesela con
+        `indice` (redeploy sin cambios visuales); None si no hay o difiere.
+        """
+        if indice is None:
+            return None
+        try:
+            with open(ruta_ultima, 'r', encoding='utf-8') as f:
+                _, ruta_png, ruta_indice = self._rutas(f.read().strip())
+        except OSError:
+            return None
+        previo = cargar_indice_teselas(ruta_indice)
+        if previo is None or (previo['ancho'], previo['alto']) != (indice['ancho'], indice['alto']):
+            return None
+        distintas = teselas_distintas(previo, indice)
+        return ruta_png if distintas is not None and not distintas.any() and os.path.exists(ruta_png) else None
+
+    def obtener(self, url, viewport, huella):
+        """
+        Devuelve (estructura, png, índice de teselas) si hay una captura válida para esa huella;
+        None si no. El índice es None en entradas guardadas sin él.
+        """
+        if huella is None:
+            return None
+        ruta_json, ruta_png, ruta_indice = self._rutas(self._clave(url, viewport, huella))
+        try:
+            if time.time() - os.path.getmtime(ruta_json) > self.max_edad_s:
+                return None
+            with open(ruta_json, 'r', encoding='utf-8') as f:
+                entrada = json.load(f)
+            if usar_captura_por_teselas(dimensiones_png(ruta_png)[1]):
+                # Páginas muy altas: se usa el archivo de la caché sin cargarlo en memoria
+                png = ruta_png
             else:
-                 display_selector = f['selector'][:50] + "..."
-            # -----------------------------------------------------------------
+                with open(ruta_png, 'rb') as f:
+                    png = f.read()
+        except (OSError, ValueError):
+            return None
+        return entrada['estructura'], png, cargar_indice_teselas(ruta_indice)
 
-            coords_str = f"{int(coords['x'])},{int(coords['y'])},{int(coords['width'])},{int(coords['height'])}"
+    def guardar(self, url, viewport, huella, estructura, png, indice=None):
+        """Guarda una captura base exitosa y aplica el límite de tamaño del directorio."""
+        if huella is None or png is None or estructura_tiene_error(estructura):
+            return
+        clave = self._clave(url, viewport, huella)
+        ruta_json, ruta_png, ruta_indice = self._rutas(clave)
+        ruta_ultima = self._ruta_ultima(url, viewport)
+        entrada = {'url': url, 'viewport': list(viewport), 'huella': huella, 'creado': time.time(), 'estructura': estructura}
+        with self._lock:
+            previo = self._png_previo_identico(ruta_ultima, indice)
+            if previo is not None:
+                # Mismo contenido visual que la entrada anterior: se enlaza su PNG en lugar de reescribirlo
+                if previo != ruta_png:
+                    temporal = f"{ruta_png}.{threading.get_ident()}.tmp"
+                    try:
+                        os.link(previo, temporal)
+                    except OSError:
+                        shutil.copyfile(previo, temporal)
+                    os.replace(temporal, ruta_png)
+            elif es_captura_en_disco(png):
+                temporal = f"{ruta_png}.{threading.get_ident()}.tmp"
+                shutil.copyfile(png, temporal)
+                os.replace(temporal, ruta_png)
+            else:
+                _escribir_atomico(ruta_png, png)
+            if indice is not None:
+                temporal = f"{ruta_indice}.{threading.get_ident()}.tmp"
+                guardar_indice_teselas(indice, temporal)
+                os.replace(temporal, ruta_indice)
+            _escribir_atomico(ruta_json, json.dumps(entrada).encode('utf-8'))
+            _escribir_atomico(ruta_ultima, clave.encode('utf-8'))
+            self.purgar()
 
-            # Usar el nuevo campo 'tipo' para determinar el color (DIFERENCIA AGRUPADA GRAVE/MENOR)
-            color = 'red' if 'GRAVE' in f['tipo'] else '#007bff' 
-            
-            detalle_consolidado = f['v2'] 
-            tipo_resumen = f['tipo'].replace('AGRUPADA ', '')
-            
-            fallas_html_detalle += f"""
-            <li class='diff-item' 
-                style='color: {color}; border-bottom: 1px dotted #ccc; padding: 5px 0; cursor: pointer;'
-                onclick="highlightElement('{url_id}', '{coords_str}', this)"
-                data-coords="{coords_str}"
-                data-selector="{f['selector']}"
-                data-id="item-{url_id}-{i}"
-                >
-                <span style="font-weight: bold;">Elemento:</span> <code>{display_selector}</code> 
-                <br><span style="font-weight: bold;">Resultado Agrupado:</span> <span style='color:{color};'>{tipo_resumen}</span>
-                {detalle_consolidado}
-            </li>
-            """
-        if not fallas:
-             fallas_html_detalle += "<li>✅ No se encontraron diferencias.</li>"
-        fallas_html_detalle += "</ul>"
-        
-        # Almacenar métricas
-        all_comparisons_data.append({
-            'base_url': base_url,
-            'description': url_description, 
-            'url1': url1,
-            'url2': url2,
-            # Contamos solo fallas graves para el resultado final
-            'diff_count': len(fallas_graves), 
-            'alert_color': final_alert_color, 
-            'html_fallas_detalle': fallas_html_detalle,
-            'filename2_diff': filename2_diff, # Usa el nombre de archivo ÚNICO
-            'filename1': filename1, # Usa el nombre de archivo ÚNICO
-            'time_elapsed': format_time(time_elapsed_url),
-            'url_id': url_id 
-        })
-        
-        # Salida en Consola
-        if final_alert_color == 'red':
-            result_msg = f'❌ SE DETECTARON {len(fallas_graves)} DIFERENCIAS (Graves/Ausentes/Nuevos)'
-            result_color = '\033[91m' 
-        else:
-            result_msg = '✅ PASÓ LA PRUEBA'
-            result_color = '\033[92m' 
-        
-        print(f"\n  {result_color}RESULTADO: {result_msg}\033[0m")
-        print(f"  Tiempo total para esta URL: {format_time(time_elapsed_url)}\n")
-    
+    def purgar(self):
+        """Borra entradas vencidas y, si se supera el tamaño máximo, las más antiguas."""
+        entradas = {}
+        for nombre in os.listdir(self.directorio):
+            clave, extension = os.path.splitext(nombre)
+            if extension not in ('.json', '.png', '.npz', '.ultima'):
+                continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                estado = os.stat(ruta)
+            except OSError:
+                continue
+            datos = entradas.setdefault(clave, {'rutas': [], 'bytes': 0, 'mtime': estado.st_mtime})
+            datos['rutas'].append(ruta)
+            # Los PNG enlazados entre entradas ocupan disco una sola vez
+            datos['bytes'] += estado.st_size // max(1, estado.st_nlink)
+            datos['mtime'] = min(datos['mtime'], estado.st_mtime)
+
+        ahora = time.time()
+        total = sum(datos['bytes'] for datos in entradas.values())
+        for clave, datos in sorted(entradas.items(), key=lambda item: item[1]['mtime']):
+            if ahora - datos['mtime'] <= self.max_edad_s and total <= self.max_bytes:
+                continue
+            for ruta in datos['rutas']:
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+            total -= datos['bytes']
+
+# ---
+## Modo Incremental (Solo Páginas que Cambiaron entre V1 y V2)
+# ---
+
+def huella_bundles(url, timeout=20):
+    """
+    Huella comparable ENTRE variantes: hash de las URLs de bundles JS/CSS que sirve la página
+    (a diferencia de `huella_pagina`, nunca usa el ETag ni el HTML, que cambian con `?d=`).
+    None si no se pudo descargar o no referencia bundles.
+    """
+    descargado = _descargar_html(url, timeout)
+    if descargado is None:
+        return None
+    bundles = _urls_bundles(descargado[1])
+    return "bundles:" + hashlib.sha256("\n".join(bundles).encode('utf-8')).hexdigest() if bundles else None
+
+class HistorialResultados:
+    """
+    Último resultado de cada página (por `url_id`) junto con copias de sus capturas, para poder
+    volver a mostrarlo en el reporte cuando el modo incremental omite la página.
+    """
+
+    def __init__(self, directorio=None):
+        self.directorio = os.path.join(CACHE_DIR, 'resultados') if directorio is None else directorio
+        os.makedirs(self.directorio, exist_ok=True)
+
+    @staticmethod
+    def _archivos(resultado):
+        """Archivos del resultado, relativos a output_dir (capturas, índices de teselas y snapshots DOM)."""
+        archivos = []
+        for nombre in (resultado.get('filename2_diff'), resultado.get('filename1')):
+            if nombre:
+                archivos += [nombre, os.path.basename(ruta_indice_teselas(nombre)), os.path.basename(ruta_snapshot_dom(nombre))]
+        return archivos
+
+    def guardar(self, resultado, version_number, huellas=None):
+        """Reemplaza el resultado guardado de la página y copia sus capturas desde output_dir."""
+        directorio_pagina = os.path.join(self.directorio, resultado['url_id'])
+        shutil.rmtree(directorio_pagina, ignore_errors=True)
+        os.makedirs(directorio_pagina)
+        for nombre in self._archivos(resultado):
+            origen = os.path.join(output_dir, nombre)
+            if os.path.exists(origen):
+                shutil.copyfile(origen, os.path.join(directorio_pagina, os.path.basename(nombre)))
+        entrada = {'formato': VERSION_FORMATO_RESULTADOS, 'version': version_number, 'creado': time.time(),
+                   'huellas': huellas, 'resultado': resultado}
+        _escribir_atomico(os.path.join(directorio_pagina, 'resultado.json'), json.dumps(entrada, default=_json_por_defecto).encode('utf-8'))
+
+    def obtener(self, url_id):
+        """Entrada guardada de la página (con formato vigente); None si no hay."""
+        try:
+            with open(os.path.join(self.directorio, url_id, 'resultado.json'), 'r', encoding='utf-8') as f:
+                entrada = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entrada if entrada.get('formato') == VERSION_FORMATO_RESULTADOS else None
+
+    def restaurar(self, entrada):
+        """Copia las capturas guardadas a output_dir y devuelve el resultado marcado como reutilizado."""
+        resultado = dict(entrada['resultado'])
+        for nombre in self._archivos(resultado):
+            origen = os.path.join(self.directorio, resultado['url_id'], os.path.basename(nombre))
+            destino = os.path.join(output_dir, nombre)
+            if os.path.exists(origen) and not os.path.exists(destino):
+                shutil.copyfile(origen, destino)
+        resultado['reutilizado'] = {
+            'version': entrada['version'],
+            'fecha': datetime.datetime.fromtimestamp(entrada['creado']).strftime("%d/%m/%Y %H:%M"),
+        }
+        return resultado
+
+def planificar_incremental(paginas, historial, max_workers):
+    """
+    Calcula en paralelo la huella de bundles de V1 y V2 de cada página. Las que sirven los mismos
+    bundles en ambas variantes y tienen un resultado anterior se omiten y reutilizan ese resultado.
+    Devuelve (índices a probar, {índice: resultado reutilizado}).
+    """
+    # Una descarga por URL aunque la página aparezca en varios viewports
+    urls = sorted({url for p in paginas for url in (p['url1'], p['url2'])})
+    with ThreadPoolExecutor(max_workers=max(1, max_workers * 2)) as executor:
+        huella_por_url = dict(zip(urls, executor.map(huella_bundles, urls)))
+    huellas = [{'V1': huella_por_url[p['url1']], 'V2': huella_por_url[p['url2']]} for p in paginas]
+
+    a_probar, reutilizados = [], {}
+    for idx, (pagina, huellas_pagina) in enumerate(zip(paginas, huellas)):
+        pagina['huellas'] = huellas_pagina
+        sin_cambios = huellas_pagina['V1'] is not None and huellas_pagina['V1'] == huellas_pagina['V2']
+        entrada = historial.obtener(pagina['url_id']) if sin_cambios else None
+        if entrada is None:
+            a_probar.append(idx)
+            continue
+        reutilizados[idx] = historial.restaurar(entrada)
+        print(f"  ♻️ {pagina['description']}: V1 y V2 sirven los mismos bundles; se reutiliza el resultado de V{entrada['version']}.")
+    return a_probar, reutilizados
+
+# ---
+## Matriz de Páginas (Archivo de Configuración)
+# ---
+
+def _parsear_viewport(valor):
+    """'1920x1080' o [1920, 1080] -> (1920, 1080)."""
+    if isinstance(valor, str):
+        valor = valor.lower().split('x')
+    ancho, alto = (int(v) for v in valor)
+    if ancho <= 0 or alto <= 0:
+        raise ValueError
+    return ancho, alto
+
+def parsear_shard(valor):
+    """'2/4' -> (2, 4): shard número 2 (desde 1) de 4. Para el argumento --shard."""
+    try:
+        shard, total = (int(v) for v in valor.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard inválido '{valor}' (formato esperado: i/N, Ej: 2/4)")
+    if total < 1 or not 1 <= shard <= total:
+        raise argparse.ArgumentTypeError(f"shard inválido '{valor}': debe cumplirse 1 <= i <= N")
+    return shard, total
+
+def seleccionar_shard(paginas, shard, total_shards):
+    """
+    Índices (ordenados) de las entradas de la matriz que le tocan al shard `shard` de `total_shards`.
+    Las páginas se reparten en round-robin en el orden de la matriz, con todos sus viewports en el
+    mismo shard (son un único trabajo por variante): el reparto es determinista para una misma
+    matriz y los shards quedan parejos en cantidad de páginas.
+    """
+    grupos = {}
+    for idx, pagina in enumerate(paginas):
+        grupos.setdefault((pagina['url1'], pagina['url2']), []).append(idx)
+    return sorted(idx for n, indices in enumerate(grupos.values()) if n % total_shards == shard - 1 for idx in indices)
+
+def cargar_matriz_paginas(ruta, version_number, plantillas=None, incluir_inactivas=False):
+    """
+    Lee la matriz de páginas (JSON) y la expande en una entrada por (página × viewport), con las
+    URLs V1/V2 ya armadas. Claves por página:
+      url, descripcion (obligatorias), plantilla, activa (por defecto true),
+      viewports (lista de "ANCHOxALTO"; por defecto la global del archivo),
+      umbral_pixeles, umbral_canal, mascaras (lista de [x, y, w, h]).
+    `plantillas` filtra por tipo de plantilla; `incluir_inactivas` prueba también las páginas con
+    "activa": false (la matriz completa). Lanza ValueError si el archivo es inválido.
+    """
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            matriz = json.load(f)
+    except OSError as e:
+        raise ValueError(f"No se pudo leer la matriz de páginas '{ruta}': {e}")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"La matriz de páginas '{ruta}' no es un JSON válido: {e}")
+
+    try:
+        viewports_globales = [_parsear_viewport(v) for v in matriz.get('viewports', [(VENTANA_ANCHO, VENTANA_ALTO)])]
+    except (TypeError, ValueError):
+        raise ValueError(f"Viewports inválidos en '{ruta}' (formato esperado: \"1920x1080\").")
+
+    paginas = []
+    for n, definicion in enumerate(matriz.get('paginas', []), start=1):
+        if not definicion.get('activa', True) and not incluir_inactivas:
+            continue
+        if plantillas and definicion.get('plantilla') not in plantillas:
+            continue
+        if not definicion.get('url') or not definicion.get('descripcion'):
+            raise ValueError(f"La página #{n} de '{ruta}' necesita 'url' y 'descripcion'.")
+        try:
+            viewports = [_parsear_viewport(v) for v in definicion['viewports']] if 'viewports' in definicion else viewports_globales
+        except (TypeError, ValueError):
+            raise ValueError(f"Viewports inválidos en la página '{definicion['descripcion']}'.")
+
+        url1, url2 = construir_urls_version(definicion['url'], version_number)
+        url_id_base = re.sub(r'[^a-zA-Z0-9]', '_', definicion['descripcion']).lower()
+        for viewport in viewports:
+            pagina = {
+                'base_url': definicion['url'],
+                'description': definicion['descripcion'],
+                'plantilla': definicion.get('plantilla'),
+                'viewport': viewport,
+                'url1': url1,
+                'url2': url2,
+                # El viewport por defecto conserva el id histórico (modo incremental, nombres de archivo)
+                'url_id': url_id_base if viewport == (VENTANA_ANCHO, VENTANA_ALTO) else f"{url_id_base}_{format_viewport(viewport)}",
+            }
+            for clave in ('umbral_pixeles', 'umbral_canal', 'mascaras'):
+                if clave in definicion:
+                    pagina[clave] = definicion[clave]
+            paginas.append(pagina)
+    return paginas
+
+# ---
+## Planificador de Capturas en Paralelo (Pool de Chrome)
+# ---
+
+def construir_urls_version(base_url, version_number):
+    """Devuelve (url1, url2): V1 con el parámetro de versión y V2 la URL base."""
+    # V1: URL con el parámetro de versión (la que quieres probar)
+    if '?' in base_url:
+        url1 = f"{base_url}&d={version_number}"
+    else:
+        url1 = f"{base_url}?d={version_number}"
+
+    # V2: URL sin el parámetro de versión (la base actual/sbx)
+    url2 = base_url
+    return url1, url2
+
+def _capturas_desde_cache(url, etiqueta, cache_base, viewports):
+    """
+    Capturas V2 reutilizables de la `CacheCapturasBase` (None en los viewports que faltan).
+    Devuelve (capturas, índices pendientes, huella de la página).
+    """
+    capturas = [None] * len(viewports)
+    huella = huella_pagina(url)
+    pendientes = []
+    for i, viewport in enumerate(viewports):
+        inicio = time.time()
+        metricas = {'cache_base': True}
+        with medir_fase(metricas, 'caché base'):
+            guardada = cache_base.obtener(url, viewport, huella)
+        if guardada is None:
+            pendientes.append(i)
+            continue
+        print(f"  ♻️ [{etiqueta} {format_viewport(viewport)}] Captura base reutilizada de la caché (huella sin cambios).")
+        data, png, indice = guardada
+        if indice is None:
+            with medir_fase(metricas, 'índice de teselas'):
+                indice = construir_indice_teselas(png)
+        capturas[i] = {'data': data, 'png': png, 'indice': indice, 'tiempo': time.time() - inicio, 'metricas': metricas}
+    return capturas, pendientes, huella
+
+def _completar_captura(capturada, url, viewport, cache_base=None, huella=None):
+    """Arma el índice de teselas de una captura recién tomada y, para V2, la guarda en la caché base."""
+    data, png, metricas, segundos = capturada
+    indice = None
+    if png:
+        with medir_fase(metricas, 'índice de teselas'):
+            indice = construir_indice_teselas(png)
+        metricas['indice_s'] = metricas['fases'][-1]['duracion_s']
+        segundos += metricas['indice_s']
+
+    if cache_base is not None:
+        cache_base.guardar(url, viewport, huella, data, png, indice)
+    return {'data': data, 'png': png, 'indice': indice, 'tiempo': segundos, 'metricas': metricas}
+
+def _captura_fallida(captura):
+    return captura or {'data': estructura_error(), 'png': None, 'indice': None, 'tiempo': 0.0, 'metricas': {}}
+
+def _capturar_con_tiempo(url, etiqueta, pool, cache_base=None, viewports=None):
+    """
+    Ejecuta las capturas de una URL (una por viewport, en una misma sesión) midiendo su duración.
+    Nunca propaga excepciones al planificador. Devuelve una captura por viewport, en orden.
+    Con `cache_base` (solo para V2) reutiliza las capturas guardadas si la huella de la página no cambió.
+    El índice de teselas se arma aquí, en el worker, mientras las otras sesiones siguen capturando.
+    """
+    viewports = viewports or [(VENTANA_ANCHO, VENTANA_ALTO)]
+    capturas = [None] * len(viewports)
+    try:
+        pendientes, huella = list(range(len(viewports))), None
+        if cache_base is not None:
+            capturas, pendientes, huella = _capturas_desde_cache(url, etiqueta, cache_base, viewports)
+
+        if pendientes:
+            capturadas = capturar_por_viewports(url, etiqueta, [viewports[i] for i in pendientes], pool)
+            for i, capturada in zip(pendientes, capturadas):
+                capturas[i] = _completar_captura(capturada, url, viewports[i], cache_base, huella)
+    except Exception as e:
+        print(f"❌ [{etiqueta}] Error inesperado en la captura de {url}: {e}")
+
+    return [_captura_fallida(captura) for captura in capturas]
+
+def _capturar_par_con_tiempo(url1, url2, etiquetas, motor, cache_base=None, viewports=None):
+    """
+    Igual que `_capturar_con_tiempo` pero para V1 y V2 juntas con `MotorCDP.capturar_par`
+    (modo pareado). Los viewports cuya V2 sale de la caché base se capturan solo en V1.
+    Devuelve {'V1': capturas, 'V2': capturas}, una por viewport y en orden.
+    """
+    viewports = viewports or [(VENTANA_ANCHO, VENTANA_ALTO)]
+    capturas_v1 = [None] * len(viewports)
+    capturas_v2 = [None] * len(viewports)
+    try:
+        pendientes, huella = list(range(len(viewports))), None
+        if cache_base is not None:
+            capturas_v2, pendientes, huella = _capturas_desde_cache(url2, etiquetas[1], cache_base, viewports)
+
+        if pendientes:
+            pares_v1, pares_v2 = motor.capturar_par(url1, url2, etiquetas, [viewports[i] for i in pendientes])
+            for i, capturada_v1, capturada_v2 in zip(pendientes, pares_v1, pares_v2):
+                capturas_v1[i] = _completar_captura(capturada_v1, url1, viewports[i])
+                capturas_v2[i] = _completar_captura(capturada_v2, url2, viewports[i], cache_base, huella)
+
+        solo_v1 = [i for i in range(len(viewports)) if i not in pendientes]
+        if solo_v1:
+            for i, capturada in zip(solo_v1, motor.capturar(url1, etiquetas[0], [viewports[i] for i in solo_v1])):
+                capturas_v1[i] = _completar_captura(capturada, url1, viewports[i])
+    except Exception as e:
+        print(f"❌ [{' / '.join(etiquetas)}] Error inesperado en la captura pareada de {url1}: {e}")
+
+    return {'V1': [_captura_fallida(c) for c in capturas_v1], 'V2': [_captura_fallida(c) for c in capturas_v2]}
+
+def ejecutar_capturas_en_paralelo(paginas, max_workers, procesar_pagina):
+    """
+    Lanza las capturas V1/V2 de TODAS las páginas sobre `max_workers` hilos que comparten
+    un `PoolDrivers` de `max_workers` sesiones de Chrome headless (se cierran al terminar).
+    Con BACKEND_CAPTURA == 'cdp' comparten en cambio un `MotorCDP`: un solo Chrome con hasta
+    `max_workers` pestañas manejadas desde un event loop; los hilos solo esperan y hacen el
+    trabajo de caché/índices.
+
+    Cada entrada de `paginas` es una combinación (página × viewport). Las entradas de una misma
+    página forman un trabajo por variante que captura todos sus viewports en UNA sesión,
+    redimensionando la ventana en lugar de relanzar Chrome.
+    Las capturas V2 (base) pasan por la `CacheCapturasBase` si está habilitada.
+    Con CAPTURA_PAREADA (requiere el backend 'cdp') V1 y V2 de cada página son UN trabajo que
+    las carga a la vez en dos pestañas (ver `_capturar_par_con_tiempo`).
+    Apenas terminan las dos capturas de una entrada se llama (en el hilo principal) a
+    `procesar_pagina(idx, pagina, captura_v1, captura_v2)`, liberando así la memoria de las PNG.
+    Los resultados se devuelven en el MISMO orden que `paginas`, sin importar el orden de finalización.
+    """
+    resultados = [None] * len(paginas)
+    capturas_pendientes = {}
+    pool = MotorCDP(max_workers) if BACKEND_CAPTURA == 'cdp' else PoolDrivers(max_workers)
+    cache_base = CacheCapturasBase() if CACHE_BASE_HABILITADA else None
+
+    # (url1, url2) -> índices de sus entradas, en orden de viewport
+    trabajos = {}
+    for idx, pagina in enumerate(paginas):
+        trabajos.setdefault((pagina['url1'], pagina['url2']), []).append(idx)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futuros = {}
+            for (url1, url2), indices in trabajos.items():
+                viewports = [paginas[idx]['viewport'] for idx in indices]
+                etiquetas = tuple(f"{variante} {paginas[indices[0]]['description']}" for variante in ('V1', 'V2'))
+                if CAPTURA_PAREADA:
+                    futuros[executor.submit(_capturar_par_con_tiempo, url1, url2, etiquetas, pool, cache_base, viewports)] = (indices, None)
+                    continue
+                for variante, url, etiqueta in zip(('V1', 'V2'), (url1, url2), etiquetas):
+                    cache = cache_base if variante == 'V2' else None
+                    futuros[executor.submit(_capturar_con_tiempo, url, etiqueta, pool, cache, viewports)] = (indices, variante)
+
+            for futuro in as_completed(futuros):
+                indices, variante = futuros[futuro]
+                por_variante = futuro.result() if variante is None else {variante: futuro.result()}
+                for variante, capturas_variante in por_variante.items():
+                    for idx, captura in zip(indices, capturas_variante):
+                        capturas = capturas_pendientes.setdefault(idx, {})
+                        capturas[variante] = captura
+
+                        if len(capturas) == 2:
+                            del capturas_pendientes[idx]
+                            resultados[idx] = procesar_pagina(idx, paginas[idx], capturas['V1'], capturas['V2'])
+    finally:
+        pool.cerrar()
+
+    return resultados
+
+# ---
+## Procesamiento de Resultados por Página (Comparación, Marcado y Detalle HTML)
+# ---
+
+def procesar_resultado_pagina(idx, total, pagina, captura_v1, captura_v2, version_number, timestamp_ejecucion):
+    """
+    Compara las capturas V1/V2 de una página, guarda las imágenes y arma su entrada para el reporte.
+    """
+    start_time_url = time.time()
+    metricas = {}
+    url_description = pagina['description']
+    url_id = pagina['url_id']
+
+    data_v1, png_v1 = captura_v1['data'], captura_v1['png']
+    data_v2, png_v2 = captura_v2['data'], captura_v2['png']
+
+    print(f"\n==================================================================================")
+    print(f"[{idx + 1}/{total}] | Página: {url_description}")
+    print(f"  [V1] Captura finalizada en {format_time(captura_v1['tiempo'])}")
+    print(f"  [V2] Captura finalizada en {format_time(captura_v2['tiempo'])}")
+
+    # Tiempo real que tardó cada variante en estabilizarse (identifica plantillas lentas)
+    estabilizacion = {
+        'V1': captura_v1['metricas'].get('estabilizacion_s'),
+        'V2': captura_v2['metricas'].get('estabilizacion_s'),
+        'tope': bool(captura_v1['metricas'].get('estabilizacion_tope') or captura_v2['metricas'].get('estabilizacion_tope')),
+    }
+    navegacion = {
+        'V1': captura_v1['metricas'].get('navegacion_s'),
+        'V2': captura_v2['metricas'].get('navegacion_s'),
+    }
+    print(f"  🌐 Navegación -> {format_segundos_variantes(navegacion)}")
+    print(f"  ⏱️ Estabilización -> {format_estabilizacion(estabilizacion)}")
+
+    # 3.3 Comparar Estructuras
+    if estructura_tiene_error(data_v1) or estructura_tiene_error(data_v2):
+        fallas = [{'selector': 'FATAL ERROR (Revisar logs)', 'tipo': 'DIFERENCIA AGRUPADA GRAVE', 'coords_v2': {'x':0, 'y':0, 'width':0, 'height':0}, 'gravedad': 'grave',
+                   'cambios': [{'tipo': 'ERROR DE CAPTURA', 'diff': None, 'v1': None, 'v2': None, 'mensaje': 'Error grave en la ejecución de Selenium.'}]}]
+        selectores_fallidos = []
+    else:
+        print("\n  🔍 Comparando estructuras DOM (X, Y, W, H)...")
+        fallas, selectores_fallidos = comparar_estructura_dom(data_v1, data_v2, pagina.get('umbral_pixeles', UMBRAL_PIXELES_TOLERANCIA), metricas=metricas)
+
+        if DIFF_PIXELES_HABILITADO and png_v1 and png_v2:
+            print("  🎨 Comparando píxeles V1/V2 por teselas...")
+            mascaras = regiones_dinamicas(data_v1, data_v2) + [tuple(m) for m in pagina.get('mascaras', [])]
+            with medir_fase(metricas, 'diferencia de píxeles'):
+                fallas_visuales = diferencia_visual_pixeles(png_v1, png_v2, mascaras, fallas, umbral_canal=pagina.get('umbral_canal'),
+                                                            indices=(captura_v1.get('indice'), captura_v2.get('indice')))
+            print(f"  🎨 Regiones con diferencias visuales: {len(fallas_visuales)}")
+            fallas += fallas_visuales
+
+
+    # 3.4 Filtrado de fallas no marcables (sin área en la captura V2)
+    fallas = [f for f in fallas if _es_marcable(f.get('coords_v2'))]
     
-    # 4. GENERAR REPORTE HTML FINAL
+    # 3.5 Marcado Visual en la Captura de V2 (Ahora usa la lista filtrada)
+    png_v2_marcado = png_v2
+    # Las fallas graves son aquellas cuyo tipo contiene 'GRAVE'
+    fallas_graves = [f for f in fallas if 'GRAVE' in f['tipo']] 
+    fallas_visuales = [f for f in fallas if 'VISUAL' in f['tipo']]
     
-    end_time_global = time.time()
-    time_elapsed_global = end_time_global - start_time_global
+    if fallas:
+        print(f"  🔴🔵 Marcando visualmente las diferencias en la captura V2 (si existen)")
+        png_v2_marcado = marcar_fallas_en_captura(png_v2, fallas, data_v2, metricas) 
+        
     
-    # El timestamp del archivo HTML es el mismo de las capturas
-    timestamp_html = TIMESTAMP_EJECUCION
-    html_file = os.path.join(output_dir, f"Reporte_DOM_Estructural_v{version_number}_{timestamp_html}.html")
+    # 3.6 Reporte y Métrica
+    # Con capturas en paralelo, el tiempo de la URL es la suma de sus dos capturas más el procesamiento.
+    end_time_url = time.time()
+    time_elapsed_url = captura_v1['tiempo'] + captura_v2['tiempo'] + (end_time_url - start_time_url)
     
-    formatted_time_global = format_time(time_elapsed_global)
+    final_alert_color = "red" if fallas_graves else "green"
     
-    # --- Generación del contenido detallado por URL ---
-    all_details_html = ""
-    sites_with_red_diff = sum(1 for data in all_comparisons_data if data['alert_color'] == 'red')
+    # Guardar capturas de pantalla 
+    # NOTA: Nombres y asignación para el reporte invertido:
+    # filename2_diff: V1 (Con versión) SIN marcar.
+    # filename1: V2 (Base sin versión) MARCADA.
+    # --- CORRECCIÓN SOLICITADA: Usar 'url_id' en lugar de 'domain_name' ---
+    filename2_diff = f"{url_id}_V{version_number}_base_{timestamp_ejecucion}.png" 
+    filename1 = f"{url_id}_V{version_number}_diff_{timestamp_ejecucion}.png" 
+    # ---------------------------------------------------------------------
     
-    for data in all_comparisons_data:
-        
-        display_name = data.get('description', data['base_url']) 
-        
-        if data['alert_color'] == 'red':
-            result_summary_text = f"❌ Se detectaron {data['diff_count']} diferencias graves."
-            result_color_style = "red"
-        else:
-            result_summary_text = "✅ No se encontraron diferencias graves."
-            result_color_style = "green"
-            
-            
-        result_summary = f"""
-        <p><strong>URL Base (V1):</strong> <code>{data['url1']}</code></p>
-        <p><strong>URL Comparada (V2):</strong> <code>{data['url2']}</code></p>
-        <p>
-            <strong>Resultado:</strong> 
-            <span style="font-weight: bold; color: {result_color_style}">
-            {result_summary_text}
-            </span>
-        </p>
-        <p><strong>Tiempo de Ejecución:</strong> {data['time_elapsed']}</p> 
-        """
-        
-        all_details_html += f"""
-        <div style="border: 2px solid #ddd; padding: 15px; margin-top: 20px; border-radius: 8px;">
-            <h2>{display_name}</h2>
-            {result_summary}
-            
-            <details>
-                <summary style="cursor: pointer; font-weight: bold; color: #1e3a8a; display: flex; align-items: center;">
-                    Detalle de diferencias (Rojo: Grave, Azul: Desplazamiento Menor)
-                    <span class="arrow-icon" style="font-size: 1.2em; margin-left: 10px; transition: transform 0.2s; display: inline-block;">&#9660;</span>
-                </summary>
-                <div id="diff-list-{data['url_id']}" class="diff-container" style="margin-top: 10px; background: #fff; padding: 10px; border: 1px solid #eee;">
-                    {data['html_fallas_detalle']}
-                </div>
-            </details>
-
-            <details>
-                <summary style="cursor: pointer; font-weight: bold; color: #1e3a8a; display: flex; align-items: center;">
-                    Contexto Visual
-                    <span class="arrow-icon" style="font-size: 1.2em; margin-left: 10px; transition: transform 0.2s; display: inline-block;">&#9660;</span>
-                </summary>
-            <div class='container' id='container-{data['url_id']}'>
-                <div>
-                    <h4>Versión No Promovida(V1)</h4>
-                    <img src='{data['filename2_diff']}' alt='Versión 1'>
-                </div>
-                <div id="image-container-{data['url_id']}" style="position: relative;">
-                    <h4>Versión Promovida (V2) - Diferencias graves (Rojo) o menores (Azul)</h4>
-                    <img id="screenshot-{data['url_id']}" src='{data['filename1']}' alt='Versión 2 (Diferencias)'>
-                    <div id="highlight-box-{data['url_id']}" class="highlight-box" style="display: none;"></div>
-                </div>
-            </div>
-            </details>
+    # Las capturas sin marcar se escriben tal cual llegaron de Chrome (bytes PNG crudos)
+    # o, si se tomaron por teselas, se mueven desde el directorio temporal sin releerlas.
+    with medir_fase(metricas, 'guardado de capturas'):
+        if png_v1: guardar_captura(png_v1, os.path.join(output_dir, filename2_diff))
+        if png_v2_marcado: 
+            if not es_captura_en_disco(png_v2_marcado):
+                filename1 = f"{url_id}_V{version_number}_diff_{timestamp_ejecucion}.{extension_imagen(png_v2_marcado)}" 
+            guardar_captura(png_v2_marcado, os.path.join(output_dir, filename1))
+        for captura in (png_v1, png_v2, png_v2_marcado):
+            descartar_captura_temporal(captura)
 
-        </div>
-        """
-        
+        # Índices de teselas junto a las capturas (el de V2 corresponde a la captura sin marcar)
+        if captura_v1.get('indice'): guardar_indice_teselas(captura_v1['indice'], ruta_indice_teselas(os.path.join(output_dir, filename2_diff)))
+        if captura_v2.get('indice'): guardar_indice_teselas(captura_v2['indice'], ruta_indice_teselas(os.path.join(output_dir, filename1)))
+
+    # Snapshots binarios de ambas estructuras DOM junto a sus capturas (historial comparable)
+    if SNAPSHOTS_DOM_HABILITADOS:
+        with medir_fase(metricas, 'snapshots DOM'):
+            for variante, data, nombre, url in (('V1', data_v1, filename2_diff, pagina['url1']), ('V2', data_v2, filename1, pagina['url2'])):
+                if not estructura_tiene_error(data):
+                    guardar_snapshot_dom(data, ruta_snapshot_dom(os.path.join(output_dir, nombre)), {
+                        'url': url, 'variante': variante, 'version': version_number, 'timestamp': timestamp_ejecucion,
+                        'viewport': list(pagina.get('viewport', (VENTANA_ANCHO, VENTANA_ALTO)))})
+    teselas = resumen_teselas(captura_v1.get('indice'), captura_v2.get('indice'))
+    print(f"  🧮 Teselas ({DIFF_PIXELES_TESELA}px) -> {format_resumen_teselas(teselas)}")
+
+    # Salida en Consola
+    if final_alert_color == 'red':
+        result_msg = f'❌ SE DETECTARON {len(fallas_graves)} DIFERENCIAS (Graves/Ausentes/Nuevos)'
+        result_color = '\033[91m' 
+    else:
+        result_msg = '✅ PASÓ LA PRUEBA'
+        result_color = '\033[92m' 
     
-    # --- Estructura Final del HTML y JS de Interacción ---
+    print(f"\n  {result_color}RESULTADO: {result_msg}\033[0m")
+    print(f"  Tiempo total para esta URL: {format_time(time_elapsed_url)}\n")
+
+    # Perfil de la página: fases de ambas capturas (en paralelo) y del procesamiento, en un mismo eje
+    perfil = {
+        'fases': [dict(span, etapa=etapa) for etapa, m in (('V1', captura_v1['metricas']), ('V2', captura_v2['metricas']), ('Comparación', metricas))
+                  for span in m.get('fases', [])],
+        'webdriver_bytes': {'V1': captura_v1['metricas'].get('webdriver_bytes'), 'V2': captura_v2['metricas'].get('webdriver_bytes')},
+        # Pico acumulado del proceso hasta esta página (no el consumo propio de la página)
+        'rss_pico_proceso_mb': pico_rss_mb(),
+    }
+
+    # Resultado de la página (se escribe al NDJSON de la corrida; el reporte HTML se arma desde ahí)
+    return {
+        'base_url': pagina['base_url'],
+        'description': url_description, 
+        'plantilla': pagina.get('plantilla'),
+        'viewport': list(pagina.get('viewport', (VENTANA_ANCHO, VENTANA_ALTO))),
+        'url1': pagina['url1'],
+        'url2': pagina['url2'],
+        # Contamos solo fallas graves para el resultado final
+        'diff_count': len(fallas_graves), 
+        'diff_visual_count': len(fallas_visuales),
+        'teselas': teselas,
+        'alert_color': final_alert_color, 
+        'fallas': fallas,
+        'filename2_diff': filename2_diff, # Usa el nombre de archivo ÚNICO
+        'filename1': filename1, # Usa el nombre de archivo ÚNICO
+        'tiempo_s': time_elapsed_url,
+        'captura_s': {'V1': captura_v1['tiempo'], 'V2': captura_v2['tiempo']},
+        'procesamiento_s': end_time_url - start_time_url,
+        'perfil': perfil,
+        'navegacion': navegacion,
+        'v2_desde_cache': bool(captura_v2['metricas'].get('cache_base')),
+        'estabilizacion': estabilizacion,
+        'url_id': url_id 
+    }
+
+# ---
+## Resultados Estructurados (NDJSON por Corrida)
+# ---
+
+# Cada corrida escribe en output_dir un NDJSON con una línea por registro:
+#   {'tipo': 'corrida', ...}  configuración de la corrida (primera línea)
+#   {'tipo': 'pagina', 'indice': i, ...}  resultado de cada página apenas termina de compararse
+#   {'tipo': 'fin', 'tiempo_total_s': ...}  solo si la corrida terminó
+# El reporte HTML se arma leyendo este archivo, así que una corrida interrumpida igual deja
+# resultados utilizables y el reporte se puede regenerar sin volver a capturar (--reporte).
+
+def sufijo_shard(shard):
+    """Sufijo de los archivos de una corrida parcial (--shard): '_shard2de4'; '' sin shard."""
+    return f"_shard{shard[0]}de{shard[1]}" if shard else ""
+
+def ruta_resultados(version_number, timestamp, shard=None):
+    return os.path.join(output_dir, f"Resultados_v{version_number}_{timestamp}{sufijo_shard(shard)}.ndjson")
+
+def ruta_perfil(version_number, timestamp, shard=None):
+    return os.path.join(output_dir, f"Perfil_v{version_number}_{timestamp}{sufijo_shard(shard)}.json")
+
+def ruta_reporte(version_number, timestamp, shard=None):
+    return os.path.join(output_dir, f"Reporte_DOM_Estructural_v{version_number}_{timestamp}{sufijo_shard(shard)}.html")
+
+def _json_por_defecto(valor):
+    """Serializa los escalares/arrays de NumPy que pueden quedar en las fallas."""
+    if isinstance(valor, (np.generic, np.ndarray)):
+        return valor.tolist()
+    raise TypeError(f"{type(valor).__name__} no es serializable a JSON")
+
+class ResultadosCorrida:
+    """Escritor del NDJSON de una corrida: cada registro se escribe y se vuelca a disco al instante."""
+
+    def __init__(self, ruta, corrida):
+        self.ruta = ruta
+        self._archivo = open(ruta, 'w', encoding='utf-8')
+        self._escribir(dict(corrida, tipo='corrida', formato=VERSION_FORMATO_RESULTADOS))
+
+    def _escribir(self, registro):
+        self._archivo.write(json.dumps(registro, default=_json_por_defecto, ensure_ascii=False) + "\n")
+        self._archivo.flush()
+
+    def agregar(self, indice, resultado):
+        """Registra el resultado de la entrada `indice` de la matriz."""
+        self._escribir(dict(resultado, tipo='pagina', indice=indice))
+
+    def cerrar(self, tiempo_total_s=None):
+        """Cierra el archivo; con `tiempo_total_s` marca la corrida como terminada."""
+        if tiempo_total_s is not None:
+            self._escribir({'tipo': 'fin', 'tiempo_total_s': tiempo_total_s})
+        self._archivo.close()
+
+def leer_resultados(ruta):
+    """
+    Recorre el NDJSON de una corrida sin retener las fallas de cada página.
+    Devuelve (corrida, fin, paginas): `fin` es None si la corrida se interrumpió y `paginas` es
+    una lista ordenada por índice de la matriz con {'indice', 'posicion', 'alert_color', 'reutilizado',
+    'url_id', 'tiempo_s', 'perfil'} (la posición en bytes permite releer cada página con
+    `cargar_paginas`; 'perfil' es el resumen de `resumir_perfil_pagina`).
+    """
+    corrida, fin, paginas = None, None, {}
+    with open(ruta, 'rb') as f:
+        while True:
+            posicion = f.tell()
+            linea = f.readline()
+            if not linea:
+                break
+            try:
+                registro = json.loads(linea)
+            except ValueError:
+                continue  # Línea cortada por una interrupción a mitad de escritura
+            if registro.get('tipo') == 'corrida':
+                corrida = registro
+            elif registro.get('tipo') == 'fin':
+                fin = registro
+            elif registro.get('tipo') == 'pagina':
+                paginas[registro['indice']] = {'indice': registro['indice'], 'posicion': posicion,
+                                               'alert_color': registro['alert_color'],
+                                               'reutilizado': bool(registro.get('reutilizado')),
+                                               'url_id': registro['url_id'], 'tiempo_s': registro['tiempo_s'],
+                                               'perfil': resumir_perfil_pagina(registro.get('perfil'))}
+    if corrida is None or corrida.get('formato') != VERSION_FORMATO_RESULTADOS:
+        raise ValueError(f"'{ruta}' no es un archivo de resultados de la corrida con formato {VERSION_FORMATO_RESULTADOS}.")
+    return corrida, fin, [paginas[indice] for indice in sorted(paginas)]
+
+def cargar_paginas(ruta, paginas):
+    """Relee de a una las páginas de `leer_resultados` (en su orden) desde el NDJSON."""
+    with open(ruta, 'rb') as f:
+        for pagina in paginas:
+            f.seek(pagina['posicion'])
+            yield json.loads(f.readline())
+
+def render_shards_corrida(corrida):
+    """Línea del resumen para corridas repartidas en shards (una parcial o la combinada)."""
+    if corrida.get('shard'):
+        shard, total = corrida['shard']
+        return f"<p><strong>Shard:</strong> {shard} de {total} (solo las páginas de este shard)</p>"
+    if corrida.get('shards'):
+        faltantes = corrida.get('shards_faltantes') or []
+        detalle = f" — ⚠️ faltan los shards {', '.join(map(str, faltantes))}" if faltantes else ""
+        return f"<p><strong>Shards:</strong> combinación de {corrida['shards']} shards{detalle}</p>"
+    return ""
+
+def render_resumen_corrida(corrida, fin, paginas, perfil):
+    """Resumen global del reporte a partir de los registros de la corrida (y su `perfil_corrida`)."""
+    timestamp = corrida['timestamp']
+    hora = timestamp.split('_')[1]
+    sites_with_red_diff = sum(1 for p in paginas if p['alert_color'] == 'red')
+    reutilizadas = sum(1 for p in paginas if p['reutilizado'])
+
     global_result_color = 'red' if sites_with_red_diff > 0 else 'green'
-    global_result_text = f'❌ Se encontraron diferencias graves en {sites_with_red_diff} de {len(BASE_URLS_MAP)} urls.' if sites_with_red_diff > 0 else '✅ Todas las URLs pasaron la prueba estructural (no se detectaron diferencias graves).'
+    global_result_text = f'❌ Se encontraron diferencias graves en {sites_with_red_diff} de {len(paginas)} urls.' if sites_with_red_diff > 0 else '✅ Todas las URLs pasaron la prueba estructural (no se detectaron diferencias graves).'
+    if fin is None:
+        tiempo_total = f"⚠️ corrida interrumpida ({len(paginas)} de {corrida['total_paginas']} páginas con resultado)"
+    else:
+        tiempo_total = format_time(fin['tiempo_total_s'])
 
-    html_summary = f"""
-    <p><strong>Versión Testeada:</strong> <code>{version_number}</code></p>
-    <p><strong>Fecha y Hora de Ejecución:</strong> {format_date(timestamp_html)} {timestamp_html.split('_')[1][:2]}:{timestamp_html.split('_')[1][2:4]}:{timestamp_html.split('_')[1][4:6]}</p> 
-    <p><strong>Tiempo Total de Proceso:</strong> {formatted_time_global}</p> 
+    return f"""
+    <p><strong>Versión Testeada:</strong> <code>{corrida['version']}</code></p>
+    <p><strong>Fecha y Hora de Ejecución:</strong> {format_date(timestamp)} {hora[:2]}:{hora[2:4]}:{hora[4:6]}</p> 
+    <p><strong>Tiempo Total de Proceso:</strong> {tiempo_total}</p> 
     <p>
-        <strong>Umbral de Tolerancia:</strong> {UMBRAL_PIXELES_TOLERANCIA} píxeles.
+        <strong>Umbral de Tolerancia:</strong> {corrida['umbral_pixeles']} píxeles.
     </p>
+    <p><strong>Emparejamiento de DIVs:</strong> {'alineación estructural del árbol DOM' if corrida['alineacion_estructural'] else 'por selector CSS exacto'}</p>
+    <p><strong>Modo Incremental:</strong> {f'{reutilizadas} de {len(paginas)} páginas reutilizadas' if corrida['incremental'] else 'deshabilitado'}</p>
+    <p><strong>Red:</strong> {f"{corrida['patrones_bloqueados']} patrones de terceros bloqueados" if corrida['patrones_bloqueados'] else 'sin bloqueo'}{'' if corrida['grabacion'] == 'desactivada' else f" | respuestas propias: {corrida['grabacion']}"}</p>
+    <p><strong>Diferencia Visual por Píxeles:</strong> {f"habilitada (umbral por canal {corrida['umbral_canal']})" if corrida['umbral_canal'] is not None else 'deshabilitada'}</p>
+    <p><strong>Backend de Captura:</strong> {'CDP asíncrono (un Chrome, varias pestañas)' if corrida.get('backend') == 'cdp' else 'Selenium (una sesión por worker)'}{' | V1/V2 pareadas' if corrida.get('pareada') else ''}</p>
+    {render_shards_corrida(corrida)}
+    <p><strong>Perfil:</strong> {format_perfil_corrida(perfil)} <small>(detalle en {os.path.basename(ruta_perfil(corrida['version'], timestamp, corrida.get('shard')))})</small></p>
     <p>
         <strong>Resumen global:</strong> 
         <span style="font-weight: bold; color: {global_result_color}">
@@ -780,10 +3561,230 @@ if __name__ == "__main__":
     </p>
 
     """
+
+def resumir_perfil_pagina(perfil):
+    """Segundos por fase (sumando variantes y repeticiones), bytes por WebDriver y pico acumulado de RSS del proceso al terminar la página."""
+    if not perfil:
+        return None
+    fases = {}
+    for span in perfil['fases']:
+        fases[span['fase']] = fases.get(span['fase'], 0.0) + span['duracion_s']
+    webdriver_bytes = sum(b for b in perfil['webdriver_bytes'].values() if b)
+    return {'fases': fases, 'webdriver_bytes': webdriver_bytes, 'rss_pico_proceso_mb': perfil.get('rss_pico_proceso_mb')}
+
+def perfil_corrida(corrida, fin, paginas):
+    """
+    Perfil de toda la corrida a partir de los resúmenes de `leer_resultados`: fases ordenadas por
+    tiempo total, bytes por WebDriver, pico de RSS del proceso y detalle por página. Las páginas reutilizadas
+    (modo incremental) no suman: sus tiempos son de otra corrida.
+    """
+    fases, detalle = {}, []
+    for pagina in paginas:
+        resumen = pagina['perfil']
+        if pagina['reutilizado'] or not resumen:
+            continue
+        for fase, segundos in resumen['fases'].items():
+            total = fases.setdefault(fase, {'total_s': 0.0, 'max_s': 0.0, 'max_url_id': None})
+            total['total_s'] += segundos
+            if segundos > total['max_s']:
+                total['max_s'], total['max_url_id'] = segundos, pagina['url_id']
+        detalle.append(dict(resumen, url_id=pagina['url_id'], tiempo_s=pagina['tiempo_s']))
+    picos = [d['rss_pico_proceso_mb'] for d in detalle if d['rss_pico_proceso_mb'] is not None]
+    return {
+        'version': corrida['version'],
+        'timestamp': corrida['timestamp'],
+        'tiempo_total_s': fin['tiempo_total_s'] if fin else None,
+        'rss_pico_proceso_mb': max(picos) if picos else None,
+        'webdriver_bytes': sum(d['webdriver_bytes'] for d in detalle),
+        'fases': dict(sorted(fases.items(), key=lambda item: item[1]['total_s'], reverse=True)),
+        'paginas': detalle,
+    }
+
+def format_perfil_corrida(perfil, cantidad_fases=3):
+    """Texto del resumen del reporte: fases más costosas, bytes por WebDriver y pico de RSS del proceso."""
+    if not perfil['paginas']:
+        return "N/A"
+    total = sum(f['total_s'] for f in perfil['fases'].values()) or 1.0
+    fases = ", ".join(f"{fase} {datos['total_s']:.1f}s ({datos['total_s'] / total:.0%})"
+                      for fase, datos in itertools.islice(perfil['fases'].items(), cantidad_fases))
+    rss = f"{perfil['rss_pico_proceso_mb']:.0f} MB" if perfil['rss_pico_proceso_mb'] is not None else "N/A"
+    return f"{fases} | WebDriver: {format_bytes(perfil['webdriver_bytes'])} | RSS pico del proceso: {rss}"
+
+def generar_reporte_desde_resultados(ruta_ndjson):
+    """
+    Arma el reporte HTML (en output_dir) desde el NDJSON de una corrida, terminada o no, y exporta
+    su perfil de tiempos en JSON (ver `ruta_perfil`).
+    Devuelve (ruta del reporte, corrida, cantidad de páginas).
+    """
+    corrida, fin, paginas = leer_resultados(ruta_ndjson)
+    perfil = perfil_corrida(corrida, fin, paginas)
+    _escribir_atomico(ruta_perfil(corrida['version'], corrida['timestamp'], corrida.get('shard')),
+                      json.dumps(perfil, indent=2, ensure_ascii=False).encode('utf-8'))
+    html_file = ruta_reporte(corrida['version'], corrida['timestamp'], corrida.get('shard'))
+    escribir_reporte_html(html_file, cargar_paginas(ruta_ndjson, paginas),
+                          render_resumen_corrida(corrida, fin, paginas, perfil), corrida['version'])
+    return html_file, corrida, len(paginas)
+
+def combinar_resultados(rutas):
+    """
+    Combina los NDJSON de los shards de una corrida (--shard i/N) en el NDJSON de la corrida
+    completa, con las páginas en el orden de la matriz. Los shards pueden haber corrido en otras
+    máquinas: sus capturas tienen que estar ya copiadas en output_dir. Si falta algún shard (o
+    alguno se interrumpió) la corrida combinada queda como interrumpida.
+    Devuelve (ruta del NDJSON combinado, shards faltantes). Lanza ValueError si no son combinables.
+    """
+    shards = {}
+    for ruta in rutas:
+        corrida, fin, paginas = leer_resultados(ruta)
+        if not corrida.get('shard'):
+            raise ValueError(f"'{ruta}' no es el resultado de un shard (--shard).")
+        shard, total = corrida['shard']
+        if shard in shards:
+            raise ValueError(f"El shard {shard} de {total} aparece dos veces ('{shards[shard][0]}' y '{ruta}').")
+        shards[shard] = (ruta, corrida, fin, paginas)
+
+    corridas = [corrida for _, corrida, _, _ in shards.values()]
+    base = corridas[0]
+    for corrida in corridas[1:]:
+        for clave in ('version', 'config', 'total_matriz'):
+            if corrida.get(clave) != base.get(clave):
+                raise ValueError(f"Los shards no son de la misma corrida ('{clave}': {base.get(clave)} / {corrida.get(clave)}).")
+        if corrida['shard'][1] != base['shard'][1]:
+            raise ValueError(f"Los shards no usan la misma cantidad total ({base['shard'][1]} / {corrida['shard'][1]}).")
+
+    total_shards = base['shard'][1]
+    faltantes = sorted(set(range(1, total_shards + 1)) - set(shards))
+    corrida_combinada = dict(base, timestamp=min(c['timestamp'] for c in corridas), total_paginas=base['total_matriz'],
+                             shards=total_shards, shards_faltantes=faltantes)
+    corrida_combinada.pop('shard')
+    corrida_combinada['incremental'] = any(c['incremental'] for c in corridas)
+
+    # (índice de la matriz, ruta, posición): se copian de a una, sin cargar todas las páginas
+    entradas = sorted((pagina['indice'], ruta, pagina['posicion']) for ruta, _, _, paginas in shards.values() for pagina in paginas)
+    for anterior, siguiente in zip(entradas, entradas[1:]):
+        if anterior[0] == siguiente[0]:
+            raise ValueError(f"La entrada {siguiente[0]} de la matriz aparece en más de un shard.")
+
+    finales = [fin for _, _, fin, _ in shards.values()]
+    completa = not faltantes and all(finales)
+    escritor = ResultadosCorrida(ruta_resultados(base['version'], corrida_combinada['timestamp']), corrida_combinada)
+    archivos = {}
+    try:
+        for indice, ruta, posicion in entradas:
+            if ruta not in archivos:
+                archivos[ruta] = open(ruta, 'rb')
+            archivo = archivos[ruta]
+            archivo.seek(posicion)
+            escritor.agregar(indice, json.loads(archivo.readline()))
+    finally:
+        for archivo in archivos.values():
+            archivo.close()
+        # Los shards corren a la vez: la duración de la corrida es la del más lento
+        escritor.cerrar(max(fin['tiempo_total_s'] for fin in finales) if completa else None)
+    return escritor.ruta, faltantes
+
+# ---
+## Reporte HTML (Escritura en Streaming y Fragmentos de Diferencias)
+# ---
+
+# Diferencias por página incluidas en el reporte; el resto se carga a pedido desde un fragmento .js
+REPORTE_FALLAS_INICIALES = 50
+REPORTE_FALLAS_POR_TANDA = 200
+
+CSS_REPORTE = """
+    body { font-family: Arial; background: #f7f7f7; margin: 20px; }
+    h1 { color: #1e3a8a; border-bottom: 3px solid #bfdbfe; padding-bottom: 10px; }
+    h2 { margin-top: 40px; color: #555; border-bottom: 2px solid #ccc; padding-bottom: 5px; }
+    h3, h4 { color: #000; margin-top: 10px; margin-bottom: 5px; font-size: 1em; }
+    code { background-color: #eee; padding: 2px 4px; border-radius: 3px; }
+    details > summary { list-style: none; } 
+    
+    /* Reglas del contenedor para el scroll */
+    .container { 
+        display: flex; 
+        gap: 20px; 
+        margin-bottom: 40px; 
+        align-items: flex-start;
+        border: 1px solid #eee;
+        padding: 10px;
+        background: #fafafa;
+        border-radius: 4px;
+        overflow-x: auto; 
+        overflow-y: hidden; 
+    }
+    .container > div { 
+        flex: 1; 
+        min-width: 480px; 
+    }
+    /* Contenedor de la imagen V2 */
+    div[id^="image-container-"] {
+        position: relative; 
+        border: 1px solid #ddd;
+    }
+    img { 
+        width: 100%; 
+        height: auto;
+        border: 3px solid #ccc; 
+        border-radius: 4px;
+        box-shadow: 2px 2px 5px rgba(0,0,0,0.1);
+        display: block;
+    }
+    
+    /* Estilo de la Flecha Indicadora */
+    .highlight-box {
+        position: absolute;
+        pointer-events: none; 
+        z-index: 1000;
+        opacity: 1; 
+        border-left: 15px solid transparent; 
+        border-right: 15px solid transparent; 
+        border-top: 30px solid #ffcc00; /* Amarillo */
+        transform: translateX(-50%); 
+        filter: drop-shadow(0px 0px 5px rgba(0, 0, 0, 0.5));
+    }
     
-    # INYECCIÓN DEL SCRIPT JAVASCRIPT
-    javascript_code = """
+    /* Estilo para el botón de volver arriba (NUEVO) */
+    #scrollToTopBtn {
+        display: none; 
+        position: fixed;
+        bottom: 20px;
+        right: 30px;
+        z-index: 99;
+        border: none;
+        outline: none;
+        background-color: #1e3a8a; 
+        color: white;
+        cursor: pointer;
+        padding: 15px;
+        border-radius: 50%; 
+        font-size: 18px;
+        line-height: 0; 
+        box-shadow: 0 4px 8px rgba(0,0,0,0.2);
+        transition: background-color 0.3s, opacity 0.3s;
+    }
+    #scrollToTopBtn:hover {
+        background-color: #3b82f6; 
+    }
+    .load-more-btn {
+        margin-top: 10px;
+        padding: 6px 12px;
+        border: 1px solid #1e3a8a;
+        border-radius: 4px;
+        background: #fff;
+        color: #1e3a8a;
+        cursor: pointer;
+    }
+    /* Waterfall del perfil de tiempos */
+    .waterfall { width: 100%; border-collapse: collapse; font-size: 0.85em; margin-top: 10px; background: #fff; }
+    .waterfall th, .waterfall td { border-bottom: 1px solid #eee; padding: 3px 6px; text-align: left; white-space: nowrap; }
+    .waterfall td.num { text-align: right; font-family: monospace; }
+    .waterfall-pista { width: 50%; }
+    .waterfall-barra { height: 10px; border-radius: 2px; }
+"""
+
+JS_REPORTE = """
     <script>
+        const FALLAS_POR_TANDA = __FALLAS_POR_TANDA__;
         let lastHighlightedItem = null;
         const ARROW_HEIGHT = -5; 
 
@@ -810,7 +3811,7 @@ if __name__ == "__main__":
             
             // 5. Calcular la escala 
             const displayedWidth = screenshot.clientWidth;
-            const originalWidth = 1920; 
+            const originalWidth = screenshot.naturalWidth; // Ancho real de la captura (depende del viewport)
             
             if (displayedWidth > 0 && originalWidth > 0) {
                 const scaleFactor = displayedWidth / originalWidth; 
@@ -890,89 +3891,274 @@ if __name__ == "__main__":
         };
         // -----------------------------------------------
 
+        // --- Carga diferida del resto de las diferencias (fragmentos por página) ---
+        window.__regresionFallas = window.__regresionFallas || {};
+        const fallasMostradas = {};
+
+        function mostrarTandaFallas(urlId, boton) {
+            const lista = document.querySelector(`#diff-list-${urlId} ul`);
+            const pendientes = window.__regresionFallas[urlId] || [];
+            const desde = fallasMostradas[urlId] || 0;
+            const tanda = pendientes.slice(desde, desde + FALLAS_POR_TANDA);
+            lista.insertAdjacentHTML('beforeend', tanda.join(''));
+            fallasMostradas[urlId] = desde + tanda.length;
+            const restantes = pendientes.length - fallasMostradas[urlId];
+            if (restantes > 0) {
+                boton.disabled = false;
+                boton.textContent = `Mostrar más diferencias (quedan ${restantes})`;
+            } else {
+                boton.remove();
+            }
+        }
+
+        function cargarMasFallas(urlId, boton) {
+            if (window.__regresionFallas[urlId]) {
+                mostrarTandaFallas(urlId, boton);
+                return;
+            }
+            // <script> en lugar de fetch(): también funciona abriendo el reporte desde file://
+            boton.disabled = true;
+            boton.textContent = 'Cargando...';
+            const script = document.createElement('script');
+            script.src = boton.dataset.fragmento;
+            script.onload = () => mostrarTandaFallas(urlId, boton);
+            script.onerror = () => { boton.textContent = 'No se pudo cargar el detalle de diferencias.'; };
+            document.head.appendChild(script);
+        }
+        // -----------------------------------------------
+
     </script>
+"""
+
+def _detalle_cambio(cambio, coords):
+    """Línea de detalle de un cambio estructurado de una falla."""
+    if cambio.get('mensaje'):
+        return cambio['mensaje']
+    if cambio['tipo'] == 'PÍXELES DISTINTOS':
+        return _formatear_detalle(cambio['tipo'], f"{cambio['diff'] / (coords['width'] * coords['height']):.1%} de la región", 'N/A', f"{cambio['diff']} px")
+    detalle = _formatear_detalle(cambio['tipo'], *("N/A" if valor is None else valor for valor in (cambio['diff'], cambio['v1'], cambio['v2'])))
+    return detalle + f" (+{cambio['internos']} elementos internos)" if cambio.get('internos') else detalle
+
+def detalle_falla_html(f):
+    """Detalle consolidado de una falla (una línea por cambio), armado desde su lista 'cambios'."""
+    coords = f.get('coords_v2', {'x':0, 'y':0, 'width':0, 'height':0})
+    return ("<div style='margin-top: 5px; border-left: 2px solid #ccc; padding-left: 5px;'>"
+            + "<br>".join(_detalle_cambio(cambio, coords) for cambio in f['cambios']) + "</div>")
+
+def render_falla_html(f, i, url_id):
+    """
+    <li> de una falla en la lista de diferencias (clic -> resalta su posición en la captura V2).
+    Los atributos id/class de V2 viajan en la falla ('atributos_v2'), así que no se busca el
+    selector en la estructura: el reporte se arma en tiempo lineal en la cantidad de fallas.
+    El detalle se arma acá desde los cambios estructurados (el NDJSON no guarda HTML).
+    """
+    coords = f.get('coords_v2', {'x':0, 'y':0, 'width':0, 'height':0})
+
+    item_v2_original = f.get('atributos_v2')
+
+    # --- Construcción del selector simplificado ---
+    display_selector = ""
+    if 'VISUAL' in f['tipo']:
+        display_selector = f['selector']
+    elif item_v2_original:
+        if item_v2_original.get('class_attr'):
+            display_selector += f"class={item_v2_original['class_attr'][:50]}"
+
+        if item_v2_original.get('id_attr'):
+            if display_selector:
+                display_selector += " / "
+            display_selector += f"id={item_v2_original['id_attr']}"
+
+        if not display_selector:
+            display_selector = f['selector'].split(' > ')[-1]
+    else:
+         display_selector = f['selector'][:50] + "..."
+    # -----------------------------------------------------------------
+
+    coords_str = f"{int(coords['x'])},{int(coords['y'])},{int(coords['width'])},{int(coords['height'])}"
+
+    # Usar el nuevo campo 'tipo' para determinar el color (DIFERENCIA AGRUPADA GRAVE/MENOR)
+    color = 'red' if 'GRAVE' in f['tipo'] else ('#ff8c00' if 'VISUAL' in f['tipo'] else '#007bff')
+
+    detalle_consolidado = detalle_falla_html(f)
+    tipo_resumen = f['tipo'].replace('AGRUPADA ', '')
+
+    return f"""
+    <li class='diff-item' 
+        style='color: {color}; border-bottom: 1px dotted #ccc; padding: 5px 0; cursor: pointer;'
+        onclick="highlightElement('{url_id}', '{coords_str}', this)"
+        data-coords="{coords_str}"
+        data-selector="{f['selector']}"
+        data-id="item-{url_id}-{i}"
+        >
+        <span style="font-weight: bold;">Elemento:</span> <code>{display_selector}</code> 
+        <br><span style="font-weight: bold;">Resultado Agrupado:</span> <span style='color:{color};'>{tipo_resumen}</span>
+        {detalle_consolidado}
+    </li>
+    """
+
+def escribir_fallas_html(fallas, url_id, nombre_fragmento):
+    """
+    Arma la lista de diferencias de una página. Las primeras REPORTE_FALLAS_INICIALES van en el
+    reporte; las demás se escriben de a una (sin juntarlas en memoria) en `nombre_fragmento`
+    (relativo a output_dir), que el reporte carga recién cuando se piden más.
+    Devuelve (html de la lista, nombre del fragmento o None si no hizo falta).
+    """
+    items_iniciales = []
+    fragmento = None
+    restantes = 0
+    try:
+        for i, f in enumerate(fallas):
+            item = render_falla_html(f, i, url_id)
+            if i < REPORTE_FALLAS_INICIALES:
+                items_iniciales.append(item)
+                continue
+            if fragmento is None:
+                os.makedirs(os.path.dirname(os.path.join(output_dir, nombre_fragmento)), exist_ok=True)
+                fragmento = open(os.path.join(output_dir, nombre_fragmento), 'w', encoding='utf-8')
+                fragmento.write(f"window.__regresionFallas = window.__regresionFallas || {{}};\nwindow.__regresionFallas[{json.dumps(url_id)}] = [\n")
+            fragmento.write(("," if restantes else "") + json.dumps(item) + "\n")
+            restantes += 1
+    finally:
+        if fragmento is not None:
+            fragmento.write("];\n")
+            fragmento.close()
+
+    html = "<ul>" + "".join(items_iniciales)
+    if not fallas:
+         html += "<li>✅ No se encontraron diferencias.</li>"
+    html += "</ul>"
+    if restantes:
+        html += (f"<button class='load-more-btn' data-fragmento='{nombre_fragmento}' onclick=\"cargarMasFallas('{url_id}', this)\">"
+                 f"Mostrar más diferencias (quedan {restantes})</button>")
+    return html, (nombre_fragmento if restantes else None)
+
+# Color de la barra del waterfall por etapa
+COLORES_ETAPAS = {'V1': '#60a5fa', 'V2': '#a78bfa', 'Comparación': '#f59e0b'}
+
+def render_perfil_html(perfil):
+    """Tabla waterfall de las fases de una página (capturas V1/V2 en paralelo y procesamiento)."""
+    if not perfil or not perfil['fases']:
+        return "<p>Sin fases medidas.</p>"
+    fases = sorted(perfil['fases'], key=lambda span: span['inicio'])
+    inicio = fases[0]['inicio']
+    total = max(span['inicio'] + span['duracion_s'] for span in fases) - inicio or 1.0
+
+    filas = []
+    for span in fases:
+        desplazamiento = span['inicio'] - inicio
+        filas.append(f"""
+            <tr>
+                <td>{span['etapa']}</td><td>{span['fase']}</td>
+                <td class='num'>+{desplazamiento:.2f}s</td><td class='num'>{span['duracion_s']:.2f}s</td>
+                <td class='num'>{format_bytes(span['bytes']) if 'bytes' in span else ''}</td>
+                <td class='waterfall-pista'><div class='waterfall-barra' style='margin-left: {desplazamiento / total:.2%}; width: {max(span['duracion_s'] / total, 0.002):.2%}; background: {COLORES_ETAPAS.get(span['etapa'], '#9ca3af')};'></div></td>
+            </tr>""")
+    rss = f"{perfil['rss_pico_proceso_mb']:.0f} MB" if perfil.get('rss_pico_proceso_mb') is not None else "N/A"
+    return f"""
+        <p><strong>WebDriver:</strong> {' | '.join(f"{v}: {format_bytes(perfil['webdriver_bytes'].get(v))}" for v in ('V1', 'V2'))}
+           &nbsp; <strong>RSS pico acumulado del proceso (hasta esta página):</strong> {rss}</p>
+        <table class='waterfall'>
+            <tr><th>Etapa</th><th>Fase</th><th>Inicio</th><th>Duración</th><th>WebDriver</th><th>0s — {total:.1f}s</th></tr>
+            {''.join(filas)}
+        </table>
+    """
+
+def render_seccion_pagina(data, nombre_fragmento):
+    """
+    Bloque del reporte de una página (resumen, lista de diferencias y contexto visual).
+    Las diferencias que no entran en el reporte se escriben en `nombre_fragmento`.
+    """
+    fallas_html_detalle, _ = escribir_fallas_html(data['fallas'], data['url_id'], nombre_fragmento)
+    display_name = data.get('description', data['base_url']) 
+    if data.get('viewport'):
+        display_name += f" <small style='color: #666;'>({format_viewport(data['viewport'])})</small>"
+
+    if data['alert_color'] == 'red':
+        result_summary_text = f"❌ Se detectaron {data['diff_count']} diferencias graves."
+        result_color_style = "red"
+    else:
+        result_summary_text = "✅ No se encontraron diferencias graves."
+        result_color_style = "green"
+
+
+    result_summary = f"""
+    <p><strong>URL Base (V1):</strong> <code>{data['url1']}</code></p>
+    <p><strong>URL Comparada (V2):</strong> <code>{data['url2']}</code></p>
+    <p>
+        <strong>Resultado:</strong> 
+        <span style="font-weight: bold; color: {result_color_style}">
+        {result_summary_text}
+        </span>
+    </p>
+    {f"<p><strong>Diferencias Visuales:</strong> <span style='color: #ff8c00;'>🟠 {data['diff_visual_count']} regiones con píxeles distintos</span></p>" if data['diff_visual_count'] else ""}
+    <p><strong>Teselas:</strong> {format_resumen_teselas(data['teselas'])}</p> 
+    <p><strong>Tiempo de Ejecución:</strong> {format_time(data['tiempo_s'])}</p> 
+    <p><strong>Tiempo de Navegación:</strong> {format_segundos_variantes(data['navegacion'])}</p> 
+    {f"<p><strong>Resultado:</strong> ♻️ reutilizado de la corrida V{data['reutilizado']['version']} del {data['reutilizado']['fecha']} (V1 y V2 sirven los mismos bundles).</p>" if data.get('reutilizado') else ""}
+    {"<p><strong>Captura V2:</strong> ♻️ reutilizada de la caché de base (sandbox sin cambios).</p>" if data['v2_desde_cache'] else ""}
+    <p><strong>Tiempo de Estabilización:</strong> {format_estabilizacion(data['estabilizacion'])}</p> 
+    """
+
+    return f"""
+    <div style="border: 2px solid #ddd; padding: 15px; margin-top: 20px; border-radius: 8px;">
+        <h2>{display_name}</h2>
+        {result_summary}
+
+        <details>
+            <summary style="cursor: pointer; font-weight: bold; color: #1e3a8a; display: flex; align-items: center;">
+                Detalle de diferencias (Rojo: Grave, Azul: Desplazamiento Menor, Naranja: Diferencia Visual)
+                <span class="arrow-icon" style="font-size: 1.2em; margin-left: 10px; transition: transform 0.2s; display: inline-block;">&#9660;</span>
+            </summary>
+            <div id="diff-list-{data['url_id']}" class="diff-container" style="margin-top: 10px; background: #fff; padding: 10px; border: 1px solid #eee;">
+                {fallas_html_detalle}
+            </div>
+        </details>
+
+        <details>
+            <summary style="cursor: pointer; font-weight: bold; color: #1e3a8a; display: flex; align-items: center;">
+                Perfil de Tiempos (Waterfall)
+                <span class="arrow-icon" style="font-size: 1.2em; margin-left: 10px; transition: transform 0.2s; display: inline-block;">&#9660;</span>
+            </summary>
+            {render_perfil_html(data.get('perfil'))}
+        </details>
+
+        <details>
+            <summary style="cursor: pointer; font-weight: bold; color: #1e3a8a; display: flex; align-items: center;">
+                Contexto Visual
+                <span class="arrow-icon" style="font-size: 1.2em; margin-left: 10px; transition: transform 0.2s; display: inline-block;">&#9660;</span>
+            </summary>
+        <div class='container' id='container-{data['url_id']}'>
+            <div>
+                <h4>Versión No Promovida(V1)</h4>
+                <img src='{data['filename2_diff']}' alt='Versión 1' loading='lazy'>
+            </div>
+            <div id="image-container-{data['url_id']}" style="position: relative;">
+                <h4>Versión Promovida (V2) - Diferencias graves (Rojo) o menores (Azul)</h4>
+                <img id="screenshot-{data['url_id']}" src='{data['filename1']}' alt='Versión 2 (Diferencias)' loading='lazy'>
+                <div id="highlight-box-{data['url_id']}" class="highlight-box" style="display: none;"></div>
+            </div>
+        </div>
+        </details>
+
+    </div>
     """
 
-    html = f"""
+def escribir_reporte_html(html_file, resultados, html_summary, version_number):
+    """
+    Escribe el reporte directamente en disco, página por página, sin armar el documento completo
+    en memoria. Cada página aporta solo su resumen y las primeras diferencias (ver `escribir_fallas_html`);
+    `resultados` puede ser un generador (p. ej. `cargar_paginas`).
+    """
+    # Fragmentos de diferencias en un directorio propio del reporte (relativo a output_dir)
+    directorio_fragmentos = "fallas/" + os.path.splitext(os.path.basename(html_file))[0]
+    with open(html_file, "w", encoding="utf-8") as f:
+        f.write(f"""
     <html>
     <head>
     <meta charset="utf-8">
     <title>Reporte de Regresión Desktop - Sbx Versión {version_number}</title>
-    <style>
-    body {{ font-family: Arial; background: #f7f7f7; margin: 20px; }}
-    h1 {{ color: #1e3a8a; border-bottom: 3px solid #bfdbfe; padding-bottom: 10px; }}
-    h2 {{ margin-top: 40px; color: #555; border-bottom: 2px solid #ccc; padding-bottom: 5px; }}
-    h3, h4 {{ color: #000; margin-top: 10px; margin-bottom: 5px; font-size: 1em; }}
-    code {{ background-color: #eee; padding: 2px 4px; border-radius: 3px; }}
-    details > summary {{ list-style: none; }} 
-    
-    /* Reglas del contenedor para el scroll */
-    .container {{ 
-        display: flex; 
-        gap: 20px; 
-        margin-bottom: 40px; 
-        align-items: flex-start;
-        border: 1px solid #eee;
-        padding: 10px;
-        background: #fafafa;
-        border-radius: 4px;
-        overflow-x: auto; 
-        overflow-y: hidden; 
-    }}
-    .container > div {{ 
-        flex: 1; 
-        min-width: 480px; 
-    }}
-    /* Contenedor de la imagen V2 */
-    div[id^="image-container-"] {{
-        position: relative; 
-        border: 1px solid #ddd;
-    }}
-    img {{ 
-        width: 100%; 
-        height: auto;
-        border: 3px solid #ccc; 
-        border-radius: 4px;
-        box-shadow: 2px 2px 5px rgba(0,0,0,0.1);
-        display: block;
-    }}
-    
-    /* Estilo de la Flecha Indicadora */
-    .highlight-box {{
-        position: absolute;
-        pointer-events: none; 
-        z-index: 1000;
-        opacity: 1; 
-        border-left: 15px solid transparent; 
-        border-right: 15px solid transparent; 
-        border-top: 30px solid #ffcc00; /* Amarillo */
-        transform: translateX(-50%); 
-        filter: drop-shadow(0px 0px 5px rgba(0, 0, 0, 0.5));
-    }}
-    
-    /* Estilo para el botón de volver arriba (NUEVO) */
-    #scrollToTopBtn {{
-        display: none; 
-        position: fixed;
-        bottom: 20px;
-        right: 30px;
-        z-index: 99;
-        border: none;
-        outline: none;
-        background-color: #1e3a8a; 
-        color: white;
-        cursor: pointer;
-        padding: 15px;
-        border-radius: 50%; 
-        font-size: 18px;
-        line-height: 0; 
-        box-shadow: 0 4px 8px rgba(0,0,0,0.2);
-        transition: background-color 0.3s, opacity 0.3s;
-    }}
-    #scrollToTopBtn:hover {{
-        background-color: #3b82f6; 
-    }}
-    </style>
+    <style>{CSS_REPORTE}    </style>
     </head>
     <body>
     <h1>Reporte de Regresión - Desktop Sbx - Versión {version_number}</h1>
@@ -980,22 +4166,224 @@ if __name__ == "__main__":
     <hr style="margin-top: 20px; margin-bottom: 20px;"/>
     
     <div id="report-details-container">
-        {all_details_html}
+""")
+        for data in resultados:
+            f.write(render_seccion_pagina(data, f"{directorio_fragmentos}/{data['url_id']}.js"))
+
+        f.write(f"""
     </div>
     
     <button id="scrollToTopBtn" title="Ir Arriba">↑</button> 
     
-    {javascript_code}  
+    {JS_REPORTE.replace('__FALLAS_POR_TANDA__', str(REPORTE_FALLAS_POR_TANDA))}  
     
     </body>
     </html>
-    """
+    """)
+
+# === SCRIPT PRINCIPAL ===
+
+if __name__ == "__main__":
     
-    with open(html_file, "w", encoding="utf-8") as f:
-        f.write(html)
+    # 2. MANEJO DE ARGUMENTOS DE LÍNEA DE COMANDOS (Recibe la versión)
+    
+    parser = argparse.ArgumentParser(description="Regresión visual estructural (DOM) - TN Desktop SBX.")
+    parser.add_argument('version_number', nargs='?', help="Número de versión a testear (Ej: 170)")
+    parser.add_argument('--config', default=ARCHIVO_PAGINAS,
+                        help=f"Matriz de páginas a testear en JSON (por defecto {ARCHIVO_PAGINAS}).")
+    parser.add_argument('--plantilla', nargs='+', default=None, metavar='TIPO',
+                        help="Probar solo las páginas de estas plantillas (Ej: article home).")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS_CHROME,
+                        help=f"Cantidad de navegadores Chrome en paralelo (por defecto {MAX_WORKERS_CHROME}).")
+    parser.add_argument('--backend', choices=BACKENDS_CAPTURA, default=BACKEND_CAPTURA,
+                        help="Backend de captura: 'selenium' (una sesión por worker) o 'cdp' (un Chrome, varias pestañas asíncronas; requiere websockets).")
+    parser.add_argument('--pareada', action='store_true',
+                        help="Capturar V1 y V2 a la vez en dos pestañas del mismo Chrome (requiere --backend cdp).")
+    parser.add_argument('--recarga', choices=MODOS_RECARGA, default=MODO_RECARGA,
+                        help="Modo de navegación: una sola carga, recarga con caché caliente o sin caché (CDP).")
+    parser.add_argument('--sin-cache-base', action='store_true',
+                        help="No reutilizar ni guardar capturas base (V2) en la caché persistente.")
+    parser.add_argument('--formato-marcada', choices=FORMATOS_CAPTURA_MARCADA, default=FORMATO_CAPTURA_MARCADA,
+                        help="Formato de la captura V2 marcada en el reporte (png sin pérdida, webp o avif).")
+    parser.add_argument('--compresion-png', type=int, choices=range(10), default=PNG_NIVEL_COMPRESION, metavar='0-9',
+                        help=f"Nivel de compresión PNG de la captura marcada (por defecto {PNG_NIVEL_COMPRESION}).")
+    parser.add_argument('--alineacion-por-selector', action='store_true',
+                        help="Emparejar DIVs por selector exacto (comportamiento anterior) en lugar de alinear los árboles.")
+    parser.add_argument('--sin-neutralizacion', action='store_true',
+                        help="No inyectar la neutralización de popups; limpiar con barridos completos de la página.")
+    parser.add_argument('--reservar-ads', action='store_true',
+                        help="Reservar cajas de tamaño fijo para los contenedores de anuncios (layout determinista).")
+    parser.add_argument('--sin-bloqueo-red', action='store_true',
+                        help="No bloquear anuncios, trackers, players ni fuentes de terceros.")
+    parser.add_argument('--grabacion', choices=MODOS_GRABACION, default=MODO_GRABACION,
+                        help="Grabar las respuestas propias en disco o reproducirlas (corrida offline).")
+    parser.add_argument('--sin-snapshots', action='store_true',
+                        help="No guardar el snapshot binario de la estructura DOM junto a cada captura.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Probar solo las páginas cuyas variantes V1 y V2 sirven bundles distintos; el resto reutiliza su último resultado.")
+    parser.add_argument('--sin-diff-pixeles', action='store_true',
+                        help="Comparar solo la geometría DOM, sin la diferencia visual por píxeles.")
+    parser.add_argument('--umbral-canal', type=int, default=DIFF_PIXELES_UMBRAL_CANAL, metavar='0-255',
+                        help=f"Diferencia mínima por canal para contar un píxel como cambiado (por defecto {DIFF_PIXELES_UMBRAL_CANAL}).")
+    parser.add_argument('--captura', choices=MODOS_CAPTURA, default=MODO_CAPTURA,
+                        help=f"Modo de captura: 'teselas' escribe el PNG por filas en disco; 'auto' lo usa en páginas de más de {ALTURA_MAX_CAPTURA_COMPLETA}px.")
+    parser.add_argument('--todas', action='store_true',
+                        help="Probar también las páginas inactivas de la matriz (\"activa\": false).")
+    parser.add_argument('--shard', type=parsear_shard, default=None, metavar='i/N',
+                        help="Probar solo la parte i de N de la matriz (Ej: 2/4), para repartir la corrida entre máquinas.")
+    parser.add_argument('--combinar', nargs='+', default=None, metavar='RESULTADOS.ndjson',
+                        help="Combinar los resultados de los shards de una corrida en un único reporte, sin volver a capturar.")
+    parser.add_argument('--reporte', default=None, metavar='RESULTADOS.ndjson',
+                        help="Regenerar el reporte HTML desde los resultados de una corrida (terminada o interrumpida), sin volver a capturar.")
+    args = parser.parse_args()
+
+    if args.combinar:
+        try:
+            ruta_combinada, faltantes = combinar_resultados(args.combinar)
+            html_file, corrida, cantidad = generar_reporte_desde_resultados(ruta_combinada)
+        except (OSError, ValueError) as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+        if faltantes:
+            print(f"⚠️ Faltan los resultados de los shards {', '.join(map(str, faltantes))} de {corrida['shards']}: el reporte queda parcial.")
+        print(f"🧾 Resultados combinados ({cantidad} páginas de {len(args.combinar)} shards) en: {ruta_combinada}")
+        print(f"📄 Reporte de la versión {corrida['version']} generado en: {html_file}")
+        sys.exit(0)
+
+    if args.reporte:
+        try:
+            html_file, corrida, cantidad = generar_reporte_desde_resultados(args.reporte)
+        except (OSError, ValueError) as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+        print(f"📄 Reporte de la versión {corrida['version']} ({cantidad} páginas) regenerado en: {html_file}")
+        sys.exit(0)
+
+    if not args.version_number:
+        print("\n❌ ERROR: Debe proporcionar el número de versión como argumento.")
+        print("Uso: python regre_visual_tn_desk_sbx.py [NUMERO_DE_VERSION] [--workers N]")
+        print("      python regre_visual_tn_desk_sbx.py --reporte [RESULTADOS.ndjson]")
+        print("      python regre_visual_tn_desk_sbx.py --combinar [RESULTADOS_shard*.ndjson ...]")
+        print("Ejemplo: python regre_visual_tn_desk_sbx.py 170 --workers 4")
+        sys.exit(1)
+
+    version_number = args.version_number
+    
+    try:
+        if not version_number.isdigit() or not version_number:
+            raise ValueError("El argumento de versión debe ser numérico y no puede estar vacío.")
+        if args.workers < 1:
+            raise ValueError("La cantidad de workers debe ser mayor o igual a 1.")
+        if args.backend == 'cdp' and websockets is None:
+            raise ValueError("El backend 'cdp' requiere el paquete websockets (pip install websockets).")
+        if args.pareada and args.backend != 'cdp':
+            raise ValueError("La captura pareada (--pareada) requiere el backend 'cdp'.")
+        if args.backend == 'cdp' and args.grabacion != 'desactivada':
+            raise ValueError("La grabación/reproducción de respuestas solo está disponible con el backend 'selenium'.")
+    except ValueError as e:
+        print(f"❌ Error: {e}")
+        sys.exit(1)
+        
+    # --- FIN DE MANEJO DEL ARGUMENTO ---
+
+    MODO_RECARGA = args.recarga
+    BACKEND_CAPTURA = args.backend
+    CAPTURA_PAREADA = args.pareada
+    ALINEACION_ESTRUCTURAL = not args.alineacion_por_selector
+    CACHE_BASE_HABILITADA = not args.sin_cache_base
+    FORMATO_CAPTURA_MARCADA = args.formato_marcada
+    PNG_NIVEL_COMPRESION = args.compresion_png
+    MODO_CAPTURA = args.captura
+    DIFF_PIXELES_HABILITADO = not args.sin_diff_pixeles
+    NEUTRALIZACION_INYECTADA = not args.sin_neutralizacion
+    RESERVAR_CAJAS_ADS = args.reservar_ads
+    BLOQUEO_RED_HABILITADO = not args.sin_bloqueo_red
+    MODO_GRABACION = args.grabacion
+    MODO_INCREMENTAL = args.incremental
+    SNAPSHOTS_DOM_HABILITADOS = not args.sin_snapshots
+    DIFF_PIXELES_UMBRAL_CANAL = args.umbral_canal
+
+    # GENERAR TIMESTAMP ÚNICO PARA ESTA EJECUCIÓN
+    TIMESTAMP_EJECUCION = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    start_time_global = time.time()
+
+    print(f"\n INICIANDO PROCESO DE REGRESIÓN DESKTOP - SBX VERSIÓN {version_number}\n ")    
+    if BACKEND_CAPTURA == 'cdp':
+        modo_pestanas = f"{args.workers} par(es) V1/V2 de pestañas" if CAPTURA_PAREADA else f"{args.workers} pestaña(s)"
+        print(f" Ejecutando capturas con {modo_pestanas} asíncronas en un solo Chrome vía CDP (modo de recarga: {MODO_RECARGA}).\n")
+    else:
+        print(f" Ejecutando capturas con {args.workers} navegador(es) Chrome en paralelo (modo de recarga: {MODO_RECARGA}).\n")
+    
+    # 3. PLANIFICAR Y EJECUTAR LAS CAPTURAS V1/V2 DE TODA LA MATRIZ (PÁGINA × VIEWPORT)
+    try:
+        paginas = cargar_matriz_paginas(args.config, version_number, args.plantilla, args.todas)
+    except ValueError as e:
+        print(f"❌ Error: {e}")
+        sys.exit(1)
+    if not paginas:
+        print(f"❌ Error: la matriz '{args.config}' no tiene páginas activas para probar.")
+        sys.exit(1)
+    print(f" Matriz: {len(paginas)} combinaciones página × viewport desde '{args.config}'.\n")
+
+    # Con --shard se prueba solo una parte; los resultados se guardan con el índice en la matriz COMPLETA
+    total_matriz = len(paginas)
+    indices_matriz = seleccionar_shard(paginas, *args.shard) if args.shard else list(range(total_matriz))
+    paginas = [paginas[idx] for idx in indices_matriz]
+    if args.shard:
+        print(f" Shard {args.shard[0]} de {args.shard[1]}: {len(paginas)} de {total_matriz} combinaciones.\n")
+        if not paginas:
+            print(" No hay páginas para este shard.")
+
+    historial = HistorialResultados()
+    if MODO_INCREMENTAL:
+        print(" Modo incremental: comparando los bundles servidos por V1 y V2 de cada página...")
+        indices_a_probar, reutilizados = planificar_incremental(paginas, historial, args.workers)
+        print(f" Se probarán {len(indices_a_probar)} de {len(paginas)} páginas.\n")
+    else:
+        indices_a_probar, reutilizados = list(range(len(paginas))), {}
+    paginas_a_probar = [paginas[idx] for idx in indices_a_probar]
+
+    # Resultados por página en NDJSON, escritos apenas termina cada una (el reporte se arma desde ahí)
+    resultados_corrida = ResultadosCorrida(ruta_resultados(version_number, TIMESTAMP_EJECUCION, args.shard), {
+        'version': version_number,
+        'timestamp': TIMESTAMP_EJECUCION,
+        'config': args.config,
+        'total_paginas': len(paginas),
+        'total_matriz': total_matriz,
+        'shard': args.shard,
+        'umbral_pixeles': UMBRAL_PIXELES_TOLERANCIA,
+        'alineacion_estructural': ALINEACION_ESTRUCTURAL,
+        'incremental': MODO_INCREMENTAL,
+        'patrones_bloqueados': len(PATRONES_BLOQUEADOS) if BLOQUEO_RED_HABILITADO else 0,
+        'grabacion': MODO_GRABACION,
+        'backend': BACKEND_CAPTURA,
+        'pareada': CAPTURA_PAREADA,
+        'umbral_canal': DIFF_PIXELES_UMBRAL_CANAL if DIFF_PIXELES_HABILITADO else None,
+    })
+    for idx, resultado in reutilizados.items():
+        resultados_corrida.agregar(indices_matriz[idx], resultado)
+
+    def procesar_y_registrar(idx, pagina, captura_v1, captura_v2):
+        resultado = procesar_resultado_pagina(idx, len(paginas_a_probar), pagina, captura_v1, captura_v2, version_number, TIMESTAMP_EJECUCION)
+        resultados_corrida.agregar(indices_matriz[indices_a_probar[idx]], resultado)
+        historial.guardar(resultado, version_number, pagina.get('huellas'))
+
+    # 4. GENERAR REPORTE HTML FINAL (también si la corrida se interrumpe, con las páginas ya terminadas)
+    corrida_completa = False
+    try:
+        ejecutar_capturas_en_paralelo(paginas_a_probar, args.workers, procesar_y_registrar)
+        corrida_completa = True
+    finally:
+        resultados_corrida.cerrar(time.time() - start_time_global if corrida_completa else None)
+        html_file, _, _ = generar_reporte_desde_resultados(resultados_corrida.ruta)
+        if not corrida_completa:
+            print(f"\n⚠️ Corrida interrumpida. Reporte parcial en: {html_file}")
 
     print(f"\n==================================================================================")
     print(f"✅ Proceso de regresión visual completado.")
     print(f"📄 Reporte generado en: {html_file}")
+    print(f"🧾 Resultados por página en: {resultados_corrida.ruta}")
+    print(f"⏱️ Perfil de tiempos en: {ruta_perfil(version_number, TIMESTAMP_EJECUCION, args.shard)}")
 
     print(f"==================================================================================")